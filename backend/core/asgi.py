@@ -3,43 +3,104 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 import django
 django.setup()
 
+import asyncio
+from urllib.parse import parse_qs
+
 from django.core.asgi import get_asgi_application
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.contrib.auth.models import AnonymousUser
 from channels.db import database_sync_to_async
+from ninja_jwt.authentication import JWTBaseAuthentication
+from ninja_jwt.exceptions import InvalidToken
+from ninja_jwt.settings import api_settings
 from modules.rooms.router import websocket_urlpatterns
+from modules.rooms.pipeline import message_writer
 from modules.users.models import User
+from modules.users.presence import presence
+from modules.users.revocation import ws_users
 
 class JWTAuthMiddleware:
+    """
+    Responsável por autenticar o handshake do websocket a partir do token de
+    acesso enviado no parâmetro `token` da query string.
+
+    O token é validado localmente (assinatura, expiração e claims) e o usuário
+    é mantido em um cache curto, chaveado por (user_id, jti), para que
+    reconexões em massa não virem uma consulta ao banco por socket. Buscas
+    simultâneas pela mesma chave compartilham a mesma consulta.
+
+    O `jti` do token fica em `scope['token_jti']`; a revogação posterior
+    (usuário desativado, token na blacklist) é tratada por
+    modules.users.revocation.
+    """
+
     def __init__(self, inner):
         self.inner = inner
+        self.users = ws_users
+        self._loading = {}
 
     async def __call__(self, scope, receive, send):
-        query_string = scope.get('query_string', b'').decode()
-        params = dict(pair.split('=') for pair in query_string.split('&') if '=' in pair)
-        user_id_str = params.get("user_id", "0")
+        params = parse_qs(scope.get('query_string', b'').decode())
+        token = params.get('token', [None])[0]
 
-        try:
-            user_id = int(user_id_str)
-        except ValueError:
-            user_id = 0
-
-        if user_id:
-            # Busca usuário no banco de forma assíncrona, captura exceção caso não exista
-            try:
-                user = await database_sync_to_async(User.objects.get)(id=user_id)
-            except User.DoesNotExist:
-                user = AnonymousUser()
-        else:
-            user = AnonymousUser()
-
-        scope['user'] = user
+        scope['user'], scope['token_jti'] = (
+            await self.get_user(token) if token else (AnonymousUser(), None)
+        )
         return await self.inner(scope, receive, send)
 
+    async def get_user(self, raw_token):
+        try:
+            validated_token = JWTBaseAuthentication.get_validated_token(raw_token)
+            key = (
+                validated_token[api_settings.USER_ID_CLAIM],
+                validated_token[api_settings.JTI_CLAIM],
+            )
+        except (InvalidToken, KeyError):
+            return AnonymousUser(), None
+
+        user = self.users.get(key)
+        if user is not None:
+            return user, key[1]
+
+        loading = self._loading.get(key)
+        if loading is None:
+            loading = asyncio.ensure_future(self.load_user(key[0]))
+            self._loading[key] = loading
+            loading.add_done_callback(lambda _: self._loading.pop(key, None))
+        user = await asyncio.shield(loading)
+
+        if user.is_authenticated:
+            self.users.set(key, user)
+            return user, key[1]
+        return user, None
+
+    @database_sync_to_async
+    def load_user(self, user_id):
+        user = User.objects.filter(**{api_settings.USER_ID_FIELD: user_id}).first()
+        if user is None or not user.is_active:
+            return AnonymousUser()
+        return user
+
+
+async def lifespan(scope, receive, send):
+    # Servidores com suporte a lifespan (ex.: uvicorn) avisam o desligamento,
+    # permitindo persistir as mensagens pendentes do write-behind e marcar
+    # como offline os usuários conectados a este processo.
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await message_writer.drain()
+            await presence.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
 
 application = ProtocolTypeRouter({
     "http": get_asgi_application(),
     "websocket": JWTAuthMiddleware(
         URLRouter(websocket_urlpatterns)
     ),
+    "lifespan": lifespan,
 })
@@ -0,0 +1,381 @@
+"""
+Responsável pelas camadas de canal (channel layers) do Channels usadas pelo chat.
+
+- LocalChannelLayer: camada em memória do processo, com tabelas de grupos
+  particionadas (shards) e fila limitada por canal com política de estouro
+  explícita. Serve para implantações de um único processo.
+- HybridChannelLayer: entrega localmente aos membros do grupo que estão no
+  próprio processo e só usa a camada remota (Redis) quando outro nó também
+  possui membros no grupo, ou quando o processo não tem membros nele.
+"""
+
+import asyncio
+import logging
+import time
+import uuid
+from collections import defaultdict
+from typing import Dict, Set
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+RAISE = 'raise'
+
+
+class LocalChannelLayer(BaseChannelLayer):
+    """
+    Camada de canal em memória do processo.
+
+    Cada canal tem uma fila limitada a `capacity` mensagens (ou ao valor de
+    `channel_capacity` que casar com o nome). Quando a fila está cheia, a
+    política `overflow` decide o que acontece:
+
+    - drop_oldest: descarta a mensagem mais antiga da fila e enfileira a nova;
+    - drop_newest: descarta a nova mensagem (padrão);
+    - raise: `send` lança ChannelFull (`group_send` ignora o canal cheio,
+      como nas demais camadas do Channels).
+
+    Toda mensagem descartada conta em `dropped` e gera um aviso no log com o
+    canal e o tipo do evento.
+
+    Os grupos ficam distribuídos em `shards` tabelas pelo hash do nome, de
+    modo que a limpeza de membros expirados percorre apenas a partição do
+    grupo enviado.
+    """
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        shards=16,
+        overflow=DROP_NEWEST,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity)
+        if overflow not in (DROP_OLDEST, DROP_NEWEST, RAISE):
+            raise ValueError(f'Invalid overflow policy: {overflow}')
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.group_expiry = group_expiry
+        self.overflow = overflow
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self.channels: Dict[str, asyncio.Queue] = {}
+        self.shards = [dict() for _ in range(shards)]
+        self.dropped = 0
+
+    def _shard(self, group):
+        return self.shards[hash(group) % len(self.shards)]
+
+    def _queue(self, channel):
+        queue = self.channels.get(channel)
+        if queue is None:
+            queue = self.channels[channel] = asyncio.Queue(maxsize=self.get_capacity(channel))
+        return queue
+
+    def _put(self, channel, message, *, raise_on_full):
+        queue = self._queue(channel)
+        item = (time.monotonic() + self.expiry, message)
+        if queue.full():
+            if self.overflow == RAISE and raise_on_full:
+                raise ChannelFull(channel)
+            if self.overflow == DROP_OLDEST:
+                _, dropped = queue.get_nowait()
+            else:
+                dropped = message
+            self.dropped += 1
+            logger.warning(
+                'Channel %s is full; dropped a %r message (%d dropped so far)',
+                channel, dropped.get('type'), self.dropped,
+            )
+            if dropped is message:
+                return
+        queue.put_nowait(item)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        assert '__asgi_channel__' not in message
+        self._put(channel, message, raise_on_full=True)
+
+    async def receive(self, channel):
+        self.require_valid_channel_name(channel)
+        queue = self._queue(channel)
+        try:
+            while True:
+                expires_at, message = await queue.get()
+                if expires_at >= time.monotonic():
+                    return message
+        finally:
+            if queue.empty() and self.channels.get(channel) is queue:
+                del self.channels[channel]
+
+    async def new_channel(self, prefix='specific.'):
+        return f'{prefix}{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def flush(self):
+        self.channels = {}
+        self.shards = [dict() for _ in self.shards]
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        shard = self._shard(group)
+        shard.setdefault(group, {})[channel] = time.monotonic() + self.group_expiry
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        shard = self._shard(group)
+        members = shard.get(group)
+        if members is not None:
+            members.pop(channel, None)
+            if not members:
+                del shard[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        for channel in self.group_channels(group):
+            self._put(channel, message, raise_on_full=False)
+
+    def group_channels(self, group):
+        """
+        Retorna os canais locais do grupo, removendo os membros expirados.
+        """
+        shard = self._shard(group)
+        members = shard.get(group)
+        if not members:
+            return []
+        now = time.monotonic()
+        expired = [channel for channel, expires_at in members.items() if expires_at < now]
+        for channel in expired:
+            del members[channel]
+        if not members:
+            del shard[group]
+        return list(members)
+
+
+class HybridChannelLayer(LocalChannelLayer):
+    """
+    Camada local com repasse para uma camada remota (ex.: RedisChannelLayer).
+
+    Os canais deste processo recebem nomes `hybrid.<nó>!<id>` e são sempre
+    entregues pela fila local. Na camada remota, o processo é representado
+    por um único canal (`hybrid.node.<nó>`), inscrito nos grupos em que há
+    membros locais. Ao entrar em um grupo o nó se anuncia aos demais; assim
+    cada nó sabe quais grupos têm membros em outros nós, e um `group_send`
+    cujo grupo só tem membros locais não faz nenhuma ida à camada remota.
+
+    Um nó sem membros locais no grupo não recebe esses anúncios, então seu
+    `group_send` vai sempre para a camada remota (ex.: envios de outro worker,
+    do admin ou de um comando de gerenciamento).
+
+    O anúncio é assíncrono: durante a ida e volta da camada remota após a
+    entrada de um nó em um grupo, envios de outros nós podem não alcançá-lo.
+    Os consumers cobrem essa janela carregando o histórico depois do
+    `group_add`.
+
+    Cada nó envia um `hybrid.heartbeat` ao grupo `hybrid.nodes` a cada
+    `heartbeat` segundos. Um nó que morre sem anunciar a saída deixa de ser
+    destino dos envios quando passa `node_ttl` segundos sem dar notícias.
+
+    `remote` é a configuração da camada remota (no mesmo formato de
+    CHANNEL_LAYERS) ou uma instância de camada, como a InMemoryChannelLayer
+    usada no lugar do Redis em testes.
+    """
+
+    NODE_PREFIX = 'hybrid.node.'
+    NODES_GROUP = 'hybrid.nodes'
+
+    def __init__(self, remote, heartbeat=10, node_ttl=30, **kwargs):
+        super().__init__(**kwargs)
+        if isinstance(remote, dict):
+            remote = import_string(remote['BACKEND'])(**remote.get('CONFIG', {}))
+        self.remote = remote
+        self.heartbeat = heartbeat
+        self.node_ttl = node_ttl
+        self.node_channel = f'{self.NODE_PREFIX}{self.client_prefix}'
+        self.remote_nodes: Dict[str, Set[str]] = defaultdict(set)
+        self.node_seen: Dict[str, float] = {}
+        self._reader = None
+        self._heartbeat = None
+
+    def _is_local(self, channel):
+        return channel.startswith(f'hybrid.{self.client_prefix}!')
+
+    @staticmethod
+    def _node_of(channel):
+        if channel.startswith('hybrid.') and '!' in channel:
+            return channel[len('hybrid.'):channel.index('!')]
+        return None
+
+    def _ensure_reader(self):
+        loop = asyncio.get_running_loop()
+        if self._reader is None or self._reader.done() or self._reader.get_loop() is not loop:
+            self._reader = loop.create_task(self._read_remote())
+        if self._heartbeat is None or self._heartbeat.done() or self._heartbeat.get_loop() is not loop:
+            self._heartbeat = loop.create_task(self._send_heartbeats())
+
+    def live_remote_nodes(self, group):
+        """
+        Retorna os outros nós com membros no grupo, removendo os que passaram
+        de `node_ttl` sem dar notícias.
+        """
+        nodes = self.remote_nodes.get(group)
+        if not nodes:
+            return set()
+        stale_before = time.monotonic() - self.node_ttl
+        dead = {node for node in nodes if self.node_seen.get(node, 0) < stale_before}
+        if dead:
+            nodes -= dead
+            if not nodes:
+                del self.remote_nodes[group]
+        return nodes
+
+    async def new_channel(self, prefix='specific.'):
+        self._ensure_reader()
+        return f'hybrid.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def send(self, channel, message):
+        if self._is_local(channel):
+            return await super().send(channel, message)
+        node = self._node_of(channel)
+        if node is None:
+            return await self.remote.send(channel, message)
+        await self.remote.send(
+            f'{self.NODE_PREFIX}{node}',
+            {'type': 'hybrid.direct', 'channel': channel, 'message': message},
+        )
+
+    async def receive(self, channel):
+        if self._is_local(channel):
+            return await super().receive(channel)
+        return await self.remote.receive(channel)
+
+    async def group_add(self, group, channel):
+        if not self._is_local(channel):
+            return await self.remote.group_add(group, channel)
+
+        first = not self.group_channels(group)
+        await super().group_add(group, channel)
+        if first:
+            self._ensure_reader()
+            await self.remote.group_add(group, self.node_channel)
+            await self.remote.group_send(
+                group, {'type': 'hybrid.join', 'node': self.client_prefix, 'group': group}
+            )
+
+    async def group_discard(self, group, channel):
+        if not self._is_local(channel):
+            return await self.remote.group_discard(group, channel)
+
+        await super().group_discard(group, channel)
+        if not self.group_channels(group):
+            await self.remote.group_discard(group, self.node_channel)
+            if self.remote_nodes.pop(group, None):
+                await self.remote.group_send(
+                    group, {'type': 'hybrid.leave', 'node': self.client_prefix, 'group': group}
+                )
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_group_name(group)
+        channels = self.group_channels(group)
+        for channel in channels:
+            self._put(channel, message, raise_on_full=False)
+        if self.live_remote_nodes(group) or not channels:
+            await self.remote.group_send(
+                group,
+                {
+                    'type': 'hybrid.group',
+                    'node': self.client_prefix,
+                    'group': group,
+                    'member': bool(channels),
+                    'message': message,
+                },
+            )
+
+    async def flush(self):
+        for task in (self._reader, self._heartbeat):
+            if task is not None:
+                task.cancel()
+        self._reader = self._heartbeat = None
+        self.remote_nodes.clear()
+        self.node_seen.clear()
+        await super().flush()
+        await self.remote.flush()
+
+    async def _read_remote(self):
+        while True:
+            try:
+                event = await self.remote.receive(self.node_channel)
+                await self._dispatch(event)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to read from the remote channel layer')
+                await asyncio.sleep(1)
+
+    async def _send_heartbeats(self):
+        while True:
+            try:
+                # Renova também a inscrição do nó no grupo, que expira na camada remota.
+                await self.remote.group_add(self.NODES_GROUP, self.node_channel)
+                await self.remote.group_send(
+                    self.NODES_GROUP, {'type': 'hybrid.heartbeat', 'node': self.client_prefix}
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception('Failed to send the node heartbeat')
+            stale_before = time.monotonic() - self.node_ttl
+            self.node_seen = {
+                node: seen_at for node, seen_at in self.node_seen.items() if seen_at >= stale_before
+            }
+            await asyncio.sleep(self.heartbeat)
+
+    async def _dispatch(self, event):
+        event_type = event.get('type')
+        if event_type == 'hybrid.direct':
+            self._put(event['channel'], event['message'], raise_on_full=False)
+            return
+
+        node = event['node']
+        if node == self.client_prefix:
+            return
+        self.node_seen[node] = time.monotonic()
+        if event_type == 'hybrid.heartbeat':
+            return
+
+        group = event['group']
+        if event_type == 'hybrid.group':
+            if self.group_channels(group):
+                # Só nós com membros no grupo entram em remote_nodes; um nó
+                # que apenas envia não anuncia a saída.
+                if event.get('member', True):
+                    self.remote_nodes[group].add(node)
+                await LocalChannelLayer.group_send(self, group, event['message'])
+        elif event_type == 'hybrid.join':
+            self.remote_nodes[group].add(node)
+            if self.group_channels(group):
+                await self.remote.send(
+                    f'{self.NODE_PREFIX}{node}',
+                    {'type': 'hybrid.join_ack', 'node': self.client_prefix, 'group': group},
+                )
+        elif event_type == 'hybrid.join_ack':
+            if self.group_channels(group):
+                self.remote_nodes[group].add(node)
+        elif event_type == 'hybrid.leave':
+            nodes = self.remote_nodes.get(group)
+            if nodes is not None:
+                nodes.discard(node)
+                if not nodes:
+                    del self.remote_nodes[group]
@@ -1,7 +1,12 @@
 # GENERIC SCHEMAS:
+import hashlib
+import json
+import logging
 from operator import attrgetter, itemgetter
 from typing import (
     Any,
+    Collection,
+    Dict,
     Generic,
     List,
     Optional,
@@ -12,7 +17,10 @@ from typing import (
     Union,
 )
 
-from django.core.exceptions import FieldDoesNotExist
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db import connections
 from django.db.models import CharField, F, QuerySet, TextField
 from django.db.models.functions import Upper
 from ninja import Field, FilterSchema, Schema, Field, P, Query
@@ -22,8 +30,7 @@ from pydantic import BaseModel
 from django.http import HttpRequest
 from ninja.types import DictStrAny
 
-from django.forms import CharField
-
+logger = logging.getLogger(__name__)
 
 T = TypeVar("T")
 
@@ -37,6 +44,7 @@ class PaginatedResponseSchema(
     """
 
     count: int
+    count_exact: bool = True
     results: List[T]
     __generic_model__: Any
 
@@ -89,17 +97,43 @@ class DisabledInput(Schema):
 class CustomPagination(PaginationBase):
     """
     Responsável para definição do Schema (modelo Pydantic) de paginação customizado.
-    Page size se não for informado, retorna todos os registros. Caso page_size seja informado
-    for menor que 1 vai retornar todos os registros. Caso contrário, vai retornar a quantidade
-    de registros informada em page_size.
+    Page size se não for informado, for menor que 1 ou maior que o máximo do servidor
+    (`max_page_size`, padrão PAGINATION_MAX_PAGE_SIZE), usa o máximo.
+
+    O total (`count`) depende de `count_mode`:
+
+    - 'exact': COUNT a cada requisição (padrão).
+    - 'cached': COUNT guardado no cache por `count_cache_ttl` segundos, por consulta.
+    - 'estimated': estimativa do planejador do PostgreSQL (EXPLAIN), sem COUNT;
+      nos demais bancos, igual a 'cached'.
+
+    Em qualquer modo, quando a página não está cheia o total é calculado a partir
+    dela, sem consulta extra. `count_exact` indica se o total é exato.
     """
 
+    COUNT_MODES = ('exact', 'cached', 'estimated')
+
     class Input(Schema):  # pylint: disable=missing-class-docstring
         page: int = Field(1, ge=1, description="Número da página")
         page_size: int = Field(
             100, description="Quantidade de registros por página"
         )
 
+    def __init__(
+        self,
+        *,
+        count_mode: str = 'exact',
+        max_page_size: Optional[int] = None,
+        count_cache_ttl: Optional[int] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        if count_mode not in self.COUNT_MODES:
+            raise ValueError(f"count_mode must be one of {', '.join(self.COUNT_MODES)}")
+        self.count_mode = count_mode
+        self.max_page_size = max_page_size or settings.PAGINATION_MAX_PAGE_SIZE
+        self.count_cache_ttl = count_cache_ttl or settings.PAGINATION_COUNT_CACHE_TTL
+
     def paginate_queryset(
         self,
         queryset: QuerySet,
@@ -109,26 +143,94 @@ class CustomPagination(PaginationBase):
     ) -> Any:
         assert request, "request is required!"
 
-        offset = None
-        results = None
+        page_size = pagination.page_size
+        if page_size is None or not 0 < page_size <= self.max_page_size:
+            page_size = self.max_page_size
+        offset = (pagination.page - 1) * page_size
 
-        if pagination.page_size is not None and pagination.page_size > 0:
-            offset = (pagination.page - 1) * pagination.page_size
+        # Um registro a mais indica se existe algo depois desta página.
+        results = list(queryset[offset : offset + page_size + 1])  # noqa: E203
+        has_more = len(results) > page_size
+        results = results[:page_size]
 
-        if offset is not None:
-            results = list(
-                queryset[offset : offset + pagination.page_size]  # noqa: E203
-            )  # noqa: E203
+        if not has_more and (results or offset == 0):
+            count, count_exact = offset + len(results), True
         else:
-            results = list(queryset)
+            count, count_exact = self.get_count(queryset)
+            if results:
+                # A estimativa nunca fica abaixo do que a própria página prova existir.
+                count = max(count, offset + len(results) + int(has_more))
 
         return OrderedDict(
             [
-                ("count", queryset.count()),
+                ("count", count),
+                ("count_exact", count_exact),
                 ("results", results),
             ]
         )
 
+    def get_count(self, queryset: Union[QuerySet, List]) -> Tuple[int, bool]:
+        """
+        Retorna o total de registros segundo o `count_mode` e se ele é exato.
+        """
+        if not isinstance(queryset, QuerySet):
+            return len(queryset), True
+        if self.count_mode == 'estimated':
+            estimate = self.estimated_count(queryset)
+            if estimate is not None:
+                return estimate, False
+        if self.count_mode in ('cached', 'estimated'):
+            count = self.cached_count(queryset)
+            if count is not None:
+                return count, False
+        return queryset.count(), True
+
+    def cached_count(self, queryset: QuerySet) -> Optional[int]:
+        """
+        Total guardado no cache por `count_cache_ttl` segundos, ou None se o
+        cache estiver indisponível (quem chama conta direto no banco).
+        """
+        try:
+            sql, sql_params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+
+        digest = hashlib.sha1(f"{queryset.db}:{sql}:{sql_params!r}".encode()).hexdigest()
+        key = f"pagination:count:{digest}"
+        try:
+            count = cache.get(key)
+        except Exception:
+            logger.warning('Pagination count cache unavailable', exc_info=True)
+            return None
+        if count is None:
+            count = queryset.count()
+            try:
+                cache.set(key, count, self.count_cache_ttl)
+            except Exception:
+                logger.warning('Pagination count cache unavailable', exc_info=True)
+        return count
+
+    @staticmethod
+    def estimated_count(queryset: QuerySet) -> Optional[int]:
+        """
+        Estimativa de linhas do planejador do PostgreSQL para a consulta, ou
+        None nos demais bancos.
+        """
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+        try:
+            sql, sql_params = queryset.order_by().query.sql_with_params()
+        except EmptyResultSet:
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", sql_params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
     @classmethod
     def get_response_schema(
         cls,
@@ -159,6 +261,8 @@ class CustomOrdering(OrderingBase):
         super().__init__(pass_parameter=pass_parameter)
         self.ordering_fields = ordering_fields or "__all__"
         self.Input = self.create_input(ordering_fields)  # type:ignore
+        # Termos válidos por model, compilados na primeira requisição.
+        self._terms: Dict[Any, Dict[str, Tuple[Any, bool]]] = {}
 
     def create_input(self, ordering_fields: Optional[List[str]]) -> Type[Input]:
         if ordering_fields:
@@ -174,48 +278,36 @@ class CustomOrdering(OrderingBase):
     ) -> Union[QuerySet, List]:
         """
         Método responsável por ordenar os registros de acordo com os campos informados.
+        Cada campo de texto é ordenado por UPPER(campo) diretamente no ORDER BY (sem
+        anotação), o que permite usar os índices funcionais gerados por
+        core.utils.model_utils.ordering_indexes. A chave primária entra como
+        desempate, para uma ordem estável entre páginas.
         """
         ordering = self.get_ordering(items, ordering_input.ordering)
         if ordering:
             if isinstance(items, QuerySet):  # type:ignore
-                field_name = ordering[0].lstrip("-")
-
-                # Check related fields
-                if "__" in field_name:
-                    base_field, related_field = field_name.split("__", 1)
-                    base_field_meta = items.model._meta.get_field(base_field)
-                    if base_field_meta.is_relation:
-                        related_model = base_field_meta.related_model
-                        if related_field not in [f.name for f in related_model._meta.fields]:
-                            raise FieldDoesNotExist(
-                                f"{related_model} has no field named '{related_field}'"
-                            )
-                else:
-                    field = items.model._meta.get_field(field_name)
-
-                # Add annotations for insensitive ordering
-                if "__" not in field_name and isinstance(field, (CharField, TextField)):
-                    items = items.annotate(upper_name=Upper(field_name))
-                else:
-                    items = items.annotate(upper_name=F(field_name))
-
-                return items.order_by(
-                    *[
-                        (
-                            F("upper_name").desc()
-                            if o.startswith("-")
-                            else F("upper_name")
-                        )
-                        for o in ordering
-                    ]
-                )
+                terms = self.get_terms(items.model)
+                pk_name = items.model._meta.pk.name
+                descending = False
+                has_pk = False
+                expressions = []
+                for term in ordering:
+                    descending = term.startswith("-")
+                    expression, is_pk = terms[term.lstrip("-")]
+                    has_pk = has_pk or is_pk
+                    expressions.append(expression.desc() if descending else expression.asc())
+
+                if not has_pk:
+                    expressions.append(F(pk_name).desc() if descending else F(pk_name).asc())
+
+                return items.order_by(*expressions)
             elif isinstance(items, list) and items:
 
                 def multisort(xs: List, specs: List[Tuple[str, bool]]) -> List:
                     orerator = (
                         itemgetter if isinstance(xs[0], dict) else attrgetter
                     )
-                    for key, reverse in specs:
+                    for key, reverse in reversed(specs):
                         xs.sort(key=orerator(key), reverse=reverse)
                     return xs
 
@@ -231,6 +323,58 @@ class CustomOrdering(OrderingBase):
                 )
         return items
 
+    def get_terms(self, model: Any) -> Dict[str, Tuple[Any, bool]]:
+        """
+        Retorna os termos de ordenação válidos para o model, cada um com a expressão
+        do ORDER BY e se é a chave primária. Calculado uma vez por model.
+        """
+        terms = self._terms.get(model)
+        if terms is None:
+            terms = self._terms[model] = self.compile_terms(model)
+        return terms
+
+    def compile_terms(self, model: Any) -> Dict[str, Tuple[Any, bool]]:
+        """
+        Compila os termos válidos: os `ordering_fields` declarados que existem no
+        model ou, com "__all__", os campos do model e os campos dos models
+        relacionados diretamente (`relacao__campo`).
+        """
+        if self.ordering_fields == "__all__":
+            names = []
+            for field in model._meta.fields:
+                names.append(field.name)
+                if field.is_relation:
+                    names.extend(
+                        f"{field.name}__{related.name}"
+                        for related in field.related_model._meta.fields
+                    )
+        else:
+            names = [name.lstrip("-") for name in self.ordering_fields]
+
+        pk = model._meta.pk
+        terms = {}
+        for name in names:
+            try:
+                field = self.resolve_field(model, name)
+            except (FieldDoesNotExist, AttributeError):
+                continue
+            expression = Upper(name) if isinstance(field, (CharField, TextField)) else F(name)
+            terms[name] = (expression, field is pk)
+        if pk.name in terms:
+            terms["pk"] = terms[pk.name]
+        return terms
+
+    @staticmethod
+    def resolve_field(model: Any, field_name: str) -> Any:
+        """
+        Retorna o campo do model indicado por `field_name`, seguindo as relações
+        em caminhos como `relacao__campo`.
+        """
+        *relations, name = field_name.split("__")
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(name)
+
     def get_ordering(
         self, items: Union[QuerySet, List], value: Optional[str]
     ) -> List[str]:
@@ -248,43 +392,19 @@ class CustomOrdering(OrderingBase):
         """
         Remove os campos inválidos para ordenação.
         """
-        valid_fields = list(self.get_valid_fields(items))
-
-        def term_valid(term: str) -> bool:
-            if term.startswith("-"):
-                term = term[1:]
-            # Validate related fields manually
-            if "__" in term:
-                parts = term.split("__")
-                model = items.model
-                for part in parts[:-1]:  # Browse relationships
-                    try:
-                        field = model._meta.get_field(part)
-                        if not field.is_relation:
-                            return False
-                        model = field.related_model
-                    except FieldDoesNotExist:
-                        return False
-                return parts[-1] in [f.name for f in model._meta.fields]
-            return term in valid_fields
-
-        return [field for field in fields if term_valid(field)]
-
-    def get_valid_fields(self, items: Union[QuerySet, List]) -> List[str]:
+        valid_fields = self.get_valid_fields(items)
+        return [field for field in fields if field.lstrip("-") in valid_fields]
+
+    def get_valid_fields(self, items: Union[QuerySet, List]) -> Collection[str]:
         """
-        Retorna a lista de campos válidos para ordenação.
+        Retorna os campos válidos para ordenação.
         """
         if isinstance(items, QuerySet):
-            # Get only the direct fields from the model
-            valid_fields = [field.name for field in items.model._meta.fields]
-
-            return valid_fields
+            return self.get_terms(items.model).keys()
         elif isinstance(items, list) and items:
             # For lists, keep the existing logic
-            valid_fields = list(items[0].keys())
-
-            return valid_fields
-        return []
+            return items[0].keys()
+        return ()
 
 
 class ErrorResponse(Schema):
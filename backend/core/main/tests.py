@@ -1 +1,90 @@
-from django.test import TestCase
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from ninja_extra.testing import TestClient
+from ninja_jwt.tokens import AccessToken
+from core.main.schemas import CustomOrdering
+from modules.users.controllers import UserController
+from modules.users.models import User
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class CustomPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(username=f'user{i:02d}', email=f'user{i}@gmail.com', password='senha', name='nome')
+            for i in range(12)
+        ])
+
+    def setUp(self):
+        self.api = TestClient(UserController)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.users[0])}'}
+
+    def page(self, query):
+        response = self.api.get(f'/?{query}', headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    @override_settings(CACHES=LOCMEM_CACHES)
+    def test_full_page_count_is_cached(self):
+        cache.clear()
+        # Autenticação, página e total (cache miss).
+        with self.assertNumQueries(3):
+            body = self.page('page=1&page_size=5')
+        self.assertEqual((body['count'], body['count_exact']), (12, False))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.page('page=2&page_size=5')['count'], 12)
+
+    def test_last_page_count_is_exact_without_count_query(self):
+        with self.assertNumQueries(2):
+            body = self.page('page=3&page_size=5')
+        self.assertEqual((body['count'], body['count_exact'], len(body['results'])), (12, True, 2))
+
+    def test_unavailable_cache_falls_back_to_exact_count(self):
+        broken_cache = mock.Mock()
+        broken_cache.get.side_effect = ConnectionError('cache down')
+        with mock.patch('core.main.schemas.cache', broken_cache), \
+                self.assertLogs('core.main.schemas', 'WARNING'):
+            body = self.page('page=2&page_size=5')
+        self.assertEqual((body['count'], body['count_exact']), (12, True))
+
+
+class CustomOrderingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = User.objects.bulk_create([
+            User(username=username, email=f'{username}@gmail.com', password='senha', name=name)
+            for username, name in (
+                ('u1', 'bruno'), ('u2', 'Ana'), ('u3', 'carla'), ('u4', 'Bruno'), ('u5', 'ana'),
+            )
+        ])
+
+    def usernames(self, ordering, ordering_fields=('id', 'username', 'name')):
+        sorter = CustomOrdering(ordering_fields=list(ordering_fields))
+        queryset = sorter.ordering_queryset(User.objects.all(), sorter.Input(ordering=ordering))
+        return [user.username for user in queryset]
+
+    def test_text_fields_are_ordered_case_insensitively(self):
+        self.assertEqual(self.usernames('name'), ['u2', 'u5', 'u1', 'u4', 'u3'])
+
+    def test_pk_breaks_ties_in_the_direction_of_the_last_term(self):
+        self.assertEqual(self.usernames('-name'), ['u3', 'u4', 'u1', 'u5', 'u2'])
+        # Com a chave primária já na ordenação, nada é acrescentado.
+        sorter = CustomOrdering(ordering_fields=['id', 'name'])
+        queryset = sorter.ordering_queryset(User.objects.all(), sorter.Input(ordering='name,-id'))
+        self.assertEqual([user.username for user in queryset], ['u5', 'u2', 'u4', 'u1', 'u3'])
+        self.assertEqual(len(queryset.query.order_by), 2)
+
+    def test_undeclared_and_unknown_fields_are_dropped(self):
+        self.assertEqual(self.usernames('email,-name'), self.usernames('-name'))
+        self.assertEqual(self.usernames('password'), self.usernames(None))
+        sorter = CustomOrdering(ordering_fields=['name', 'nao_existe'])
+        self.assertEqual(set(sorter.get_terms(User)), {'name'})
+        self.assertEqual(
+            sorter.get_ordering(User.objects.all(), 'nao_existe,name,-email'), ['name']
+        )
@@ -115,13 +115,47 @@ DATABASES = {
     }
 }
 
+REDIS_CHANNEL_LAYER = {
+    "BACKEND": "channels_redis.core.RedisChannelLayer",
+    "CONFIG": {
+        "hosts": [("127.0.0.1", 6379)],
+    },
+}
+
+# CHANNEL_LAYER escolhe a camada de canais:
+# - "hybrid": entrega local e usa o Redis apenas para membros em outros processos;
+# - "local": somente em memória, para implantações de um único processo;
+# - "redis": toda mensagem passa pelo Redis.
+CHANNEL_LAYER = os.getenv('CHANNEL_LAYER', 'hybrid')
+
+LOCAL_CHANNEL_LAYER_CONFIG = {
+    "capacity": 100,
+    "shards": 16,
+    # drop_newest | drop_oldest | raise. Com a fila do canal cheia, a mensagem
+    # descartada (ex.: uma mensagem de chat) é registrada no log; drop_newest
+    # mantém a ordem do que já foi enfileirado.
+    "overflow": "drop_newest",
+}
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
-        "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+        "redis": REDIS_CHANNEL_LAYER,
+        "local": {
+            "BACKEND": "core.layers.LocalChannelLayer",
+            "CONFIG": LOCAL_CHANNEL_LAYER_CONFIG,
         },
-    },
+        "hybrid": {
+            "BACKEND": "core.layers.HybridChannelLayer",
+            "CONFIG": {
+                **LOCAL_CHANNEL_LAYER_CONFIG,
+                "remote": REDIS_CHANNEL_LAYER,
+                # Intervalo (s) do heartbeat entre nós e tempo (s) sem notícias
+                # até um nó ser considerado morto.
+                "heartbeat": 10,
+                "node_ttl": 30,
+            },
+        },
+    }[CHANNEL_LAYER],
 }
 
 CACHES = {
@@ -134,6 +168,93 @@ CACHES = {
     }
 }
 
+# Paginação (core.main.schemas.CustomPagination)
+
+PAGINATION_MAX_PAGE_SIZE = 100
+# Validade (s) dos totais no modo de contagem 'cached'.
+PAGINATION_COUNT_CACHE_TTL = 60
+
+# Busca de usuários (GET /user/search)
+
+USER_SEARCH = {
+    # Usuários com conversas mais recentes mantidos na trie em memória.
+    'TRIE_SIZE': 1000,
+    # Intervalo (s) entre as reconstruções da trie. Também é o tempo máximo em
+    # que um processo mostra nome antigo ou usuário já desativado em outro.
+    'TRIE_TTL': 60,
+    'MAX_LIMIT': 20,
+    'MAX_QUERY_LENGTH': 50,
+}
+
+# Chat
+
+CHAT_HISTORY_PAGE_SIZE = 50
+
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+# Maior lacuna enviada pelo websocket numa reconexão com `since_id`.
+CHAT_RESUME_MAX_GAP = 200
+
+CHAT_ROOM_CACHE_SIZE = 10000
+
+CHAT_ROOM_CACHE_TTL = 300
+
+CHAT_READ_RECEIPT_DEBOUNCE = 0.5
+
+CHAT_TYPING_THROTTLE = 2.0
+
+CHAT_TYPING_TIMEOUT = 5.0
+CHAT_WS_USER_CACHE_SIZE = 10000
+CHAT_WS_USER_CACHE_TTL = 60
+# Bytes pendentes por conexão antes de aplicar a política de cliente lento.
+CHAT_OUTBOUND_HIGH_WATER = 256 * 1024
+# Salas por conexão no websocket multiplexado (ws/chat/).
+CHAT_MULTIPLEX_MAX_ROOMS = 100
+CHAT_PRESENCE = {
+    # Intervalo (s) entre as gravações em lote no cache.
+    'FLUSH_INTERVAL': 1.0,
+    # Uma entrada "online" sem regravação por mais que isso (s) é lida como offline.
+    'ONLINE_TTL': 90,
+    'LAST_SEEN_TTL': 60 * 60 * 24 * 30,
+    # Máximo de ids por consulta em POST /user/presence.
+    'MAX_IDS': 500,
+}
+# Busca textual nas mensagens (GET chat/search).
+CHAT_SEARCH_MAX_TERMS = 8
+CHAT_SEARCH_MAX_OFFSET = 1000
+# Token buckets (ver core.utils.ratelimit). USER limita as mensagens de cada
+# usuário, somando websocket e POST chat/message; com BACKEND 'redis' o limite
+# vale para todos os processos. CONNECTION limita os frames recebidos por
+# conexão websocket e é sempre local.
+CHAT_RATE_LIMIT = {
+    'USER': {
+        'RATE': 5,
+        'BURST': 20,
+        'BACKEND': os.getenv('CHAT_RATE_LIMIT_BACKEND', 'local'),
+        'LOCATION': CACHES['default']['LOCATION'],
+    },
+    'CONNECTION': {
+        'RATE': 20,
+        'BURST': 40,
+    },
+}
+
+# Id do nó (0-63) nos ids das mensagens; deve ser único por processo.
+# Obrigatório com DEBUG = False (ver core.utils.snowflake).
+SNOWFLAKE_NODE_ID = os.getenv('SNOWFLAKE_NODE_ID')
+
+CHAT_WRITE_BEHIND = {
+    'ENABLED': os.getenv('CHAT_WRITE_BEHIND', '0') == '1',
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.05,
+    'MAX_PENDING': 5000,
+    # 'fanout_first': envia aos clientes antes de persistir (menor latência).
+    # 'persist_first': envia somente após o commit do lote que contém a mensagem.
+    'DURABILITY': 'fanout_first',
+    # Novas tentativas de um lote que falhou, com espera inicial (s) dobrando a cada uma.
+    'RETRIES': 3,
+    'RETRY_BACKOFF': 0.1,
+}
+
 
 WSGI_APPLICATION = 'core.wsgi.application'
 
@@ -0,0 +1,249 @@
+import asyncio
+from unittest import mock
+
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, override_settings
+from core.layers import DROP_NEWEST, DROP_OLDEST, RAISE, HybridChannelLayer, LocalChannelLayer
+from core.utils.ratelimit import LocalRateLimiter, TokenBucket, build_rate_limiter
+from core.utils.snowflake import (
+    MAX_SEQUENCE, NODE_BITS, SEQUENCE_BITS, SNOWFLAKE_EPOCH_MS, SnowflakeGenerator,
+    configured_node_id,
+)
+
+
+async def settle():
+    # Deixa os leitores da camada remota processarem os anúncios pendentes.
+    await asyncio.sleep(0.05)
+
+
+async def receive(layer, channel):
+    return await asyncio.wait_for(layer.receive(channel), 1)
+
+
+class LocalChannelLayerTests(SimpleTestCase):
+
+    def test_overflow_policies(self):
+        async def scenario():
+            for overflow, expected in ((DROP_OLDEST, [1, 2]), (DROP_NEWEST, [0, 1])):
+                layer = LocalChannelLayer(capacity=2, overflow=overflow)
+                channel = await layer.new_channel()
+                with self.assertLogs('core.layers', 'WARNING') as logs:
+                    for i in range(3):
+                        await layer.send(channel, {'type': 'x', 'i': i})
+                self.assertIn("dropped a 'x' message", logs.output[0])
+                self.assertEqual([(await layer.receive(channel))['i'] for _ in range(2)], expected)
+                self.assertEqual(layer.dropped, 1)
+
+            layer = LocalChannelLayer(capacity=1, overflow=RAISE)
+            channel = await layer.new_channel()
+            await layer.send(channel, {'type': 'x'})
+            with self.assertRaises(ChannelFull):
+                await layer.send(channel, {'type': 'x'})
+            # group_send ignora o canal cheio.
+            await layer.group_add('g', channel)
+            with self.assertLogs('core.layers', 'WARNING'):
+                await layer.group_send('g', {'type': 'x'})
+            self.assertEqual(layer.dropped, 1)
+
+            self.assertEqual(LocalChannelLayer().overflow, DROP_NEWEST)
+
+        asyncio.run(scenario())
+
+    def test_group_send_reaches_only_members(self):
+        async def scenario():
+            layer = LocalChannelLayer()
+            a, b, c = [await layer.new_channel() for _ in range(3)]
+            await layer.group_add('g', a)
+            await layer.group_add('g', b)
+            await layer.group_discard('g', b)
+            await layer.group_send('g', {'type': 'x'})
+            self.assertEqual((await receive(layer, a))['type'], 'x')
+            self.assertNotIn(b, layer.channels)
+            self.assertNotIn(c, layer.channels)
+
+        asyncio.run(scenario())
+
+
+class HybridChannelLayerTests(SimpleTestCase):
+
+    def nodes(self, count):
+        remote = InMemoryChannelLayer()
+        return remote, [HybridChannelLayer(remote=remote) for _ in range(count)]
+
+    def test_local_only_group_skips_remote(self):
+        async def scenario():
+            remote, (node,) = self.nodes(1)
+            a, b = await node.new_channel(), await node.new_channel()
+            await node.group_add('g', a)
+            await node.group_add('g', b)
+            with mock.patch.object(remote, 'group_send', wraps=remote.group_send) as group_send:
+                await node.group_send('g', {'type': 'x'})
+                group_send.assert_not_called()
+            self.assertEqual((await receive(node, a))['type'], 'x')
+            self.assertEqual((await receive(node, b))['type'], 'x')
+
+        asyncio.run(scenario())
+
+    def test_group_send_between_member_nodes(self):
+        async def scenario():
+            remote, (first, second) = self.nodes(2)
+            a, b = await first.new_channel(), await second.new_channel()
+            await first.group_add('g', a)
+            await second.group_add('g', b)
+            await settle()
+            self.assertEqual(first.remote_nodes['g'], {second.client_prefix})
+
+            await first.group_send('g', {'type': 'x', 'n': 1})
+            self.assertEqual((await receive(first, a))['n'], 1)
+            self.assertEqual((await receive(second, b))['n'], 1)
+
+            await first.send(b, {'type': 'direct'})
+            self.assertEqual((await receive(second, b))['type'], 'direct')
+
+            await second.group_discard('g', b)
+            await settle()
+            self.assertFalse(first.remote_nodes.get('g'))
+
+        asyncio.run(scenario())
+
+    def test_group_send_from_node_without_members(self):
+        async def scenario():
+            remote, (member, sender) = self.nodes(2)
+            a = await member.new_channel()
+            await member.group_add('g', a)
+            await settle()
+
+            # Ex.: o admin ou outro worker, que nunca entrou no grupo.
+            await sender.group_send('g', {'type': 'x', 'n': 1})
+            self.assertEqual((await receive(member, a))['n'], 1)
+            await settle()
+            # O nó que só envia não vira destino dos envios do membro.
+            self.assertFalse(member.remote_nodes.get('g'))
+            with mock.patch.object(remote, 'group_send', wraps=remote.group_send) as group_send:
+                await member.group_send('g', {'type': 'x', 'n': 2})
+                group_send.assert_not_called()
+
+        asyncio.run(scenario())
+
+    def test_dead_node_expires_from_remote_nodes(self):
+        async def scenario():
+            remote = InMemoryChannelLayer()
+            first, second, third = [
+                HybridChannelLayer(remote=remote, heartbeat=0.05, node_ttl=0.3) for _ in range(3)
+            ]
+            a, b, c = [await node.new_channel() for node in (first, second, third)]
+            for node, channel in ((first, a), (second, b), (third, c)):
+                await node.group_add('g', channel)
+            await settle()
+            self.assertEqual(first.remote_nodes['g'], {second.client_prefix, third.client_prefix})
+
+            # O segundo nó morre sem anunciar a saída; o terceiro segue vivo.
+            second._reader.cancel()
+            second._heartbeat.cancel()
+            await asyncio.sleep(0.5)
+            self.assertEqual(first.live_remote_nodes('g'), {third.client_prefix})
+
+            await third.group_discard('g', c)
+            await settle()
+            with mock.patch.object(remote, 'group_send', wraps=remote.group_send) as group_send:
+                await first.group_send('g', {'type': 'x'})
+                group_send.assert_not_called()
+            self.assertEqual((await receive(first, a))['type'], 'x')
+
+        asyncio.run(scenario())
+
+
+class TokenBucketTests(SimpleTestCase):
+
+    def test_burst_then_refill(self):
+        bucket = TokenBucket(rate=2, burst=3)
+        now = bucket.updated_at
+        self.assertEqual([bucket.take(now) for _ in range(3)], [0.0, 0.0, 0.0])
+        self.assertAlmostEqual(bucket.take(now), 0.5)
+        # Meio segundo depois entrou uma ficha.
+        self.assertEqual(bucket.take(now + 0.5), 0.0)
+        self.assertAlmostEqual(bucket.take(now + 0.5), 0.5)
+
+    def test_refill_is_capped_at_burst(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated_at + 60
+        self.assertEqual([bucket.take(now) for _ in range(2)], [0.0, 0.0])
+        self.assertGreater(bucket.take(now), 0)
+
+    def test_clock_going_backwards_does_not_drain(self):
+        bucket = TokenBucket(rate=1, burst=1)
+        self.assertEqual(bucket.take(bucket.updated_at - 5), 0.0)
+        self.assertAlmostEqual(bucket.tokens, 0.0)
+
+
+class LocalRateLimiterTests(SimpleTestCase):
+
+    def test_keys_have_independent_buckets(self):
+        limiter = LocalRateLimiter(rate=1, burst=2)
+        self.assertEqual([limiter.hit('a') for _ in range(2)], [0.0, 0.0])
+        self.assertGreater(limiter.hit('a'), 0)
+        self.assertEqual(limiter.hit('b'), 0.0)
+
+    def test_least_recently_used_bucket_is_evicted(self):
+        limiter = LocalRateLimiter(rate=1, burst=1, maxsize=2)
+        limiter.hit('a')
+        limiter.hit('b')
+        limiter.hit('a')
+        limiter.hit('c')
+        self.assertEqual(list(limiter._buckets), ['a', 'c'])
+
+    def test_ahit(self):
+        limiter = LocalRateLimiter(rate=1, burst=1)
+        self.assertEqual(asyncio.run(limiter.ahit('a')), 0.0)
+        self.assertGreater(asyncio.run(limiter.ahit('a')), 0)
+
+    def test_build_rate_limiter_defaults_to_local(self):
+        limiter = build_rate_limiter({'RATE': 1, 'BURST': 2}, key_prefix='test')
+        self.assertIsInstance(limiter, LocalRateLimiter)
+        self.assertEqual((limiter.rate, limiter.burst), (1, 2))
+
+
+class SnowflakeTests(SimpleTestCase):
+
+    def ids_at(self, generator, *times_ms):
+        with mock.patch('core.utils.snowflake.time.time') as clock:
+            clock.side_effect = [(SNOWFLAKE_EPOCH_MS + ms) / 1000 for ms in times_ms]
+            return [generator.next_id() for _ in times_ms]
+
+    @staticmethod
+    def split(snowflake_id):
+        return (
+            snowflake_id >> (NODE_BITS + SEQUENCE_BITS),
+            (snowflake_id >> SEQUENCE_BITS) & ((1 << NODE_BITS) - 1),
+            snowflake_id & MAX_SEQUENCE,
+        )
+
+    def test_sequence_overflow_borrows_next_millisecond(self):
+        ids = self.ids_at(SnowflakeGenerator(3), *[1000] * (MAX_SEQUENCE + 2), 1001)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual(self.split(ids[MAX_SEQUENCE]), (1000, 3, MAX_SEQUENCE))
+        self.assertEqual(self.split(ids[MAX_SEQUENCE + 1]), (1001, 3, 0))
+        # O milissegundo 1001 já foi usado: a sequência continua.
+        self.assertEqual(self.split(ids[-1]), (1001, 3, 1))
+
+    def test_clock_going_backwards_keeps_ids_increasing(self):
+        ids = self.ids_at(SnowflakeGenerator(3), 1000, 990, 995, 1001)
+        self.assertEqual(ids, sorted(set(ids)))
+        self.assertEqual([self.split(i)[0] for i in ids], [1000, 1000, 1000, 1001])
+
+    @override_settings(DEBUG=False, SNOWFLAKE_NODE_ID=None)
+    def test_node_id_is_required_outside_debug(self):
+        with self.assertRaises(ImproperlyConfigured):
+            configured_node_id()
+        with override_settings(DEBUG=True):
+            self.assertEqual(configured_node_id(), 0)
+
+    def test_node_id_must_fit_in_node_bits(self):
+        with override_settings(SNOWFLAKE_NODE_ID='7'):
+            self.assertEqual(configured_node_id(), 7)
+        for value in ('64', '-1', 'abc'):
+            with self.subTest(value=value), override_settings(SNOWFLAKE_NODE_ID=value), \
+                    self.assertRaises(ImproperlyConfigured):
+                configured_node_id()
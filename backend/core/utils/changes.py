@@ -2,6 +2,7 @@ from typing import Any, Dict, List, Optional, Tuple, Union
 from django.db import IntegrityError, models
 from django.http import Http404
 from django.shortcuts import get_object_or_404
+from ninja import FilterSchema
 from ninja_extra import status
 from django.db import transaction
 
@@ -70,7 +71,10 @@ class Services:
     @classmethod
     def list(cls, *, filters: Optional[Any] = None) -> models.QuerySet:
         queryset = cls.repository.list()
-        if filters:
+        if isinstance(filters, FilterSchema):
+            # Respeita as lookups declaradas em `q` nos campos do schema.
+            queryset = filters.filter(queryset)
+        elif filters:
             queryset = queryset.filter(**filters.dict(exclude_none=True))
         return queryset
     
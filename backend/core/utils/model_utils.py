@@ -4,6 +4,10 @@ Responsável por prover funções utilitárias para models.
 
 from typing import Any, List, Optional
 
+from django.db import models
+from django.db.models import F
+from django.db.models.functions import Upper
+
 
 def get_active_references(
     *, model: Any, whitelist: Optional[List[Any]] = None
@@ -51,4 +55,22 @@ def get_active_references(
             if reference in whitelist:
                 active_referencing_models.remove(reference)
 
-    return active_referencing_models
\ No newline at end of file
+    return active_referencing_models
+
+
+def ordering_indexes(*, prefix: str, fields: List[str]) -> List[models.Index]:
+    """
+    Gera os índices funcionais que atendem à ordenação sem diferenciar maiúsculas
+    do CustomOrdering (ORDER BY UPPER(campo), id), um para cada campo de texto.
+
+    Parâmetros:
+        `prefix` -- Prefixo do nome dos índices.
+        `fields` -- Campos de texto declarados em `ordering_fields`.
+
+    Retorno:
+        Lista de índices para o `Meta.indexes` do model.
+    """
+    return [
+        models.Index(Upper(field), F('id'), name=f'{prefix}_{field}_upper_idx')
+        for field in fields
+    ]
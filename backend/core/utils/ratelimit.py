@@ -0,0 +1,151 @@
+"""
+Responsável pela limitação de taxa por token bucket.
+
+Cada chave tem um balde com capacidade `burst` que recebe `rate` fichas por
+segundo; cada operação consome uma ficha. Sem fichas, a operação é recusada
+e o limitador informa em quantos segundos haverá uma ficha disponível.
+
+- `TokenBucket`: um balde isolado, para estado que já é local (ex.: uma
+  conexão websocket). Não é protegido por lock.
+- `LocalRateLimiter`: baldes por chave na memória do processo. O custo por
+  chamada é de poucos microssegundos, mas cada processo tem o próprio limite.
+- `RedisRateLimiter`: baldes por chave no Redis, compartilhados entre os
+  processos, ao custo de uma ida ao Redis por chamada.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+
+class TokenBucket:
+
+    __slots__ = ('rate', 'burst', 'tokens', 'updated_at')
+
+    def __init__(self, *, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def take(self, now: Optional[float] = None, cost: float = 1) -> float:
+        """
+        Consome `cost` fichas. Retorna 0 se houver fichas suficientes ou, caso
+        contrário, quantos segundos faltam para haver.
+        """
+        if now is None:
+            now = time.monotonic()
+        tokens = self.tokens
+        if now > self.updated_at:
+            tokens = min(self.burst, tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+        if tokens >= cost:
+            self.tokens = tokens - cost
+            return 0.0
+        self.tokens = tokens
+        return (cost - tokens) / self.rate
+
+
+class LocalRateLimiter:
+    """
+    Baldes por chave na memória do processo, seguros entre threads. Guarda no
+    máximo `maxsize` baldes; o usado há mais tempo é descartado (o que apenas
+    devolve à chave um balde cheio).
+    """
+
+    def __init__(self, *, rate: float, burst: float, maxsize: int = 100000) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.maxsize = maxsize
+        self._buckets: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def hit(self, key: Hashable, cost: float = 1) -> float:
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = TokenBucket(rate=self.rate, burst=self.burst)
+                if len(self._buckets) > self.maxsize:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(key)
+            return bucket.take(now, cost)
+
+    async def ahit(self, key: Hashable, cost: float = 1) -> float:
+        return self.hit(key, cost)
+
+
+class RedisRateLimiter:
+    """
+    Baldes por chave no Redis, atualizados atomicamente por um script Lua que
+    usa o relógio do próprio Redis. A chave expira quando o balde voltaria a
+    ficar cheio.
+    """
+
+    script = """
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local clock = redis.call('TIME')
+        local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+        local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+        local tokens = tonumber(state[1]) or burst
+        local updated_at = tonumber(state[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - updated_at) * rate)
+        local retry_after = 0
+        if tokens >= cost then
+            tokens = tokens - cost
+        else
+            retry_after = (cost - tokens) / rate
+        end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated_at', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(retry_after)
+    """
+
+    def __init__(self, *, rate: float, burst: float, location: str, key_prefix: str = 'ratelimit') -> None:
+        self.rate = rate
+        self.burst = burst
+        self.location = location
+        self.key_prefix = key_prefix
+        self._client = None
+        self._async_clients: Dict[Any, Any] = {}
+
+    def key(self, key: Hashable) -> str:
+        return f'{self.key_prefix}:{key}'
+
+    def hit(self, key: Hashable, cost: float = 1) -> float:
+        if self._client is None:
+            import redis
+            self._client = redis.Redis.from_url(self.location)
+            self._sync_script = self._client.register_script(self.script)
+        return float(self._sync_script(keys=[self.key(key)], args=[self.rate, self.burst, cost]))
+
+    async def ahit(self, key: Hashable, cost: float = 1) -> float:
+        import redis.asyncio
+
+        # Clientes assíncronos ficam presos ao event loop em que foram criados.
+        loop = asyncio.get_running_loop()
+        script = self._async_clients.get(loop)
+        if script is None:
+            client = redis.asyncio.Redis.from_url(self.location)
+            script = self._async_clients[loop] = client.register_script(self.script)
+        return float(await script(keys=[self.key(key)], args=[self.rate, self.burst, cost]))
+
+
+def build_rate_limiter(config: Dict[str, Any], *, key_prefix: str):
+    """
+    Cria o limitador descrito por `config` ({'RATE', 'BURST', 'BACKEND'} e,
+    para o backend 'redis', 'LOCATION').
+    """
+    if config.get('BACKEND', 'local') == 'redis':
+        return RedisRateLimiter(
+            rate=config['RATE'],
+            burst=config['BURST'],
+            location=config['LOCATION'],
+            key_prefix=key_prefix,
+        )
+    return LocalRateLimiter(rate=config['RATE'], burst=config['BURST'])
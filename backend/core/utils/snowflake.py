@@ -0,0 +1,109 @@
+"""
+Responsável por gerar ids ordenados pelo tempo sem consultar o banco
+(ids no formato "snowflake").
+
+Layout de 53 bits, para que o id continue exato em um `Number` do JavaScript:
+
+    41 bits -- milissegundos desde SNOWFLAKE_EPOCH (~69 anos)
+     6 bits -- id do nó (processo); deve ser único entre os processos ativos
+     6 bits -- sequência dentro do mesmo milissegundo
+
+O id do nó vem do setting `SNOWFLAKE_NODE_ID`, obrigatório fora do modo
+DEBUG: com mais de um worker, cada processo precisa de um valor próprio, e
+não há como derivá-lo do processo sem risco de colisão. A verificação roda
+na inicialização (RoomsConfig.ready chama `configure`), para que um worker mal configurado
+não chegue a aceitar requisições.
+"""
+
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+SNOWFLAKE_EPOCH_MS = 1735689600000  # 2025-01-01T00:00:00Z
+
+NODE_BITS = 6
+SEQUENCE_BITS = 6
+
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class SnowflakeGenerator:
+    """
+    Gera ids únicos e monotônicos dentro do processo. Quando a sequência de um
+    milissegundo se esgota, ou quando o relógio volta no tempo, o gerador avança
+    o milissegundo lógico em vez de bloquear.
+    """
+
+    def __init__(self, node_id: int) -> None:
+        if not 0 <= node_id <= MAX_NODE_ID:
+            raise ValueError(f'node_id must be between 0 and {MAX_NODE_ID}')
+        self.node_id = node_id
+        self._last_ms = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def next_id(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000) - SNOWFLAKE_EPOCH_MS
+            if now_ms > self._last_ms:
+                self._last_ms = now_ms
+                self._sequence = 0
+            else:
+                self._sequence += 1
+                if self._sequence > MAX_SEQUENCE:
+                    self._last_ms += 1
+                    self._sequence = 0
+            return (
+                (self._last_ms << (NODE_BITS + SEQUENCE_BITS))
+                | (self.node_id << SEQUENCE_BITS)
+                | self._sequence
+            )
+
+
+_generator = None
+_generator_lock = threading.Lock()
+
+
+def configured_node_id() -> int:
+    """
+    Retorna o id do nó configurado em `SNOWFLAKE_NODE_ID`. Sem o setting,
+    usa 0 em modo DEBUG (um único processo) e lança ImproperlyConfigured
+    nos demais casos, assim como para valores fora de 0-63.
+    """
+    node_id = getattr(settings, 'SNOWFLAKE_NODE_ID', None)
+    if node_id is None or node_id == '':
+        if settings.DEBUG:
+            return 0
+        raise ImproperlyConfigured(
+            'SNOWFLAKE_NODE_ID must be set to a value unique to each worker process'
+        )
+    try:
+        node_id = int(node_id)
+    except (TypeError, ValueError):
+        node_id = -1
+    if not 0 <= node_id <= MAX_NODE_ID:
+        raise ImproperlyConfigured(f'SNOWFLAKE_NODE_ID must be between 0 and {MAX_NODE_ID}')
+    return node_id
+
+
+def configure() -> SnowflakeGenerator:
+    """
+    Cria o gerador do processo, se ainda não existir, com o id do nó
+    configurado.
+    """
+    global _generator
+    if _generator is None:
+        with _generator_lock:
+            if _generator is None:
+                _generator = SnowflakeGenerator(configured_node_id())
+    return _generator
+
+
+def next_id() -> int:
+    """
+    Retorna o próximo id do gerador do processo.
+    """
+    return (_generator or configure()).next_id()
@@ -3,3 +3,10 @@ from django.apps import AppConfig
 class RoomsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'modules.rooms'
+
+    def ready(self):
+        from core.utils import snowflake
+        from . import signals  # noqa: F401
+
+        # Falha na inicialização, e não na primeira mensagem, sem um id de nó válido.
+        snowflake.configure()
@@ -0,0 +1,92 @@
+from typing import Optional, Tuple
+
+from django.conf import settings
+from core.utils.cache import TTLCache
+from modules.users.models import User
+from .models import ChatRoom
+from .repository import ChatRoomRepository
+
+Pair = Tuple[int, int]
+
+
+class RoomCache:
+    """
+    Responsável por resolver salas pelo par canônico de usuários, mantendo
+    o id da sala em um cache LRU com TTL compartilhado pelo consumer e pelo
+    controller. O cache é local ao processo; o TTL limita o tempo em que
+    outro processo pode enxergar uma sala já removida.
+    """
+
+    def __init__(self, *, maxsize: int, ttl: float) -> None:
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+
+    @staticmethod
+    def parse_room_name(room_name: str) -> Pair:
+        """
+        Converte o nome da sala ('<id>_<id>') no par canônico.
+        Lança ValueError caso o nome seja inválido.
+        """
+        user_ids = room_name.split('_')
+        if len(user_ids) != 2:
+            raise ValueError('Invalid room name format')
+        user_a_id, user_b_id = map(int, user_ids)
+        return ChatRoom.canonical_pair(user_a_id, user_b_id)
+
+    @staticmethod
+    def _build(pair: Pair, room_id: int) -> ChatRoom:
+        return ChatRoom(id=room_id, user1_id=pair[0], user2_id=pair[1])
+
+    def peek(self, user_a_id: int, user_b_id: int) -> Optional[ChatRoom]:
+        """
+        Retorna a sala somente se estiver em cache, sem acessar o banco.
+        """
+        pair = ChatRoom.canonical_pair(user_a_id, user_b_id)
+        room_id = self._cache.get(pair)
+        return None if room_id is None else self._build(pair, room_id)
+
+    def find_room(self, user_a_id: int, user_b_id: int) -> Optional[ChatRoom]:
+        """
+        Retorna a sala do par, consultando o banco apenas em caso de cache miss.
+        Não cria a sala.
+        """
+        pair = ChatRoom.canonical_pair(user_a_id, user_b_id)
+        room_id = self._cache.get(pair)
+        if room_id is None:
+            room = ChatRoomRepository.find(user_a_id=pair[0], user_b_id=pair[1])
+            if room is None:
+                return None
+            room_id = room.id
+            self._cache.set(pair, room_id)
+        return self._build(pair, room_id)
+
+    def get_room(self, user_a_id: int, user_b_id: int) -> ChatRoom:
+        """
+        Retorna a sala do par, criando-a caso ainda não exista.
+        Lança User.DoesNotExist se algum dos usuários não existir.
+        """
+        pair = ChatRoom.canonical_pair(user_a_id, user_b_id)
+        room_id = self._cache.get(pair)
+        if room_id is None:
+            room = ChatRoomRepository.find(user_a_id=pair[0], user_b_id=pair[1])
+            if room is None:
+                if User.objects.filter(id__in=pair).count() != len(set(pair)):
+                    raise User.DoesNotExist('Room user not found')
+                room, _ = ChatRoom.objects.get_or_create(user1_id=pair[0], user2_id=pair[1])
+            room_id = room.id
+            self._cache.set(pair, room_id)
+        return self._build(pair, room_id)
+
+    def invalidate_room(self, user_a_id: int, user_b_id: int) -> None:
+        self._cache.pop(ChatRoom.canonical_pair(user_a_id, user_b_id))
+
+    def invalidate_user(self, user_id: int) -> None:
+        self._cache.pop_where(lambda pair: user_id in pair)
+
+    def clear(self) -> None:
+        self._cache.clear()
+
+
+room_cache = RoomCache(
+    maxsize=settings.CHAT_ROOM_CACHE_SIZE,
+    ttl=settings.CHAT_ROOM_CACHE_TTL,
+)
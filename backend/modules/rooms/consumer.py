@@ -1,170 +1,312 @@
-import json
+import asyncio
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
-from modules.users.models import User
-from modules.rooms.models import ChatRoom, ChatMessage
-from django.contrib.auth import get_user_model
-from asgiref.sync import async_to_sync
-from channels.db import database_sync_to_async
 from django.core.exceptions import ObjectDoesNotExist
-from ninja_jwt.authentication import JWTAuth
+from django.conf import settings
+from core.utils.ratelimit import TokenBucket
+from modules.rooms.encoding import negotiate
+from modules.rooms.outbound import DURABLE, EPHEMERAL, OutboundBuffer
+from modules.rooms.session import RoomSession
+from modules.users.presence import presence
+from modules.users.revocation import forget, user_group
 
 
+# Código de fechamento usado quando o cliente não acompanha o envio.
+SLOW_CONSUMER_CLOSE_CODE = 4008
+# Código de fechamento usado quando a autenticação do usuário é revogada.
+REVOKED_CLOSE_CODE = 4001
+# Código de fechamento usado sem usuário autenticado ou fora da sala.
+FORBIDDEN_CLOSE_CODE = 4003
+# Código de fechamento usado quando algum usuário da sala não existe.
+ROOM_NOT_FOUND_CLOSE_CODE = 4004
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """
+    Responsável pelo que é comum às conexões do chat: negociação do formato
+    dos frames pelo subprotocolo (ver modules.rooms.encoding), aceite da
+    conexão, buffer de saída, limite de frames por conexão e revogação da
+    autenticação.
+
+    A autenticação é verificada só no handshake; conexões autenticadas entram
+    no grupo `user_<id>` e são fechadas pelo evento `user_revoked` (ver
+    modules.users.revocation), sem consultar o banco a cada mensagem.
+    """
+
+    async def open_connection(self):
+        """
+        Aceita a conexão no formato negociado. Retorna False (e fecha a
+        conexão) se o cliente só oferecer subprotocolos não suportados.
+        """
+        self.codec = negotiate(self.scope.get('subprotocols') or [])
+        if self.codec is None:
+            await self.close()
+            return False
+
+        subprotocols = self.scope.get('subprotocols') or []
+        await self.accept(subprotocol=self.codec.subprotocol if subprotocols else None)
+        self.outbox = OutboundBuffer(
+            send=self.send_frame,
+            on_overflow=self.close_slow_consumer,
+            high_water=settings.CHAT_OUTBOUND_HIGH_WATER,
+        )
+        self.rate_bucket = TokenBucket(
+            rate=settings.CHAT_RATE_LIMIT['CONNECTION']['RATE'],
+            burst=settings.CHAT_RATE_LIMIT['CONNECTION']['BURST'],
+        )
+
+        self.tracks_presence = bool(self.user and self.user.is_authenticated)
+        if self.tracks_presence:
+            presence.connect(self.user.id)
+            await self.channel_layer.group_add(user_group(self.user.id), self.channel_name)
+        return True
+
+    async def close_connection(self):
+        if getattr(self, 'tracks_presence', False):
+            presence.disconnect(self.user.id)
+            await self.channel_layer.group_discard(user_group(self.user.id), self.channel_name)
+        if hasattr(self, 'outbox'):
+            await self.outbox.close()
+
+    def decode(self, text_data=None, bytes_data=None):
+        """
+        Desserializa o frame recebido. Frames `heartbeat` apenas atualizam a
+        presença do usuário e não são repassados (retorna None), assim como
+        os frames acima do limite da conexão, respondidos com um erro.
+        """
+        data = bytes_data if self.codec.binary else text_data
+        if data is None:
+            return None
+        retry_after = self.rate_bucket.take()
+        if retry_after:
+            self.push_rate_limited(retry_after)
+            return None
+        data = self.codec.decode(data)
+        if data.get('type') == 'heartbeat':
+            if self.tracks_presence:
+                presence.heartbeat(self.user.id)
+            return None
+        return data
+
+    def push_error(self, error, room_name=None, kind=DURABLE, **extra):
+        payload = {'error': error, **extra}
+        if room_name is not None:
+            payload['room'] = room_name
+        self.outbox.push(self.codec.encode(payload), kind)
+
+    def push_rate_limited(self, retry_after):
+        # Descartável: sob pressão no buffer, esses erros são os primeiros a sair.
+        self.push_error('Rate limit exceeded', kind=EPHEMERAL, retry_after=round(retry_after, 3))
+
+    async def send_frame(self, frame):
+        if self.codec.binary:
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+
+    async def close_slow_consumer(self, cursors):
+        """
+        Chamado quando o buffer de saída estoura: informa ao cliente o cursor
+        da última mensagem entregue de cada sala, para retomar pelo histórico
+        (GET chat/messages?room_name=<room_name>&after=<cursor>), e fecha a conexão.
+        """
+        await self.send_frame(self.codec.encode({
+            'type': 'resume',
+            'reason': 'slow_consumer',
+            **self.resume_cursors(cursors),
+        }))
+        await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    def resume_cursors(self, cursors):
+        """
+        Campos do frame `resume` com os cursores das salas da conexão.
+        Sem salas, o frame leva apenas o motivo.
+        """
+        return {}
+
+    async def user_revoked(self, event):
+        jti = event.get('jti')
+        if jti is not None and jti != self.scope.get('token_jti'):
+            return
+        forget(self.user.id, jti)
+        await self.outbox.close()
+        await self.close(code=REVOKED_CLOSE_CODE)
+
+
+class ChatConsumer(BaseChatConsumer):
+    """
+    Uma sala por conexão (ws/chat/<room_name>/). Exige usuário autenticado
+    e participante da sala.
+    """
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.user = self.scope.get('user', None)
-        self.room_name = self.scope['url_route']['kwargs']['room_name']
-        self.room_group_name = f'chat_{self.room_name}'
-
-        self.room = await self.get_or_create_room(self.user, self.room_name)
-        
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+            return
+
+        try:
+            self.session = RoomSession(self, self.scope['url_route']['kwargs']['room_name'])
+        except ValueError:
+            await self.close()
+            return
+        if self.user.id not in self.session.room_pair:
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+            return
+
+        await self.session.join()
+        if not await self.open_connection():
+            return
+
+        # Na reconexão o cliente informa `since_id` (última mensagem vista)
+        # e recebe apenas a lacuna, em vez da página inicial do histórico.
+        since_id = RoomSession.parse_since_id(
+            parse_qs(self.scope.get('query_string', b'').decode()).get('since_id', [None])[0]
         )
-        await self.accept()
+        try:
+            await self.session.open(since_id)
+        except ObjectDoesNotExist:
+            await self.close(code=ROOM_NOT_FOUND_CLOSE_CODE)
 
-        messages = await self.get_previous_messages(self.room)
-        await self.send(text_data=json.dumps({
-            'type': 'previous_messages',
-            'messages': messages
-        }))
-        
-        await self.mark_messages_as_read(self.room)
+    async def disconnect(self, close_code):
+        if hasattr(self, 'session') and self.session.joined:
+            await self.session.leave()
+        await self.close_connection()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode(text_data, bytes_data)
+        if data is not None:
+            await self.session.receive(data)
+
+    def push(self, session, frame, kind=DURABLE, key=None, cursor=None):
+        self.outbox.push(frame, kind, key=key, cursor=cursor, stream=session.room_name)
+
+    async def chat_message(self, event):
+        await self.session.chat_message(event)
+
+    async def user_typing(self, event):
+        await self.session.user_typing(event)
+
+    async def user_stop_typing(self, event):
+        await self.session.user_stop_typing(event)
+
+    async def mark_as_read(self, event):
+        await self.session.mark_as_read(event)
+
+    def resume_cursors(self, cursors):
+        return {'cursor': cursors.get(self.session.room_name)}
+
+
+class MultiplexChatConsumer(BaseChatConsumer):
+    """
+    Várias salas por conexão (ws/chat/), para que o número de conexões cresça
+    com o número de usuários e não com usuários x salas.
+
+    O cliente envia `{"type": "subscribe", "room": "<room_name>"}` (com
+    `since_id` opcional) e `{"type": "unsubscribe", "room": ...}`; os demais
+    frames seguem o protocolo do ChatConsumer acrescidos de `room`. Os frames
+    do servidor chegam como `{"room": "<room_name>", "frame": {...}}`, onde
+    `frame` é exatamente o que o ChatConsumer enviaria. Exige usuário
+    autenticado e só permite salas das quais ele participa.
+    """
+
+    async def connect(self):
+        self.user = self.scope.get('user', None)
+        self.sessions = {}
+        if not self.user or not self.user.is_authenticated:
+            await self.close(code=FORBIDDEN_CLOSE_CODE)
+            return
+
+        await self.open_connection()
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        sessions, self.sessions = list(self.sessions.values()), {}
+        await asyncio.gather(*(session.leave() for session in sessions))
+        await self.close_connection()
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        data = self.decode(text_data, bytes_data)
+        if data is None:
+            return
         message_type = data.get('type', 'message')
-        print(f"Received message type: {message_type}")
-        print(f"Received data: {data}")
-        
-        if message_type == 'message':
-            if not self.user or not await self.is_user_authenticated(self.user):
-                await self.send(text_data=json.dumps({
-                    'error': 'User not authenticated'
-                }))
+
+        try:
+            session = RoomSession(self, str(data.get('room', '')))
+        except ValueError:
+            self.push_error('Invalid room name format', data.get('room'))
+            return
+        room_name = session.room_name
+
+        if message_type == 'subscribe':
+            if room_name in self.sessions:
+                self.push_error('Already subscribed', room_name)
                 return
+            if self.user.id not in session.room_pair:
+                self.push_error('Forbidden', room_name)
+                return
+            if len(self.sessions) >= settings.CHAT_MULTIPLEX_MAX_ROOMS:
+                self.push_error('Too many rooms', room_name)
+                return
+
+            # Os eventos de grupo que chegarem durante a abertura só são
+            # despachados depois deste receive, quando a sala já está registrada.
+            await session.join()
+            try:
+                await session.open(RoomSession.parse_since_id(data.get('since_id')))
+            except ObjectDoesNotExist:
+                await session.leave()
+                self.push_error('Room not found', room_name)
+                return
+            self.sessions[room_name] = session
+            return
 
-            room = await self.get_or_create_room(self.user, self.room_name)
-            message = await self.create_message(self.user, room, data['message'])
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'chat_message',
-                    'message': message.content,
-                    'username': self.user.username,
-                    'timestamp': str(message.timestamp),
-                    'id': message.id,
-                    'read': message.read
-                }
-            )
-        elif message_type == 'typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_typing',
-                    'username': self.user.username,
-                }
-            )
-        elif message_type == 'stop_typing':
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'user_stop_typing',
-                    'username': self.user.username,
-                }
-            )
-        elif message_type == 'mark_as_read':
-            message_id = int(data.get('message_id', 0))
-            await self.mark_message_as_read(message_id)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'mark_as_read',
-                    'message_id': message_id,
-                }
-            )
+        session = self.sessions.get(room_name)
+        if session is None:
+            self.push_error('Not subscribed', room_name)
+            return
+
+        if message_type == 'unsubscribe':
+            del self.sessions[room_name]
+            await session.leave()
+            session.send_frame({'type': 'unsubscribed'})
+            return
+
+        await session.receive(data)
+
+    def push(self, session, frame, kind=DURABLE, key=None, cursor=None):
+        # O frame da sala já vem serializado; o envelope não o serializa de novo.
+        self.outbox.push(
+            self.codec.envelope(session.room_name, frame),
+            kind,
+            key=None if key is None else (session.room_name, key),
+            cursor=cursor,
+            stream=session.room_name,
+        )
+
+    def get_session(self, event):
+        return self.sessions.get(event.get('room'))
 
     async def chat_message(self, event):
-        message = event['message']
-        username = event['username']
-        timestamp = event['timestamp']
-        message_id = event['id']
-        read = event['read']
-
-        await self.send(text_data=json.dumps({
-            'message': message,
-            'username': username,
-            'timestamp': timestamp,
-            'id': message_id,
-            'read': read
-        }))
+        session = self.get_session(event)
+        if session is not None:
+            await session.chat_message(event)
 
     async def user_typing(self, event):
-        username = event['username']
-
-        await self.send(text_data=json.dumps({
-            'type': 'typing',
-            'username': username
-        }))
+        session = self.get_session(event)
+        if session is not None:
+            await session.user_typing(event)
 
     async def user_stop_typing(self, event):
-        username = event['username']
-
-        await self.send(text_data=json.dumps({
-            'type': 'stop_typing',
-            'username': username
-        }))
+        session = self.get_session(event)
+        if session is not None:
+            await session.user_stop_typing(event)
 
     async def mark_as_read(self, event):
-        message_id = event['message_id']
-        await self.send(text_data=json.dumps({
-            'type': 'mark_as_read',
-            'message_id': message_id
-        }))
+        session = self.get_session(event)
+        if session is not None:
+            await session.mark_as_read(event)
 
-    @database_sync_to_async
-    def get_or_create_room(self, user, room_name):
-        user_ids = list(map(int, room_name.split('_')))
-        user1 = User.objects.get(id=user_ids[0])
-        user2 = User.objects.get(id=user_ids[1])
-        return ChatRoom.get_room_by_name(user1, user2)
-
-    @database_sync_to_async 
-    def create_message(self, user, room, message):
-        print(f"Creating message: {message}")
-        return ChatMessage.objects.create(user=user, room=room, content=message)
-
-    @database_sync_to_async
-    def is_user_authenticated(self, user):
-        return user.is_active
-
-    @database_sync_to_async
-    def get_previous_messages(self, room):
-        messages = ChatMessage.objects.filter(room=room).order_by('timestamp')
-        return [
-            {
-                'id': message.id,
-                'username': message.user.username,
-                'message': message.content,
-                'timestamp': str(message.timestamp),
-                'read': message.read
-            }
-            for message in messages
-        ]
-        
-    @database_sync_to_async
-    def mark_messages_as_read(self, room):
-        return ChatMessage.objects.filter(room=room, read=False).update(read=True)
-    
-    @database_sync_to_async
-    def mark_message_as_read(self, message_id):
-        message = ChatMessage.objects.get(id=message_id)
-        message.read = True
-        message.save()
\ No newline at end of file
+    def resume_cursors(self, cursors):
+        return {
+            'cursors': {room_name: cursors.get(room_name) for room_name in self.sessions}
+        }
@@ -1,9 +1,27 @@
+import math
+from typing import Optional
+from django.conf import settings
+from django.http import HttpResponse
 from django.utils import timezone as django_timezone
 from django.shortcuts import get_object_or_404
 from ninja_extra import route, api_controller
 from ninja.errors import HttpError  # ✅ Correção aqui
-from .schemas import ChatMessageIn, ChatMessageResponse
+from .schemas import (
+    ChatMessageIn,
+    ChatMessagePageOut,
+    ChatMessageResponse,
+    ConversationOut,
+    ConversationPageOut,
+    LastMessageOut,
+    RateLimitedOut,
+    SearchPageOut,
+    SearchResultOut,
+)
 from .models import ChatMessage, ChatRoom
+from .repository import ChatMessageRepository, RoomMembershipRepository, decode_cursor, encode_cursor
+from .cache import room_cache
+from .ratelimit import message_rate_limiter
+from .search import MessageSearch, parse_terms
 from modules.users.models import User
 from ninja_jwt.authentication import JWTAuth
 from datetime import datetime
@@ -15,28 +33,31 @@ from datetime import datetime
 )
 class ChatController:
     
-    @route.post('message', response={200: ChatMessageResponse, 404: str})
-    def send_message(self, request, data: ChatMessageIn):
+    @route.post('message', response={200: ChatMessageResponse, 404: str, 429: RateLimitedOut})
+    def send_message(self, request, data: ChatMessageIn, response: HttpResponse):
         sender = request.auth
+
+        # O mesmo limite por usuário das mensagens enviadas pelo websocket.
+        retry_after = message_rate_limiter.hit(sender.id)
+        if retry_after:
+            response['Retry-After'] = str(math.ceil(retry_after))
+            return 429, {'message': 'Rate limit exceeded', 'retry_after': round(retry_after, 3)}
         recipient = User.objects.filter(id=data.recipient_id).first()
         
         if not recipient:
             raise HttpError(404, "Recipient not found")  # ✅ Correção aqui
         
-        room = ChatRoom.objects.filter(user1=sender, user2=recipient).first() or \
-            ChatRoom.objects.filter(user1=recipient, user2=sender).first()
+        room = room_cache.get_room(sender.id, recipient.id)
         
-        if not room:
-            room = ChatRoom.objects.create(user1=sender, user2=recipient)
-        
-        message = ChatMessage.objects.create(
+        message = ChatMessage(
             user=sender,
             room=room,
             content=data.content,
             timestamp=datetime.now().astimezone(django_timezone.get_current_timezone()),
         )
+        ChatMessageRepository.save_batch(messages=[message])
         
-        response = ChatMessageResponse(
+        message_out = ChatMessageResponse(
             id=message.id,
             content=message.content,
             timestamp=message.timestamp,
@@ -44,10 +65,17 @@ class ChatController:
             room=message.room.room_name,
         )
         
-        return response
+        return message_out
 
-    @route.get('messages', response={200: list[ChatMessageResponse], 404: str})
-    def get_messages(self, request, room_name: str):
+    @route.get('messages', response={200: ChatMessagePageOut, 400: str, 404: str})
+    def get_messages(
+        self,
+        request,
+        room_name: str,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: int = settings.CHAT_HISTORY_PAGE_SIZE,
+    ):
         users_ids = room_name.split("_")
         
         if len(users_ids) != 2:
@@ -58,27 +86,149 @@ class ChatController:
         except ValueError:
             raise HttpError(404, "Invalid user ID format")  # ✅ Validação extra
 
-        user1 = User.objects.filter(id=user1_id).first()
-        user2 = User.objects.filter(id=user2_id).first()
-        
-        if not user1 or not user2:
-            raise HttpError(404, "Users not found")  # ✅ Correção aqui
-        
-        room = ChatRoom.objects.filter(user1=user1, user2=user2).first() or \
-            ChatRoom.objects.filter(user1=user2, user2=user1).first()
-            
+        if before and after:
+            raise HttpError(400, "Use either 'before' or 'after', not both")
+
+        try:
+            before_cursor = ChatMessageRepository.decode_cursor(before) if before else None
+            after_cursor = ChatMessageRepository.decode_cursor(after) if after else None
+        except ValueError:
+            raise HttpError(400, "Invalid cursor")
+
+        limit = min(max(limit, 1), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+
+        room = room_cache.find_room(user1_id, user2_id)
+
         if not room:
-            room = ChatRoom.objects.create(user1=user1, user2=user2)
-            
-        messages = ChatMessage.objects.filter(room=room).select_related('user').order_by('timestamp')
-        
-        return [
-            ChatMessageResponse(
-                id=msg.id,
-                content=msg.content,
-                timestamp=msg.timestamp,
-                sender=msg.user,
+            return ChatMessagePageOut(results=[], has_more=False)
+
+        messages, has_more = ChatMessageRepository.page(
+            room_id=room.id, limit=limit, before=before_cursor, after=after_cursor
+        )
+
+        next_cursor = None
+        if has_more:
+            edge = messages[-1] if after_cursor else messages[0]
+            next_cursor = ChatMessageRepository.encode_cursor(edge)
+
+        return ChatMessagePageOut(
+            results=[
+                ChatMessageResponse(
+                    id=msg.id,
+                    content=msg.content,
+                    timestamp=msg.timestamp,
+                    sender=msg.user,
+                    room=room.room_name,
+                )
+                for msg in messages
+            ],
+            has_more=has_more,
+            next_cursor=next_cursor,
+        )
+
+    @route.get('rooms', response={200: ConversationPageOut, 400: str})
+    def list_rooms(
+        self,
+        request,
+        cursor: Optional[str] = None,
+        limit: int = settings.CHAT_HISTORY_PAGE_SIZE,
+    ):
+        try:
+            before = decode_cursor(cursor) if cursor else None
+        except ValueError:
+            raise HttpError(400, "Invalid cursor")
+
+        limit = min(max(limit, 1), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+
+        memberships, has_more = RoomMembershipRepository.inbox(
+            user_id=request.auth.id, limit=limit, before=before
+        )
+        last_messages = ChatMessageRepository.last_messages(
+            ids=[membership.room.last_message_id for membership in memberships]
+        )
+
+        results = []
+        for membership in memberships:
+            room = membership.room
+            last_message = last_messages.get(room.last_message_id)
+            results.append(ConversationOut(
+                id=room.id,
                 room=room.room_name,
-            )
-            for msg in messages
-        ]
+                peer=room.user2 if room.user1_id == request.auth.id else room.user1,
+                last_message=(
+                    LastMessageOut(
+                        id=last_message.id,
+                        content=last_message.content,
+                        sender_id=last_message.user_id,
+                        timestamp=last_message.timestamp,
+                    )
+                    if last_message else None
+                ),
+                last_activity=membership.last_activity,
+                unread_count=membership.unread_count,
+            ))
+
+        next_cursor = None
+        if has_more:
+            edge = memberships[-1]
+            next_cursor = encode_cursor(edge.last_activity, edge.id)
+
+        return ConversationPageOut(
+            results=results,
+            has_more=has_more,
+            next_cursor=next_cursor,
+        )
+
+    @route.get('search', response={200: SearchPageOut, 400: str, 404: str})
+    def search_messages(
+        self,
+        request,
+        q: str,
+        room_name: Optional[str] = None,
+        offset: int = 0,
+        limit: int = settings.CHAT_HISTORY_PAGE_SIZE,
+    ):
+        terms = parse_terms(q)
+        if not terms:
+            raise HttpError(400, "Query must contain at least one word")
+
+        if not 0 <= offset <= settings.CHAT_SEARCH_MAX_OFFSET:
+            raise HttpError(400, f"Offset must be between 0 and {settings.CHAT_SEARCH_MAX_OFFSET}")
+
+        limit = min(max(limit, 1), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+
+        room_id = None
+        if room_name is not None:
+            try:
+                user1_id, user2_id = room_cache.parse_room_name(room_name)
+            except ValueError:
+                raise HttpError(404, "Invalid room name format")
+            room = room_cache.find_room(user1_id, user2_id)
+            if not room:
+                return SearchPageOut(results=[], has_more=False)
+            room_id = room.id
+
+        hits, has_more = MessageSearch.search(
+            user_id=request.auth.id,
+            terms=terms,
+            limit=limit,
+            offset=offset,
+            room_id=room_id,
+        )
+
+        return SearchPageOut(
+            results=[
+                SearchResultOut(
+                    id=hit.message.id,
+                    content=hit.message.content,
+                    highlight=hit.highlight,
+                    rank=hit.rank,
+                    sender=hit.message.user,
+                    room=hit.message.room.room_name,
+                    timestamp=hit.message.timestamp,
+                )
+                for hit in hits
+            ],
+            has_more=has_more,
+            next_offset=offset + limit if has_more else None,
+        )
@@ -0,0 +1,184 @@
+"""
+Responsável pela serialização dos frames enviados pelo websocket.
+
+Há dois formatos, negociados pelo subprotocolo do websocket:
+
+- `chat.json` (padrão): JSON em frames de texto. Usa o `orjson` quando estiver
+  instalado e cai para o `json` da biblioteca padrão caso contrário. Datas são
+  enviadas como `str(datetime)`, como sempre foram.
+- `chat.msgpack`: MessagePack em frames binários, com as chaves e os tipos de
+  frame trocados por ids numéricos (FIELDS e TYPES) e datas em milissegundos
+  desde a época Unix. Disponível quando o `msgpack` estiver instalado.
+"""
+
+import json
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - dependência opcional
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - dependência opcional
+    msgpack = None
+
+
+def _default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return str(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def dumps(payload: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(
+            payload, default=_default, option=orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode()
+    return json.dumps(payload, default=_default)
+
+
+def loads(data: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+# Ids numéricos do formato compacto. Novos campos e tipos devem ser apenas
+# acrescentados, nunca renumerados.
+FIELDS = {
+    'type': 0,
+    'message': 1,
+    'username': 2,
+    'timestamp': 3,
+    'id': 4,
+    'read': 5,
+    'messages': 6,
+    'has_more': 7,
+    'cursor': 8,
+    'message_id': 9,
+    'user_id': 10,
+    'since_id': 11,
+    'error': 12,
+    'reason': 13,
+    'room': 14,
+    'frame': 15,
+    'cursors': 16,
+    'limit': 17,
+    'retry_after': 18,
+}
+TYPES = {
+    'message': 0,
+    'previous_messages': 1,
+    'more_messages': 2,
+    'missed_messages': 3,
+    'gap_too_large': 4,
+    'typing': 5,
+    'stop_typing': 6,
+    'mark_as_read': 7,
+    'load_more': 8,
+    'resume': 9,
+    'subscribe': 10,
+    'unsubscribe': 11,
+    'unsubscribed': 12,
+    'heartbeat': 13,
+}
+FIELD_NAMES = {field_id: name for name, field_id in FIELDS.items()}
+TYPE_NAMES = {type_id: name for name, type_id in TYPES.items()}
+
+
+def _compact(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            FIELDS.get(key, key): (
+                TYPES.get(item, item) if key == 'type' else _compact(item)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_compact(item) for item in value]
+    if isinstance(value, datetime):
+        return int(value.timestamp() * 1000)
+    return value
+
+
+def _expand(value: Any) -> Any:
+    if isinstance(value, dict):
+        return {
+            FIELD_NAMES.get(key, key): (
+                TYPE_NAMES.get(item, item) if key == FIELDS['type'] else _expand(item)
+            )
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+class JsonCodec:
+    subprotocol = 'chat.json'
+    field = 'text'
+    binary = False
+
+    @staticmethod
+    def encode(payload: Any) -> str:
+        return dumps(payload)
+
+    @staticmethod
+    def decode(data: str) -> Any:
+        return loads(data)
+
+    @staticmethod
+    def envelope(room_name: str, frame: str) -> str:
+        # Monta o envelope por concatenação, sem serializar o frame de novo.
+        return f'{{"room":"{room_name}","frame":{frame}}}'
+
+
+class CompactCodec:
+    subprotocol = 'chat.msgpack'
+    field = 'bytes'
+    binary = True
+
+    @staticmethod
+    def encode(payload: Any) -> bytes:
+        return msgpack.packb(_compact(payload))
+
+    @staticmethod
+    def decode(data: bytes) -> Any:
+        return _expand(msgpack.unpackb(data, strict_map_key=False))
+
+    @staticmethod
+    def envelope(room_name: str, frame: bytes) -> bytes:
+        # Mapa de dois itens ({room, frame}) montado por concatenação.
+        return (
+            b'\x82'
+            + msgpack.packb(FIELDS['room']) + msgpack.packb(room_name)
+            + msgpack.packb(FIELDS['frame']) + frame
+        )
+
+
+CODECS: List[Any] = [JsonCodec] + ([CompactCodec] if msgpack is not None else [])
+
+
+def negotiate(subprotocols: List[str]) -> Optional[Any]:
+    """
+    Escolhe o primeiro subprotocolo oferecido pelo cliente que o servidor
+    suporta. Sem oferta, usa JSON; com oferta sem nenhum suportado, None.
+    """
+    if not subprotocols:
+        return JsonCodec
+    for subprotocol in subprotocols:
+        for codec in CODECS:
+            if codec.subprotocol == subprotocol:
+                return codec
+    return None
+
+
+def encode_event(payload: Any) -> Dict[str, Any]:
+    """
+    Serializa um evento de grupo uma única vez em cada formato suportado;
+    cada destinatário repassa o campo do seu codec (`text` ou `bytes`).
+    """
+    return {codec.field: codec.encode(payload) for codec in CODECS}
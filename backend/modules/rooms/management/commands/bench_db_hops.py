@@ -0,0 +1,115 @@
+import asyncio
+import statistics
+import time
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from modules.rooms.models import ChatMessage, ChatRoom, RoomMembership
+from modules.rooms.repository import ChatMessageRepository, RoomMembershipRepository
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede a latência da abertura de uma sala (sala, marcas d\'água e histórico) '
+        'sob N eventos simultâneos em três estratégias: uma ida à thread do banco '
+        'por consulta, ORM assíncrono (aget/afirst/async for) e uma única ida por '
+        'evento. A espera de uma sonda periódica mostra a saturação da thread do banco. '
+        'Apenas lê o banco configurado.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=200)
+        parser.add_argument('--rounds', type=int, default=3)
+        parser.add_argument('--limit', type=int, default=50, help='Tamanho da página do histórico.')
+        parser.add_argument('--room', type=int, default=None, help='Id da sala (padrão: a primeira).')
+
+    def handle(self, *args, concurrency, rounds, limit, room, **options):
+        if room is None:
+            room = ChatRoom.objects.order_by('id').values_list('id', flat=True).first() or 0
+
+        def room_lookup():
+            return ChatRoom.objects.filter(pk=room).first()
+
+        def watermarks():
+            return RoomMembershipRepository.watermarks(room_id=room)
+
+        def history():
+            return ChatMessageRepository.page(room_id=room, limit=limit)
+
+        async def per_query():
+            await database_sync_to_async(room_lookup)()
+            await database_sync_to_async(watermarks)()
+            await database_sync_to_async(history)()
+
+        async def async_orm():
+            await ChatRoom.objects.filter(pk=room).afirst()
+            [
+                row async for row in
+                RoomMembership.objects.filter(room_id=room).values_list('user_id', 'last_read_message_id')
+            ]
+            [
+                message async for message in
+                ChatMessage.objects.filter(room_id=room).select_related('user')
+                .order_by('-timestamp', '-id')[:limit + 1]
+            ]
+
+        @database_sync_to_async
+        def grouped():
+            room_lookup()
+            watermarks()
+            history()
+
+        self.stdout.write(f'sala {room}, {concurrency} eventos simultâneos, {rounds} rodadas')
+        self.stdout.write(
+            f'{"estratégia":<28} {"p50 ms":>8} {"p99 ms":>8} {"eventos/s":>10} {"espera p99 ms":>14}'
+        )
+        for label, event in (
+            ('uma ida por consulta', per_query),
+            ('ORM assíncrono', async_orm),
+            ('uma ida por evento', grouped),
+        ):
+            latencies, waits, elapsed = async_to_sync(self._run)(event, concurrency, rounds)
+            self.stdout.write(
+                f'{label:<28} {self._ms(latencies, 50):>8.2f} {self._ms(latencies, 99):>8.2f} '
+                f'{concurrency * rounds / elapsed:>10.0f} {self._ms(waits, 99):>14.2f}'
+            )
+
+    async def _run(self, event, concurrency, rounds):
+        latencies, waits = [], []
+
+        async def timed():
+            start = time.perf_counter()
+            await event()
+            latencies.append(time.perf_counter() - start)
+
+        @database_sync_to_async
+        def noop():
+            pass
+
+        async def probe(done):
+            # Quanto uma consulta nova esperaria pela thread do banco agora.
+            while not done.is_set():
+                start = time.perf_counter()
+                await noop()
+                waits.append(time.perf_counter() - start)
+                await asyncio.sleep(0.005)
+
+        await timed()  # aquecimento (conexão, cache de consultas)
+        latencies.clear()
+
+        done = asyncio.Event()
+        prober = asyncio.ensure_future(probe(done))
+        start = time.perf_counter()
+        for _ in range(rounds):
+            await asyncio.gather(*(timed() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await prober
+        return latencies, waits or [0.0], elapsed
+
+    @staticmethod
+    def _ms(samples, percentile):
+        if len(samples) == 1:
+            return samples[0] * 1000
+        return statistics.quantiles(samples, n=100)[percentile - 1] * 1000
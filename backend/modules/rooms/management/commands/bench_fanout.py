@@ -0,0 +1,94 @@
+import asyncio
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from core.layers import LocalChannelLayer
+from modules.rooms import encoding
+
+
+class Command(BaseCommand):
+    help = (
+        'Mede o custo de entregar um evento de chat a N destinatários pela camada '
+        'de canais local (group_send, receive em cada canal e montagem do frame): '
+        'serializando em cada consumer versus uma única vez no remetente.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipients', type=int, default=1000)
+        parser.add_argument('--rounds', type=int, default=200)
+        parser.add_argument('--size', type=int, default=200, help='Tamanho do conteúdo da mensagem.')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetições; vale a melhor.')
+
+    def handle(self, *args, recipients, rounds, size, repeat, **options):
+        payload = {
+            'message': 'x' * size,
+            'username': 'alice',
+            'timestamp': '2025-01-01 12:00:00.000000+00:00',
+            'id': 123456789012345,
+            'read': False,
+        }
+
+        # Como no baseline: o evento leva os campos e cada consumer serializa.
+        def per_recipient_event():
+            return {'type': 'chat_message', **payload}
+
+        def per_recipient_frame(event):
+            return json.dumps({
+                'message': event['message'],
+                'username': event['username'],
+                'timestamp': event['timestamp'],
+                'id': event['id'],
+                'read': event['read'],
+            })
+
+        # Como hoje: o remetente serializa uma vez por formato e cada consumer
+        # repassa o campo do seu codec.
+        def pre_encoded_event():
+            return {'type': 'chat_message', **encoding.encode_event(payload)}
+
+        def pre_encoded_frame(event):
+            return event[encoding.JsonCodec.field]
+
+        results = asyncio.run(self._run(
+            recipients,
+            rounds,
+            repeat,
+            [
+                ('json.dumps por destinatário', per_recipient_event, per_recipient_frame),
+                ('encode_event uma vez', pre_encoded_event, pre_encoded_frame),
+            ],
+        ))
+
+        baseline = results[0][1]
+        self.stdout.write(
+            f'{recipients} destinatários, {rounds} rodadas, mensagem de {size} bytes '
+            f'(melhor de {repeat})'
+        )
+        for label, seconds in results:
+            per_fanout = seconds / rounds * 1e6
+            self.stdout.write(
+                f'{label:<40} {per_fanout:>10.1f} µs/fan-out '
+                f'({baseline / seconds if seconds else float("inf"):.1f}x)'
+            )
+
+    async def _run(self, recipients, rounds, repeat, cases):
+        layer = LocalChannelLayer(capacity=rounds + 1)
+        channels = [await layer.new_channel() for _ in range(recipients)]
+        for channel in channels:
+            await layer.group_add('bench', channel)
+
+        best = {label: float('inf') for label, _, _ in cases}
+        # Os casos se alternam a cada repetição, para que ruído da máquina
+        # (GC, outros processos) não pese só sobre um deles.
+        for _ in range(repeat):
+            for label, build_event, build_frame in cases:
+                sent = []
+                start = time.perf_counter()
+                for _ in range(rounds):
+                    await layer.group_send('bench', build_event())
+                    for channel in channels:
+                        # Equivalente ao dispatch do consumer seguido do send().
+                        sent.append(build_frame(await layer.receive(channel)))
+                best[label] = min(best[label], time.perf_counter() - start)
+        return [(label, best[label]) for label, _, _ in cases]
@@ -0,0 +1,52 @@
+from collections import defaultdict
+
+from django.db import migrations
+from django.db.models import Case, When, Value
+
+BATCH_SIZE = 500
+
+
+def merge_duplicate_rooms(apps, schema_editor):
+    """
+    Ordena o par (user1, user2) de cada sala e une as salas duplicadas,
+    movendo as mensagens para a sala mais antiga do par.
+    """
+    ChatRoom = apps.get_model('rooms', 'ChatRoom')
+    ChatMessage = apps.get_model('rooms', 'ChatMessage')
+
+    survivors = {}
+    merged_into = {}
+    to_swap = []
+
+    rooms = ChatRoom.objects.order_by('id').values_list('id', 'user1_id', 'user2_id')
+    for room_id, user1_id, user2_id in rooms.iterator():
+        pair = (min(user1_id, user2_id), max(user1_id, user2_id))
+        if pair in survivors:
+            merged_into[room_id] = survivors[pair]
+            continue
+        survivors[pair] = room_id
+        if (user1_id, user2_id) != pair:
+            to_swap.append(ChatRoom(id=room_id, user1_id=pair[0], user2_id=pair[1]))
+
+    duplicate_ids = list(merged_into)
+    for start in range(0, len(duplicate_ids), BATCH_SIZE):
+        batch = duplicate_ids[start:start + BATCH_SIZE]
+        ChatMessage.objects.filter(room_id__in=batch).update(
+            room_id=Case(
+                *[When(room_id=room_id, then=Value(merged_into[room_id])) for room_id in batch]
+            )
+        )
+        ChatRoom.objects.filter(id__in=batch).delete()
+
+    ChatRoom.objects.bulk_update(to_swap, ['user1', 'user2'], batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0004_chatmessage_room_timestamp_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_rooms, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0005_merge_duplicate_chatrooms'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.UniqueConstraint(fields=('user1', 'user2'), name='chatroom_unique_pair'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatroom',
+            constraint=models.CheckConstraint(condition=models.Q(('user1__lte', models.F('user2'))), name='chatroom_ordered_pair'),
+        ),
+    ]
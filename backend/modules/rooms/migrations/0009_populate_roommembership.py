@@ -0,0 +1,52 @@
+from django.db import migrations
+from django.db.models import Max
+
+BATCH_SIZE = 500
+
+
+def populate_memberships(apps, schema_editor):
+    """
+    Cria as participações das salas existentes. A marca d'água de cada
+    participante é a maior mensagem do outro participante já marcada como lida.
+    """
+    ChatRoom = apps.get_model('rooms', 'ChatRoom')
+    ChatMessage = apps.get_model('rooms', 'ChatMessage')
+    RoomMembership = apps.get_model('rooms', 'RoomMembership')
+
+    last_read = {
+        (row['room_id'], row['user_id']): row['last_id']
+        for row in ChatMessage.objects.filter(read=True)
+        .values('room_id', 'user_id')
+        .annotate(last_id=Max('id'))
+    }
+
+    memberships = []
+    rooms = ChatRoom.objects.values_list('id', 'user1_id', 'user2_id')
+    for room_id, user1_id, user2_id in rooms.iterator():
+        memberships.append(RoomMembership(
+            room_id=room_id,
+            user_id=user1_id,
+            last_read_message_id=last_read.get((room_id, user2_id), 0),
+        ))
+        if user2_id != user1_id:
+            memberships.append(RoomMembership(
+                room_id=room_id,
+                user_id=user2_id,
+                last_read_message_id=last_read.get((room_id, user1_id), 0),
+            ))
+        if len(memberships) >= BATCH_SIZE:
+            RoomMembership.objects.bulk_create(memberships, ignore_conflicts=True)
+            memberships = []
+
+    RoomMembership.objects.bulk_create(memberships, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0008_roommembership'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_memberships, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+from django.db import migrations
+from django.db.models import Max
+
+BATCH_SIZE = 500
+
+
+def populate_counters(apps, schema_editor):
+    """
+    Preenche a última mensagem, a última atividade e os contadores de não
+    lidas das salas existentes.
+    """
+    ChatRoom = apps.get_model('rooms', 'ChatRoom')
+    ChatMessage = apps.get_model('rooms', 'ChatMessage')
+    RoomMembership = apps.get_model('rooms', 'RoomMembership')
+
+    last_ids = dict(
+        ChatMessage.objects.values('room_id')
+        .annotate(last_id=Max('id'))
+        .values_list('room_id', 'last_id')
+    )
+    last_timestamps = {}
+    message_ids = list(last_ids.values())
+    for start in range(0, len(message_ids), BATCH_SIZE):
+        last_timestamps.update(
+            ChatMessage.objects
+            .filter(id__in=message_ids[start:start + BATCH_SIZE])
+            .values_list('room_id', 'timestamp')
+        )
+
+    rooms = [
+        ChatRoom(id=room_id, last_message_id=last_id, last_activity=last_timestamps[room_id])
+        for room_id, last_id in last_ids.items()
+    ]
+    ChatRoom.objects.bulk_update(rooms, ['last_message_id', 'last_activity'], batch_size=BATCH_SIZE)
+
+    memberships = []
+    for membership in RoomMembership.objects.filter(room__last_message_id__isnull=False).iterator():
+        membership.last_activity = last_timestamps[membership.room_id]
+        membership.unread_count = (
+            ChatMessage.objects
+            .filter(room_id=membership.room_id, id__gt=membership.last_read_message_id)
+            .exclude(user_id=membership.user_id)
+            .count()
+        )
+        memberships.append(membership)
+        if len(memberships) >= BATCH_SIZE:
+            RoomMembership.objects.bulk_update(memberships, ['last_activity', 'unread_count'])
+            memberships = []
+
+    RoomMembership.objects.bulk_update(memberships, ['last_activity', 'unread_count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0011_conversation_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+from django.db import migrations
+
+# SQLite: tabela FTS5 com conteúdo externo (o próprio rooms_chatmessage),
+# mantida por triggers a cada INSERT, DELETE e UPDATE do conteúdo.
+#
+# Atenção: no SQLite, migrações que recriam a tabela rooms_chatmessage
+# (ex.: AlterField) descartam os triggers junto com a tabela antiga. Os
+# triggers que faltarem são recriados ao fim de cada migrate (ver
+# modules.rooms.search.ensure_sqlite_triggers).
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS rooms_chatmessage_fts USING fts5(
+        content,
+        content='rooms_chatmessage',
+        content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_insert
+    AFTER INSERT ON rooms_chatmessage BEGIN
+        INSERT INTO rooms_chatmessage_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_delete
+    AFTER DELETE ON rooms_chatmessage BEGIN
+        INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_update
+    AFTER UPDATE OF content ON rooms_chatmessage BEGIN
+        INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts, rowid, content)
+        VALUES ('delete', old.id, old.content);
+        INSERT INTO rooms_chatmessage_fts (rowid, content) VALUES (new.id, new.content);
+    END
+    """,
+    "INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts) VALUES ('rebuild')",
+]
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS rooms_chatmessage_fts_update',
+    'DROP TRIGGER IF EXISTS rooms_chatmessage_fts_delete',
+    'DROP TRIGGER IF EXISTS rooms_chatmessage_fts_insert',
+    'DROP TABLE IF EXISTS rooms_chatmessage_fts',
+]
+
+# PostgreSQL: índice GIN sobre a mesma expressão usada nas consultas de
+# modules.rooms.search, mantido pelo próprio banco.
+POSTGRESQL_FORWARD = [
+    """
+    CREATE INDEX IF NOT EXISTS chatmsg_content_search_idx
+    ON rooms_chatmessage USING GIN (to_tsvector('simple', content))
+    """,
+]
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS chatmsg_content_search_idx',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0012_populate_conversation_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run({'sqlite': SQLITE_FORWARD, 'postgresql': POSTGRESQL_FORWARD}),
+            run({'sqlite': SQLITE_REVERSE, 'postgresql': POSTGRESQL_REVERSE}),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.18 on 2026-10-18 20:39
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rooms', '0013_chatmessage_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='roommembership',
+            index=models.Index(fields=['-last_activity'], name='roommember_activity_idx'),
+        ),
+    ]
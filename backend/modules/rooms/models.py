@@ -1,5 +1,7 @@
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from core.utils.snowflake import next_id
 from modules.users.models import User
 
 class ChatRoom(models.Model):
@@ -14,31 +16,57 @@ class ChatRoom(models.Model):
         related_name="chat_room_last_user",
     )
     
+    # Desnormalizados para a listagem de conversas; mantidos pelo
+    # ChatRoomRepository.record_activity a cada gravação de mensagens.
+    last_message_id = models.BigIntegerField(null=True, blank=True)
+    last_activity = models.DateTimeField(null=True, blank=True)
+    
     @property
     def room_name(self):
-        sorted_ids = sorted([self.user1.id, self.user2.id])
+        sorted_ids = sorted([self.user1_id, self.user2_id])
         return f'{sorted_ids[0]}_{sorted_ids[1]}'
     
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user1', 'user2'],
+                name='chatroom_unique_pair',
+            ),
+            models.CheckConstraint(
+                condition=models.Q(user1__lte=models.F('user2')),
+                name='chatroom_ordered_pair',
+            ),
+        ]
+    
+    def save(self, *args, **kwargs):
+        if self.user1_id is not None and self.user2_id is not None:
+            self.user1_id, self.user2_id = self.canonical_pair(self.user1_id, self.user2_id)
+        super().save(*args, **kwargs)
+    
+    @staticmethod
+    def canonical_pair(user1_id, user2_id):
+        """
+        Retorna o par de usuários na ordem canônica (menor id primeiro),
+        que é a forma como a sala é armazenada.
+        """
+        if user1_id <= user2_id:
+            return user1_id, user2_id
+        return user2_id, user1_id
+    
     @staticmethod
     def get_room_by_name(user1, user2):
-        sorted_ids = sorted([user1.id, user2.id])
-        room_name = f'{sorted_ids[0]}_{sorted_ids[1]}'
-        
-        room = ChatRoom.objects.filter(
-            user1_id=sorted_ids[0], user2_id=sorted_ids[1]
-        ).first()
-        
-        if not room:
-            room = ChatRoom.objects.create(user1=user1, user2=user2)
-        
+        low_id, high_id = ChatRoom.canonical_pair(user1.id, user2.id)
+        room, _ = ChatRoom.objects.get_or_create(user1_id=low_id, user2_id=high_id)
         return room
     
 class ChatMessage(models.Model):
+    # Ids pré-alocados e ordenados pelo tempo, para que a mensagem possa ser
+    # enviada aos clientes antes de ser persistida (ver pipeline.MessageWriter).
+    id = models.BigIntegerField(primary_key=True, default=next_id, editable=False)
     room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='messages')
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
     content = models.TextField()
-    read = models.BooleanField(default=False)
     
     last_user = models.ForeignKey(
         User,
@@ -48,6 +76,50 @@ class ChatMessage(models.Model):
         related_name="chat_message_last_user",
     )
     
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['room', 'timestamp', 'id'],
+                name='chatmsg_room_ts_id_idx',
+            ),
+            models.Index(
+                fields=['room', 'id'],
+                name='chatmsg_room_id_idx',
+            ),
+        ]
     
     def __str__(self):
-        return f'{self.user.username} : {self.content}'
\ No newline at end of file
+        return f'{self.user.username} : {self.content}'
+
+class RoomMembership(models.Model):
+    """
+    Responsável por guardar, para cada participante da sala, o id da última
+    mensagem lida (marca d'água de leitura).
+    """
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name='memberships')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='room_memberships')
+    last_read_message_id = models.BigIntegerField(default=0)
+    unread_count = models.PositiveIntegerField(default=0)
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['room', 'user'],
+                name='roommembership_unique_member',
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-last_activity', '-id'],
+                name='roommember_inbox_idx',
+            ),
+            # Participações mais recentes de todos os usuários (typeahead).
+            models.Index(
+                fields=['-last_activity'],
+                name='roommember_activity_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user_id} @ {self.room_id} : {self.last_read_message_id}'
@@ -0,0 +1,162 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Dict, Hashable, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+# Tipos de frame, do mais descartável para o menos descartável.
+EPHEMERAL = 'ephemeral'
+COALESCE = 'coalesce'
+DURABLE = 'durable'
+
+
+class Frame(NamedTuple):
+    kind: str
+    key: Optional[Hashable]
+    text: Union[str, bytes]
+    cursor: Optional[str]
+    stream: Optional[Hashable]
+    size: int
+
+
+_OVERFLOW = Frame(DURABLE, None, '', None, None, 0)
+
+
+def frame_size(text: Union[str, bytes]) -> int:
+    """
+    Tamanho do frame em bytes, como vai para o socket: frames de texto
+    são enviados em UTF-8.
+    """
+    if isinstance(text, bytes):
+        return len(text)
+    return len(text.encode('utf-8'))
+
+
+class OutboundBuffer:
+    """
+    Responsável pelo buffer de saída de uma conexão websocket.
+
+    Os handlers apenas enfileiram os frames; uma única tarefa os envia na
+    ordem em que chegaram, de modo que um cliente lento não bloqueia o
+    consumer. Quando o buffer passa de `high_water` bytes:
+
+    1. os frames efêmeros (ex.: digitando) enfileirados e o novo são descartados;
+    2. os frames com a mesma chave (ex.: recibos de leitura) são coalescidos,
+       mantendo apenas o mais recente;
+    3. se ainda assim não couber, o buffer é descartado e `on_overflow` é
+       chamado com o cursor do último frame efetivamente enviado de cada
+       stream (sala), para que o cliente possa retomar pelo histórico.
+    """
+
+    def __init__(
+        self,
+        *,
+        send: Callable[[Union[str, bytes]], Awaitable[None]],
+        on_overflow: Callable[[Dict[Hashable, str]], Awaitable[None]],
+        high_water: int,
+    ) -> None:
+        self._send = send
+        self._on_overflow = on_overflow
+        self.high_water = high_water
+        self.cursors: Dict[Hashable, str] = {}
+        self.overflowed = False
+        self.dropped = 0
+        self._queue = deque()
+        self._size = 0
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def push(
+        self,
+        text: Union[str, bytes],
+        kind: str = DURABLE,
+        key: Optional[Hashable] = None,
+        cursor: Optional[str] = None,
+        stream: Optional[Hashable] = None,
+    ) -> None:
+        """
+        Enfileira o frame já serializado. `cursor` identifica a posição no
+        histórico de `stream` que o cliente terá alcançado após receber este
+        frame.
+        """
+        if self.overflowed:
+            return
+
+        frame = Frame(kind, key, text, cursor, stream, frame_size(text))
+        if self._queue and self._size + frame.size > self.high_water:
+            if not self._relieve(frame):
+                return
+
+        self._queue.append(frame)
+        self._size += frame.size
+        self._ready.set()
+
+    def _relieve(self, frame: Frame) -> bool:
+        """
+        Aplica a política de estouro. Retorna se o novo frame deve ser
+        enfileirado.
+        """
+        queued = [item for item in self._queue if item.kind != EPHEMERAL]
+        if frame.kind == EPHEMERAL:
+            self._replace(queued)
+            self.dropped += 1
+            return False
+
+        seen = {frame.key} if frame.kind == COALESCE else set()
+        kept = []
+        for item in reversed(queued):
+            if item.kind == COALESCE:
+                if item.key in seen:
+                    continue
+                seen.add(item.key)
+            kept.append(item)
+        kept.reverse()
+        self._replace(kept)
+
+        if self._size + frame.size <= self.high_water:
+            return True
+
+        self.overflowed = True
+        self._replace([_OVERFLOW])
+        self.dropped += 1
+        self._ready.set()
+        return False
+
+    def _replace(self, frames) -> None:
+        self.dropped += max(len(self._queue) - len(frames), 0)
+        self._queue = deque(frames)
+        self._size = sum(frame.size for frame in frames)
+
+    async def _run(self) -> None:
+        while True:
+            if not self._queue:
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+
+            frame = self._queue.popleft()
+            if frame is _OVERFLOW:
+                await self._on_overflow(self.cursors)
+                return
+
+            self._size -= frame.size
+            await self._send(frame.text)
+            if frame.cursor is not None:
+                self.cursors[frame.stream] = frame.cursor
+
+    async def close(self) -> None:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception('Outbound buffer writer failed')
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+from typing import List, Optional, Tuple
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from .models import ChatMessage
+from .repository import ChatMessageRepository
+
+logger = logging.getLogger(__name__)
+
+FANOUT_FIRST = 'fanout_first'
+PERSIST_FIRST = 'persist_first'
+
+
+class MessageWriter:
+    """
+    Responsável pelo modo write-behind das mensagens do chat.
+
+    As mensagens já chegam com id e timestamp definidos (ver ChatMessage.id),
+    são acumuladas em memória e persistidas com `bulk_create` (junto com os
+    contadores das salas) quando o lote atinge `batch_size` ou quando
+    `flush_interval` segundos se passam.
+
+    Com durabilidade `fanout_first`, `submit` retorna imediatamente e a mensagem
+    pode ser enviada aos clientes antes do commit. Com `persist_first`, `submit`
+    aguarda o commit do lote.
+
+    Um lote que falha é tentado de novo até `retries` vezes, com espera de
+    `retry_backoff` segundos dobrando a cada tentativa; enquanto isso as
+    novas mensagens continuam pendentes, até `max_pending`. Esgotadas as
+    tentativas, o lote é descartado: em `persist_first` os `submit` do lote
+    lançam o erro; em `fanout_first`, em que as mensagens já foram entregues,
+    os ids vão para o log e a contagem para `failed`.
+    """
+
+    def __init__(
+        self,
+        *,
+        enabled: bool,
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int,
+        durability: str,
+        retries: int,
+        retry_backoff: float,
+    ) -> None:
+        if durability not in (FANOUT_FIRST, PERSIST_FIRST):
+            raise ValueError(f'Invalid durability: {durability}')
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.durability = durability
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.failed = 0
+        self._pending: List[Tuple[ChatMessage, Optional[asyncio.Future]]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._flushing: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def submit(self, message: ChatMessage) -> ChatMessage:
+        """
+        Enfileira a mensagem para persistência em lote.
+        """
+        if len(self._pending) >= self.max_pending:
+            await self.flush()
+
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future() if self.durability == PERSIST_FIRST else None
+        self._pending.append((message, waiter))
+
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.flush_interval, self._schedule_flush)
+
+        if waiter is not None:
+            await waiter
+        return message
+
+    def _schedule_flush(self) -> None:
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> None:
+        """
+        Persiste todas as mensagens pendentes, em lotes de `batch_size`.
+        """
+        async with self._get_lock():
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            while self._pending:
+                batch = self._pending[:self.batch_size]
+                del self._pending[:self.batch_size]
+                messages = [message for message, _ in batch]
+
+                try:
+                    await self._persist_with_retry(messages)
+                except Exception as error:
+                    self.failed += len(messages)
+                    logger.exception(
+                        'Failed to persist %d chat messages (ids %s)',
+                        len(messages), [message.id for message in messages],
+                    )
+                    for _, waiter in batch:
+                        if waiter is not None and not waiter.done():
+                            waiter.set_exception(error)
+                    continue
+
+                for _, waiter in batch:
+                    if waiter is not None and not waiter.done():
+                        waiter.set_result(None)
+
+    async def drain(self) -> None:
+        """
+        Persiste o que estiver pendente. Usado no desligamento do servidor.
+        """
+        if self._flushing is not None and not self._flushing.done():
+            await self._flushing
+        await self.flush()
+
+    async def _persist_with_retry(self, messages: List[ChatMessage]) -> None:
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._persist(messages)
+            except Exception:
+                if attempt == self.retries:
+                    raise
+                delay = self.retry_backoff * 2 ** attempt
+                logger.warning(
+                    'Failed to persist %d chat messages; retrying in %.2fs',
+                    len(messages), delay, exc_info=True,
+                )
+                await asyncio.sleep(delay)
+
+    @database_sync_to_async
+    def _persist(self, messages: List[ChatMessage]) -> None:
+        ChatMessageRepository.save_batch(messages=messages)
+
+
+message_writer = MessageWriter(
+    enabled=settings.CHAT_WRITE_BEHIND['ENABLED'],
+    batch_size=settings.CHAT_WRITE_BEHIND['BATCH_SIZE'],
+    flush_interval=settings.CHAT_WRITE_BEHIND['FLUSH_INTERVAL'],
+    max_pending=settings.CHAT_WRITE_BEHIND['MAX_PENDING'],
+    durability=settings.CHAT_WRITE_BEHIND['DURABILITY'],
+    retries=settings.CHAT_WRITE_BEHIND['RETRIES'],
+    retry_backoff=settings.CHAT_WRITE_BEHIND['RETRY_BACKOFF'],
+)
@@ -0,0 +1,7 @@
+from django.conf import settings
+from core.utils.ratelimit import build_rate_limiter
+
+# Mensagens por usuário, somando o websocket e o POST chat/message.
+message_rate_limiter = build_rate_limiter(
+    settings.CHAT_RATE_LIMIT['USER'], key_prefix='ratelimit:chat:user'
+)
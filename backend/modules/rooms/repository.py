@@ -1 +1,300 @@
-# Repository
\ No newline at end of file
+# Repository
+
+import base64
+import binascii
+from datetime import datetime, timedelta, timezone
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+from core.utils.changes import Repository
+from .models import ChatMessage, ChatRoom, RoomMembership
+
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+Cursor = Tuple[datetime, int]
+
+
+def encode_cursor(timestamp: datetime, pk: int) -> str:
+    """
+    Gera um cursor opaco a partir do par (timestamp, id).
+    """
+    micros = (timestamp - EPOCH) // timedelta(microseconds=1)
+    raw = f'{micros}:{pk}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Cursor:
+    """
+    Converte o cursor opaco de volta para o par (timestamp, id).
+    Lança ValueError caso o cursor seja inválido.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        micros, pk = base64.urlsafe_b64decode(padded).decode().split(':')
+        return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError) as error:
+        raise ValueError('Invalid cursor') from error
+
+
+class ChatRoomRepository(Repository):
+
+    model = ChatRoom
+
+    @classmethod
+    def find(cls, *, user_a_id: int, user_b_id: int) -> Optional[ChatRoom]:
+        """
+        Busca a sala entre dois usuários pelo par canônico, sem criá-la.
+        """
+        user1_id, user2_id = cls.model.canonical_pair(user_a_id, user_b_id)
+        return cls.model.objects.filter(user1_id=user1_id, user2_id=user2_id).first()
+
+    @classmethod
+    def record_activity(cls, *, room_id: int, messages: List[ChatMessage]) -> None:
+        """
+        Atualiza a última mensagem e a última atividade da sala e soma as novas
+        mensagens ao contador de não lidas de cada participante (exceto as que
+        ele mesmo enviou). Custa dois UPDATEs por sala, independente do lote.
+        """
+        last = max(messages, key=lambda message: message.id)
+        cls.model.objects.filter(
+            Q(last_message_id__isnull=True) | Q(last_message_id__lt=last.id),
+            id=room_id,
+        ).update(last_message_id=last.id, last_activity=last.timestamp)
+
+        total = len(messages)
+        sent_by = Counter(message.user_id for message in messages)
+        RoomMembership.objects.filter(room_id=room_id).update(
+            unread_count=F('unread_count') + Case(
+                # No write-behind o leitor pode ter avançado a marca d'água
+                # antes do lote ser persistido.
+                When(last_read_message_id__gte=last.id, then=Value(0)),
+                *[
+                    When(user_id=user_id, then=Value(total - sent))
+                    for user_id, sent in sent_by.items()
+                ],
+                default=Value(total),
+                output_field=IntegerField(),
+            ),
+            last_activity=Greatest(
+                Coalesce(F('last_activity'), Value(last.timestamp)),
+                Value(last.timestamp),
+            ),
+        )
+
+
+class ChatMessageRepository(Repository):
+
+    model = ChatMessage
+
+    @classmethod
+    def encode_cursor(cls, message: ChatMessage) -> str:
+        return encode_cursor(message.timestamp, message.id)
+
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> Cursor:
+        return decode_cursor(cursor)
+
+    @classmethod
+    def last_messages(cls, *, ids: List[Optional[int]]) -> Dict[int, ChatMessage]:
+        """
+        Busca, em uma única consulta, as mensagens pelos ids informados.
+        """
+        return cls.model.objects.only(
+            'id', 'content', 'user_id', 'timestamp'
+        ).in_bulk([message_id for message_id in ids if message_id is not None])
+
+    @classmethod
+    def save_batch(cls, *, messages: List[ChatMessage]) -> None:
+        """
+        Persiste as mensagens e atualiza, na mesma transação, os campos
+        desnormalizados das salas envolvidas.
+        """
+        by_room = defaultdict(list)
+        for message in messages:
+            by_room[message.room_id].append(message)
+
+        with transaction.atomic():
+            if len(messages) == 1:
+                messages[0].save(force_insert=True)
+            else:
+                cls.model.objects.bulk_create(messages)
+            for room_id, room_messages in by_room.items():
+                ChatRoomRepository.record_activity(room_id=room_id, messages=room_messages)
+
+    @classmethod
+    def page(
+        cls,
+        *,
+        room_id: int,
+        limit: int,
+        before: Optional[Cursor] = None,
+        after: Optional[Cursor] = None,
+    ) -> Tuple[List[ChatMessage], bool]:
+        """
+        Retorna uma página do histórico da sala em ordem cronológica usando
+        paginação por chave (timestamp, id), em uma única consulta com o autor.
+
+        Sem cursor, retorna as últimas `limit` mensagens. Com `before`, pagina
+        para trás a partir do cursor; com `after`, pagina para frente.
+        O segundo item do retorno indica se existem mais mensagens na direção
+        paginada.
+        """
+        queryset = (
+            cls.model.objects
+            .filter(room_id=room_id)
+            .select_related('user')
+            .only(
+                'id', 'room_id', 'content', 'timestamp',
+                'user__id', 'user__username', 'user__email', 'user__name',
+            )
+        )
+
+        if after is not None:
+            timestamp, message_id = after
+            queryset = queryset.filter(
+                Q(timestamp__gt=timestamp) | Q(timestamp=timestamp, id__gt=message_id)
+            ).order_by('timestamp', 'id')
+        else:
+            if before is not None:
+                timestamp, message_id = before
+                queryset = queryset.filter(
+                    Q(timestamp__lt=timestamp) | Q(timestamp=timestamp, id__lt=message_id)
+                )
+            queryset = queryset.order_by('-timestamp', '-id')
+
+        messages = list(queryset[:limit + 1])
+        has_more = len(messages) > limit
+        messages = messages[:limit]
+
+        if after is None:
+            messages.reverse()
+
+        return messages, has_more
+
+    @classmethod
+    def since(
+        cls,
+        *,
+        room_id: int,
+        since_id: int,
+        limit: int,
+    ) -> Tuple[List[ChatMessage], bool]:
+        """
+        Retorna, em ordem cronológica, as mensagens da sala com id maior que
+        `since_id`, como uma faixa no índice (room, id). O segundo item do
+        retorno indica que a lacuna tem mais de `limit` mensagens, caso em que
+        a lista volta vazia.
+        """
+        messages = list(
+            cls.model.objects
+            .filter(room_id=room_id, id__gt=since_id)
+            .select_related('user')
+            .only(
+                'id', 'room_id', 'content', 'timestamp',
+                'user__id', 'user__username', 'user__email', 'user__name',
+            )
+            .order_by('id')[:limit + 1]
+        )
+        if len(messages) > limit:
+            return [], True
+        return messages, False
+
+
+class RoomMembershipRepository(Repository):
+
+    model = RoomMembership
+
+    @classmethod
+    def create_for_room(cls, *, room: ChatRoom) -> None:
+        """
+        Cria as participações dos dois usuários da sala.
+        """
+        cls.model.objects.bulk_create(
+            [
+                cls.model(room_id=room.id, user_id=user_id)
+                for user_id in {room.user1_id, room.user2_id}
+            ],
+            ignore_conflicts=True,
+        )
+
+    @classmethod
+    def watermarks(cls, *, room_id: int) -> Dict[int, int]:
+        """
+        Retorna o id da última mensagem lida por cada participante da sala.
+        """
+        return dict(
+            cls.model.objects
+            .filter(room_id=room_id)
+            .values_list('user_id', 'last_read_message_id')
+        )
+
+    @classmethod
+    def advance(cls, *, room_id: int, user_id: int, message_id: int) -> bool:
+        """
+        Avança a marca d'água de leitura do participante em um único UPDATE,
+        sem nunca retrocedê-la, recalculando o contador de não lidas como uma
+        faixa no índice (room, id). Retorna se houve alteração.
+        """
+        unread = (
+            ChatMessage.objects
+            .filter(room_id=OuterRef('room_id'), id__gt=message_id)
+            .exclude(user_id=OuterRef('user_id'))
+            .values('room_id')
+            .annotate(total=Count('id'))
+            .values('total')
+        )
+        return bool(
+            cls.model.objects.filter(
+                room_id=room_id,
+                user_id=user_id,
+                last_read_message_id__lt=message_id,
+            ).update(
+                last_read_message_id=message_id,
+                unread_count=Coalesce(Subquery(unread), 0),
+            )
+        )
+
+    @classmethod
+    def unread_count(cls, *, room_id: int, user_id: int, last_read_message_id: int) -> int:
+        """
+        Conta as mensagens de outros participantes após a marca d'água,
+        como uma faixa no índice (room, id).
+        """
+        return (
+            ChatMessage.objects
+            .filter(room_id=room_id, id__gt=last_read_message_id)
+            .exclude(user_id=user_id)
+            .count()
+        )
+
+    @classmethod
+    def inbox(
+        cls,
+        *,
+        user_id: int,
+        limit: int,
+        before: Optional[Cursor] = None,
+    ) -> Tuple[List[RoomMembership], bool]:
+        """
+        Retorna uma página das conversas do usuário, da mais recente para a
+        mais antiga, paginada por chave (last_activity, id) sobre o índice
+        roommember_inbox_idx. Salas sem mensagens não aparecem.
+        """
+        queryset = (
+            cls.model.objects
+            .filter(user_id=user_id, last_activity__isnull=False)
+            .select_related('room', 'room__user1', 'room__user2')
+            .order_by('-last_activity', '-id')
+        )
+        if before is not None:
+            last_activity, membership_id = before
+            queryset = queryset.filter(
+                Q(last_activity__lt=last_activity)
+                | Q(last_activity=last_activity, id__lt=membership_id)
+            )
+
+        memberships = list(queryset[:limit + 1])
+        return memberships[:limit], len(memberships) > limit
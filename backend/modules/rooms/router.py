@@ -1,6 +1,7 @@
 from django.urls import re_path
-from .consumer import ChatConsumer
+from .consumer import ChatConsumer, MultiplexChatConsumer
 
 websocket_urlpatterns = [
+    re_path(r'ws/chat/$', MultiplexChatConsumer.as_asgi()),
     re_path(r'ws/chat/(?P<room_name>\w+)/$', ChatConsumer.as_asgi()),
-]
\ No newline at end of file
+]
@@ -1,5 +1,5 @@
 from ninja import Schema
-from typing import List
+from typing import List, Optional
 from datetime import datetime
 from modules.users.schemas import UserOutSchema
 
@@ -15,8 +15,51 @@ class ChatMessageResponse(Schema):
     sender: UserOutSchema
     room: str
     timestamp: datetime
+
+class LastMessageOut(Schema):
+    id: int
+    content: str
+    sender_id: int
+    timestamp: datetime
+
+class ConversationOut(Schema):
+    id: int
+    room: str
+    peer: UserOutSchema
+    last_message: Optional[LastMessageOut] = None
+    last_activity: Optional[datetime] = None
+    unread_count: int
+
+class ConversationPageOut(Schema):
+    results: List[ConversationOut]
+    has_more: bool
+    next_cursor: Optional[str] = None
+
+class ChatMessagePageOut(Schema):
+    results: List[ChatMessageResponse]
+    has_more: bool
+    next_cursor: Optional[str] = None
     
 class ChatRoomOut(Schema):
     id: int
     users: List[int]
-    messages: List[ChatMessageResponse]
\ No newline at end of file
+    messages: List[ChatMessageResponse]
+
+class SearchResultOut(Schema):
+    id: int
+    content: str
+    highlight: str
+    rank: float
+    sender: UserOutSchema
+    room: str
+    timestamp: datetime
+
+class SearchPageOut(Schema):
+    results: List[SearchResultOut]
+    has_more: bool
+    next_offset: Optional[int] = None
+
+
+class RateLimitedOut(Schema):
+    message: str
+    retry_after: float
@@ -0,0 +1,241 @@
+"""
+Responsável pela busca textual no conteúdo das mensagens.
+
+O índice invertido é mantido pelo banco a cada mensagem criada, alterada ou
+removida (migração 0013_chatmessage_search_index):
+
+- SQLite: tabela FTS5 `rooms_chatmessage_fts` alimentada por triggers, com
+  ranking por bm25 e trechos destacados por `snippet`.
+- PostgreSQL: índice GIN sobre `to_tsvector('simple', content)`, com ranking
+  por `ts_rank_cd` e trechos destacados por `ts_headline`.
+
+Nos demais bancos, a busca cai para `icontains` (varredura), ordenada das
+mensagens mais recentes para as mais antigas.
+
+No SQLite, migrações que recriam a tabela rooms_chatmessage descartam os
+triggers; `ensure_sqlite_triggers` os recria (e reconstrói o índice) ao fim
+de cada `migrate` (ver modules.rooms.signals).
+
+A consulta é reduzida a palavras (todas obrigatórias), de modo que a sintaxe
+de busca do banco nunca é exposta ao cliente. A busca fica restrita às salas
+das quais o usuário participa (RoomMembership).
+"""
+
+import html
+import logging
+import re
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+from .models import ChatMessage
+
+logger = logging.getLogger(__name__)
+
+# Marcadores dos termos encontrados no trecho destacado. São trocados por
+# <mark>...</mark> depois de o trecho ser escapado.
+MARK_START = '\x02'
+MARK_END = '\x03'
+
+TERM_PATTERN = re.compile(r'\w+')
+
+# Os mesmos triggers da migração 0013_chatmessage_search_index.
+SQLITE_TRIGGERS = {
+    'rooms_chatmessage_fts_insert': """
+        CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_insert
+        AFTER INSERT ON rooms_chatmessage BEGIN
+            INSERT INTO rooms_chatmessage_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """,
+    'rooms_chatmessage_fts_delete': """
+        CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_delete
+        AFTER DELETE ON rooms_chatmessage BEGIN
+            INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+        END
+    """,
+    'rooms_chatmessage_fts_update': """
+        CREATE TRIGGER IF NOT EXISTS rooms_chatmessage_fts_update
+        AFTER UPDATE OF content ON rooms_chatmessage BEGIN
+            INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts, rowid, content)
+            VALUES ('delete', old.id, old.content);
+            INSERT INTO rooms_chatmessage_fts (rowid, content) VALUES (new.id, new.content);
+        END
+    """,
+}
+
+
+@dataclass
+class SearchHit:
+    message: ChatMessage
+    highlight: str
+    rank: float
+
+
+def parse_terms(query: str) -> List[str]:
+    return TERM_PATTERN.findall(query.lower())[:settings.CHAT_SEARCH_MAX_TERMS]
+
+
+def ensure_sqlite_triggers(db) -> List[str]:
+    """
+    Recria os triggers do índice FTS5 que estiverem faltando e, nesse caso,
+    reconstrói o índice. Retorna os nomes dos triggers recriados. Não faz
+    nada fora do SQLite ou antes da migração que cria o índice.
+    """
+    if db.vendor != 'sqlite':
+        return []
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master WHERE name = 'rooms_chatmessage_fts' "
+            "OR (type = 'trigger' AND tbl_name = 'rooms_chatmessage')"
+        )
+        existing = {name for _, name in cursor.fetchall()}
+        if 'rooms_chatmessage_fts' not in existing:
+            return []
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        if not missing:
+            return []
+        logger.warning('Recreating dropped message search triggers: %s', ', '.join(missing))
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute("INSERT INTO rooms_chatmessage_fts (rooms_chatmessage_fts) VALUES ('rebuild')")
+    return missing
+
+
+def render_highlight(text: str) -> str:
+    return (
+        html.escape(text)
+        .replace(MARK_START, '<mark>')
+        .replace(MARK_END, '</mark>')
+    )
+
+
+class MessageSearch:
+
+    @classmethod
+    def search(
+        cls,
+        *,
+        user_id: int,
+        terms: List[str],
+        limit: int,
+        offset: int = 0,
+        room_id: Optional[int] = None,
+    ) -> Tuple[List[SearchHit], bool]:
+        """
+        Retorna uma página das mensagens que contêm todos os termos, das
+        mais relevantes para as menos relevantes. O segundo item do retorno
+        indica se existem mais resultados.
+        """
+        if connection.vendor == 'sqlite':
+            rows = cls._sqlite(user_id, terms, limit + 1, offset, room_id)
+        elif connection.vendor == 'postgresql':
+            rows = cls._postgresql(user_id, terms, limit + 1, offset, room_id)
+        else:
+            return cls._fallback(user_id, terms, limit, offset, room_id)
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+        messages = (
+            ChatMessage.objects
+            .select_related('user', 'room')
+            .only(
+                'id', 'content', 'timestamp',
+                'room__id', 'room__user1_id', 'room__user2_id',
+                'user__id', 'user__username', 'user__email', 'user__name',
+            )
+            .in_bulk([row[0] for row in rows])
+        )
+        hits = [
+            SearchHit(message=messages[message_id], highlight=render_highlight(text), rank=rank)
+            for message_id, text, rank in rows
+            if message_id in messages
+        ]
+        return hits, has_more
+
+    @staticmethod
+    def _sqlite(user_id, terms, limit, offset, room_id):
+        match = ' '.join(f'"{term}"' for term in terms)
+        room_filter = 'AND message.room_id = %s' if room_id is not None else ''
+        params = [MARK_START, MARK_END, user_id, match]
+        if room_id is not None:
+            params.append(room_id)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT
+                    message.id,
+                    snippet(rooms_chatmessage_fts, 0, %s, %s, '…', 24),
+                    -bm25(rooms_chatmessage_fts) AS score
+                FROM rooms_chatmessage_fts
+                JOIN rooms_chatmessage AS message
+                    ON message.id = rooms_chatmessage_fts.rowid
+                JOIN rooms_roommembership AS membership
+                    ON membership.room_id = message.room_id AND membership.user_id = %s
+                WHERE rooms_chatmessage_fts MATCH %s {room_filter}
+                ORDER BY score DESC, message.id DESC
+                LIMIT %s OFFSET %s
+                """,
+                params + [limit, offset],
+            )
+            return cursor.fetchall()
+
+    @staticmethod
+    def _postgresql(user_id, terms, limit, offset, room_id):
+        room_filter = 'AND message.room_id = %s' if room_id is not None else ''
+        params = [
+            f'StartSel={MARK_START}, StopSel={MARK_END}, MaxFragments=2, MaxWords=24, MinWords=8',
+            ' '.join(terms),
+            user_id,
+        ]
+        if room_id is not None:
+            params.append(room_id)
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                SELECT
+                    message.id,
+                    ts_headline('simple', message.content, query, %s),
+                    ts_rank_cd(to_tsvector('simple', message.content), query) AS score
+                FROM rooms_chatmessage AS message
+                CROSS JOIN plainto_tsquery('simple', %s) AS query
+                JOIN rooms_roommembership AS membership
+                    ON membership.room_id = message.room_id AND membership.user_id = %s
+                WHERE to_tsvector('simple', message.content) @@ query {room_filter}
+                ORDER BY score DESC, message.id DESC
+                LIMIT %s OFFSET %s
+                """,
+                params + [limit, offset],
+            )
+            return cursor.fetchall()
+
+    @staticmethod
+    def _fallback(user_id, terms, limit, offset, room_id):
+        queryset = (
+            ChatMessage.objects
+            .filter(room__memberships__user_id=user_id)
+            .select_related('user', 'room')
+            .order_by('-id')
+        )
+        if room_id is not None:
+            queryset = queryset.filter(room_id=room_id)
+        for term in terms:
+            queryset = queryset.filter(content__icontains=term)
+
+        messages = list(queryset[offset:offset + limit + 1])
+        pattern = re.compile('|'.join(re.escape(term) for term in terms), re.IGNORECASE)
+        hits = [
+            SearchHit(
+                message=message,
+                highlight=render_highlight(
+                    pattern.sub(lambda match: f'{MARK_START}{match.group()}{MARK_END}', message.content)
+                ),
+                rank=0.0,
+            )
+            for message in messages[:limit]
+        ]
+        return hits, len(messages) > limit
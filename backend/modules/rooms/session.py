@@ -0,0 +1,431 @@
+import asyncio
+from channels.db import database_sync_to_async
+from django.conf import settings
+from modules.rooms.models import ChatMessage
+from modules.rooms.repository import ChatMessageRepository, RoomMembershipRepository
+from modules.rooms.cache import room_cache
+from modules.rooms.pipeline import message_writer
+from modules.rooms.ratelimit import message_rate_limiter
+from modules.rooms.typing_indicator import typing_tracker
+from modules.rooms.encoding import encode_event
+from modules.rooms.outbound import COALESCE, DURABLE, EPHEMERAL
+
+
+class RoomSession:
+    """
+    Responsável pelo protocolo de uma sala dentro de uma conexão websocket:
+    entrada no grupo, histórico, mensagens, digitação e recibos de leitura.
+
+    A conexão (`consumer`) fornece o usuário, o canal, o codec negociado e o
+    método `push`, que enfileira os frames no buffer de saída. Assim o mesmo protocolo serve ao
+    ChatConsumer (uma sala por conexão) e ao MultiplexChatConsumer (várias
+    salas por conexão).
+    """
+
+    def __init__(self, consumer, room_name):
+        self.consumer = consumer
+        self.user = consumer.user
+        self.room_pair = room_cache.parse_room_name(room_name)
+        self.room_name = f'{self.room_pair[0]}_{self.room_pair[1]}'
+        self.room_group_name = f'chat_{self.room_name}'
+        self.room = None
+        self.read_watermarks = {}
+        self.read_watermark = 0
+        self.pending_read_watermark = 0
+        self.read_receipt_task = None
+        self.typing_key = None
+        self.joined = False
+
+    @property
+    def channel_layer(self):
+        return self.consumer.channel_layer
+
+    @property
+    def channel_name(self):
+        return self.consumer.channel_name
+
+    def send_frame(self, payload, kind=DURABLE, key=None, cursor=None):
+        """
+        Serializa o frame no formato da conexão e o enfileira.
+        """
+        frame = self.consumer.codec.encode(payload)
+        self.consumer.push(self, frame, kind=kind, key=key, cursor=cursor)
+
+    def forward(self, event, kind=DURABLE, key=None, cursor=None):
+        """
+        Enfileira o frame de um evento de grupo, já serializado pelo remetente.
+        """
+        frame = event[self.consumer.codec.field]
+        self.consumer.push(self, frame, kind=kind, key=key, cursor=cursor)
+
+    async def join(self):
+        """
+        Entra no grupo da sala. O nome do grupo depende apenas do par de
+        usuários, então a entrada não espera o banco e acontece antes da
+        leitura do histórico: nenhuma mensagem enviada nesse meio-tempo se perde.
+        """
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
+        )
+        self.joined = True
+
+    async def open(self, since_id=None):
+        """
+        Envia o estado inicial da sala: a página mais recente do histórico ou,
+        na reconexão com `since_id` (última mensagem vista), apenas a lacuna.
+        """
+        state = await self.load(since_id)
+
+        if since_id is None:
+            self.send_frame({
+                'type': 'previous_messages',
+                'messages': state['messages'],
+                'has_more': state['has_more'],
+                'cursor': state['cursor'],
+            }, cursor=state['last_cursor'])
+        elif state['gap_too_large']:
+            self.send_frame({'type': 'gap_too_large', 'since_id': since_id})
+        else:
+            self.send_frame(
+                {'type': 'missed_messages', 'since_id': since_id, 'messages': state['messages']},
+                cursor=state['last_cursor'],
+            )
+
+        # Abrir a sala marca como lido até a última mensagem enviada.
+        if state['read_until']:
+            await self.broadcast_read_receipt(state['read_until'])
+
+    async def resume(self, since_id):
+        """
+        Envia as mensagens posteriores a `since_id`. Se a lacuna passar de
+        CHAT_RESUME_MAX_GAP mensagens, envia apenas o marcador `gap_too_large`
+        e o cliente deve recarregar o histórico pela API REST.
+        """
+        gap = await self.get_missed_messages(since_id)
+        if gap['gap_too_large']:
+            self.send_frame({'type': 'gap_too_large', 'since_id': since_id})
+            return
+
+        self.send_frame(
+            {'type': 'missed_messages', 'since_id': since_id, 'messages': gap['messages']},
+            cursor=gap['last_cursor'],
+        )
+        # Como na abertura, marca como lido até a última mensagem enviada.
+        if gap['read_until']:
+            await self.broadcast_read_receipt(gap['read_until'])
+
+    async def leave(self):
+        if self.read_receipt_task is not None:
+            # Aplica imediatamente o recibo que ainda aguardava o debounce.
+            self.read_receipt_task.cancel()
+            await self.flush_read_receipts()
+
+        if self.typing_key is not None and typing_tracker.stop(self.typing_key):
+            await self.broadcast_stop_typing()
+
+        await self.channel_layer.group_discard(
+            self.room_group_name,
+            self.channel_name
+        )
+
+    async def receive(self, data):
+        message_type = data.get('type', 'message')
+
+        if message_type == 'message':
+            if not self.user or not self.user.is_active:
+                self.send_frame({
+                    'error': 'User not authenticated'
+                })
+                return
+
+            retry_after = await message_rate_limiter.ahit(self.user.id)
+            if retry_after:
+                self.send_frame({
+                    'error': 'Rate limit exceeded',
+                    'retry_after': round(retry_after, 3),
+                }, EPHEMERAL)
+                return
+
+            message = await self.create_message(data['message'])
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'chat_message',
+                    'room': self.room_name,
+                    'cursor': ChatMessageRepository.encode_cursor(message),
+                    **encode_event({
+                        'message': message.content,
+                        'username': self.user.username,
+                        'timestamp': message.timestamp,
+                        'id': message.id,
+                        'read': False
+                    }),
+                }
+            )
+        elif message_type == 'typing':
+            if typing_tracker.typing(self.typing_key, self.broadcast_stop_typing):
+                await self.channel_layer.group_send(
+                    self.room_group_name,
+                    {
+                        'type': 'user_typing',
+                        'room': self.room_name,
+                        **encode_event({
+                            'type': 'typing',
+                            'username': self.user.username
+                        }),
+                        'sender_channel_name': self.channel_name,
+                    }
+                )
+        elif message_type == 'stop_typing':
+            if typing_tracker.stop(self.typing_key):
+                await self.broadcast_stop_typing()
+        elif message_type == 'mark_as_read':
+            try:
+                message_id = int(data.get('message_id', 0))
+            except (TypeError, ValueError):
+                return
+            self.queue_read_receipt(message_id)
+        elif message_type == 'resume':
+            since_id = self.parse_since_id(data.get('since_id'))
+            if since_id is None:
+                self.send_frame({
+                    'error': 'Invalid since_id'
+                })
+                return
+            await self.resume(since_id)
+        elif message_type == 'load_more':
+            try:
+                before = ChatMessageRepository.decode_cursor(str(data.get('cursor', '')))
+            except ValueError:
+                self.send_frame({
+                    'error': 'Invalid cursor'
+                })
+                return
+
+            history = await self.get_previous_messages(
+                before=before, limit=data.get('limit')
+            )
+            history.pop('last_cursor')
+            self.send_frame({'type': 'more_messages', **history})
+
+    # Os eventos do grupo já trazem o frame serializado em `text` pelo
+    # remetente; os handlers apenas o repassam ao buffer de saída, sem
+    # serializar por destinatário.
+
+    async def chat_message(self, event):
+        self.forward(event, cursor=event.get('cursor'))
+
+    async def user_typing(self, event):
+        if event.get('sender_channel_name') == self.channel_name:
+            return
+        self.forward(event, EPHEMERAL)
+
+    async def user_stop_typing(self, event):
+        if event.get('sender_channel_name') == self.channel_name:
+            return
+        self.forward(event, EPHEMERAL)
+
+    async def mark_as_read(self, event):
+        message_id = event['message_id']
+        user_id = event['user_id']
+        self.read_watermarks[user_id] = max(self.read_watermarks.get(user_id, 0), message_id)
+        self.forward(event, COALESCE, key=('mark_as_read', user_id))
+
+    async def broadcast_stop_typing(self):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'user_stop_typing',
+                'room': self.room_name,
+                **encode_event({
+                    'type': 'stop_typing',
+                    'username': self.user.username
+                }),
+                'sender_channel_name': self.channel_name,
+            }
+        )
+
+    def queue_read_receipt(self, message_id):
+        """
+        Acumula o recibo de leitura como uma marca d'água ("lido até X") e
+        agenda sua aplicação após o debounce, coalescendo recibos seguidos.
+        """
+        if not self.user or not self.user.is_authenticated:
+            return
+        if message_id <= max(self.read_watermark, self.pending_read_watermark):
+            return
+        self.pending_read_watermark = message_id
+        if self.read_receipt_task is None:
+            self.read_receipt_task = asyncio.ensure_future(
+                self.flush_read_receipts(delay=settings.CHAT_READ_RECEIPT_DEBOUNCE)
+            )
+
+    async def flush_read_receipts(self, delay=0):
+        if delay:
+            await asyncio.sleep(delay)
+        self.read_receipt_task = None
+
+        message_id = self.pending_read_watermark
+        if message_id <= self.read_watermark:
+            return
+        self.read_watermark = message_id
+
+        if await self.mark_messages_as_read_until(message_id):
+            await self.broadcast_read_receipt(message_id)
+
+    async def broadcast_read_receipt(self, message_id):
+        await self.channel_layer.group_send(
+            self.room_group_name,
+            {
+                'type': 'mark_as_read',
+                'room': self.room_name,
+                'message_id': message_id,
+                'user_id': self.user.id,
+                **encode_event({
+                    'type': 'mark_as_read',
+                    'message_id': message_id,
+                    'user_id': self.user.id,
+                }),
+            }
+        )
+
+    # Acesso ao banco. Cada evento faz no máximo uma ida à thread do banco
+    # (database_sync_to_async), com todas as consultas dele agrupadas nela.
+    # As APIs assíncronas do ORM (aget, acreate, ...) não evitariam o custo:
+    # cada chamada delas é um sync_to_async próprio, ou seja, uma ida por
+    # consulta. Ver o comando bench_db_hops.
+
+    @database_sync_to_async
+    def load(self, since_id=None):
+        """
+        Carrega de uma vez o que a abertura da sala precisa: a sala, as marcas
+        d'água de leitura, o histórico (ou a lacuna desde `since_id`) e o
+        avanço da marca d'água do usuário até a última mensagem carregada.
+        """
+        self.room = room_cache.get_room(*self.room_pair)
+        self.read_watermarks = RoomMembershipRepository.watermarks(room_id=self.room.id)
+        user_id = getattr(self.user, 'id', None)
+        self.read_watermark = self.read_watermarks.get(user_id, 0)
+        # Sem usuário, cada conexão tem o próprio limite de digitação.
+        self.typing_key = (user_id if user_id is not None else self.channel_name, self.room.id)
+
+        if since_id is None:
+            state = self.previous_messages()
+        else:
+            state = self.missed_messages(since_id)
+        state['read_until'] = self.read_until(state['messages'])
+        return state
+
+    def read_until(self, messages):
+        """
+        Avança a marca d'água do usuário até a última das mensagens enviadas a
+        ele. Retorna o id da mensagem, se a marca avançou, ou 0.
+        """
+        if not messages or not (self.user and self.user.is_authenticated):
+            return 0
+        message_id = messages[-1]['id']
+        if message_id <= self.read_watermark:
+            return 0
+        self.read_watermark = message_id
+        if RoomMembershipRepository.advance(
+            room_id=self.room.id, user_id=self.user.id, message_id=message_id
+        ):
+            return message_id
+        return 0
+
+    async def create_message(self, message):
+        if message_writer.enabled:
+            return await message_writer.submit(
+                ChatMessage(user=self.user, room=self.room, content=message)
+            )
+        return await self.save_message(message)
+
+    @database_sync_to_async
+    def save_message(self, message):
+        message = ChatMessage(user=self.user, room=self.room, content=message)
+        ChatMessageRepository.save_batch(messages=[message])
+        return message
+
+    @database_sync_to_async
+    def get_previous_messages(self, before=None, limit=None):
+        return self.previous_messages(before=before, limit=limit)
+
+    @database_sync_to_async
+    def get_missed_messages(self, since_id):
+        state = self.missed_messages(since_id)
+        state['read_until'] = self.read_until(state['messages'])
+        return state
+
+    @database_sync_to_async
+    def mark_messages_as_read_until(self, message_id):
+        return RoomMembershipRepository.advance(
+            room_id=self.room.id, user_id=self.user.id, message_id=message_id
+        )
+
+    def previous_messages(self, before=None, limit=None):
+        try:
+            limit = int(limit or settings.CHAT_HISTORY_PAGE_SIZE)
+        except (TypeError, ValueError):
+            limit = settings.CHAT_HISTORY_PAGE_SIZE
+        limit = min(max(limit, 1), settings.CHAT_HISTORY_MAX_PAGE_SIZE)
+
+        messages, has_more = ChatMessageRepository.page(
+            room_id=self.room.id, limit=limit, before=before
+        )
+        return {
+            'messages': self.serialize_messages(messages),
+            'has_more': has_more,
+            'cursor': (
+                ChatMessageRepository.encode_cursor(messages[0])
+                if has_more else None
+            ),
+            'last_cursor': (
+                ChatMessageRepository.encode_cursor(messages[-1])
+                if messages else None
+            ),
+        }
+
+    def missed_messages(self, since_id):
+        messages, gap_too_large = ChatMessageRepository.since(
+            room_id=self.room.id, since_id=since_id, limit=settings.CHAT_RESUME_MAX_GAP
+        )
+        return {
+            'messages': self.serialize_messages(messages),
+            'gap_too_large': gap_too_large,
+            'last_cursor': (
+                ChatMessageRepository.encode_cursor(messages[-1])
+                if messages else None
+            ),
+        }
+
+    @staticmethod
+    def parse_since_id(value):
+        try:
+            since_id = int(value)
+        except (TypeError, ValueError):
+            return None
+        return since_id if since_id >= 0 else None
+
+    def serialize_messages(self, messages):
+        return [
+            {
+                'id': message.id,
+                'username': message.user.username,
+                'message': message.content,
+                'timestamp': message.timestamp,
+                'read': self.is_read(message.id, message.user_id)
+            }
+            for message in messages
+        ]
+
+    def is_read(self, message_id, author_id):
+        """
+        A mensagem está lida se o outro participante já avançou sua marca
+        d'água até ela.
+        """
+        if author_id == self.room.user1_id:
+            recipient_id = self.room.user2_id
+        else:
+            recipient_id = self.room.user1_id
+        return message_id <= self.read_watermarks.get(recipient_id, 0)
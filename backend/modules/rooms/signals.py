@@ -0,0 +1,30 @@
+from django.db import connections
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from modules.users.models import User
+from .cache import room_cache
+from .models import ChatRoom
+from .repository import RoomMembershipRepository
+from .search import ensure_sqlite_triggers
+
+
+@receiver(post_save, sender=ChatRoom)
+def create_room_memberships(sender, instance, created, **kwargs):
+    if created:
+        RoomMembershipRepository.create_for_room(room=instance)
+
+
+@receiver(post_delete, sender=ChatRoom)
+def invalidate_deleted_room(sender, instance, **kwargs):
+    room_cache.invalidate_room(instance.user1_id, instance.user2_id)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user_rooms(sender, instance, **kwargs):
+    room_cache.invalidate_user(instance.id)
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'modules.rooms':
+        ensure_sqlite_triggers(connections[using])
@@ -1 +1,1011 @@
-from django.test import TestCase
+import asyncio
+from unittest import mock, skipUnless
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from ninja_extra.testing import TestClient
+from ninja_jwt.tokens import AccessToken, RefreshToken
+from core.asgi import JWTAuthMiddleware
+from core.utils.ratelimit import LocalRateLimiter
+from modules.rooms.cache import room_cache
+from modules.rooms.consumer import FORBIDDEN_CLOSE_CODE, ROOM_NOT_FOUND_CLOSE_CODE
+from modules.rooms.controllers import ChatController
+from modules.rooms.encoding import CompactCodec, JsonCodec, negotiate
+from modules.rooms.models import ChatMessage, ChatRoom, RoomMembership
+from modules.rooms.outbound import COALESCE, DURABLE, EPHEMERAL, OutboundBuffer
+from modules.rooms.pipeline import FANOUT_FIRST, PERSIST_FIRST, MessageWriter
+from modules.rooms.repository import (
+    ChatMessageRepository, RoomMembershipRepository, decode_cursor, encode_cursor,
+)
+from modules.rooms.search import SQLITE_TRIGGERS, MessageSearch, ensure_sqlite_triggers
+from modules.rooms.session import RoomSession
+from modules.rooms.typing_indicator import TypingTracker
+from modules.rooms.router import websocket_urlpatterns
+from modules.users.models import User
+from modules.users.revocation import ws_users
+
+IN_MEMORY_CHANNEL_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def create_user(username):
+    return User.objects.create_user(username, f'{username}@gmail.com', 'senha', name=username)
+
+
+def communicator(path, user):
+    socket = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+    socket.scope['user'] = user
+    return socket
+
+
+class CursorTests(SimpleTestCase):
+
+    def test_round_trip(self):
+        timestamp = timezone.now()
+        self.assertEqual(decode_cursor(encode_cursor(timestamp, 42)), (timestamp, 42))
+
+    def test_invalid_cursor_raises_value_error(self):
+        for cursor in ('', 'não-é-cursor', 'MTIz', 'YWJjOmRlZg'):
+            with self.subTest(cursor=cursor), self.assertRaises(ValueError):
+                decode_cursor(cursor)
+
+
+class OutboundBufferTests(SimpleTestCase):
+
+    async def blocked_buffer(self, high_water):
+        """
+        Buffer cujo envio fica bloqueado até `release`, com o primeiro frame
+        ('aaaa', cursor 'c1') já retirado da fila pelo escritor.
+        """
+        self.sent, self.overflow_cursors, self.release = [], [], asyncio.Event()
+
+        async def send(text):
+            await self.release.wait()
+            self.sent.append(text)
+
+        async def on_overflow(cursors):
+            self.overflow_cursors.append(dict(cursors))
+
+        buffer = OutboundBuffer(send=send, on_overflow=on_overflow, high_water=high_water)
+        buffer.push('aaaa', cursor='c1', stream='sala')
+        await asyncio.sleep(0)
+        return buffer
+
+    async def finish(self, buffer):
+        self.release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await buffer.close()
+
+    def test_pressure_drops_ephemeral_and_coalesces_frames(self):
+        async def scenario():
+            buffer = await self.blocked_buffer(high_water=10)
+            buffer.push('e1', EPHEMERAL)
+            buffer.push('r1', COALESCE, key='leitura')
+            buffer.push('r2', COALESCE, key='leitura')
+            buffer.push('dddd', DURABLE)
+            buffer.push('xxx', DURABLE)
+            await self.finish(buffer)
+            self.assertEqual(buffer.dropped, 2)
+
+        asyncio.run(scenario())
+        self.assertEqual(self.sent, ['aaaa', 'r2', 'dddd', 'xxx'])
+        self.assertEqual(self.overflow_cursors, [])
+
+    def test_overflow_reports_cursor_of_last_sent_frame(self):
+        async def scenario():
+            buffer = await self.blocked_buffer(high_water=4)
+            buffer.push('bbbb', cursor='c2', stream='sala')
+            buffer.push('cccc', cursor='c3', stream='sala')
+            self.assertTrue(buffer.overflowed)
+            buffer.push('dddd')
+            await self.finish(buffer)
+
+        asyncio.run(scenario())
+        self.assertEqual(self.sent, ['aaaa'])
+        self.assertEqual(self.overflow_cursors, [{'sala': 'c1'}])
+
+    def test_high_water_counts_encoded_bytes(self):
+        async def scenario():
+            buffer = await self.blocked_buffer(high_water=6)
+            # 3 caracteres, 6 bytes em UTF-8.
+            buffer.push('ççç')
+            self.assertEqual(buffer.size, 6)
+            buffer.push(b'x')
+            self.assertTrue(buffer.overflowed)
+            await self.finish(buffer)
+
+        asyncio.run(scenario())
+        self.assertEqual(self.sent, ['aaaa'])
+
+
+class TypingTrackerTests(SimpleTestCase):
+
+    def test_typing_is_throttled_per_key(self):
+        async def scenario():
+            tracker = TypingTracker(throttle=2, timeout=60)
+            on_timeout = mock.AsyncMock()
+            with mock.patch('modules.rooms.typing_indicator.time.monotonic') as clock:
+                clock.return_value = 100
+                self.assertTrue(tracker.typing('a', on_timeout))
+                self.assertFalse(tracker.typing('a', on_timeout))
+                self.assertTrue(tracker.typing('b', on_timeout))
+                clock.return_value = 102
+                self.assertTrue(tracker.typing('a', on_timeout))
+                self.assertFalse(tracker.typing('a', on_timeout))
+            self.assertTrue(tracker.stop('a'))
+            self.assertFalse(tracker.stop('a'))
+            tracker.stop('b')
+
+        asyncio.run(scenario())
+
+    def test_stop_typing_is_sent_after_timeout(self):
+        async def scenario():
+            tracker = TypingTracker(throttle=0, timeout=0.05)
+            on_timeout = mock.AsyncMock()
+            tracker.typing('a', on_timeout)
+            await asyncio.sleep(0.03)
+            # A tecla adia o prazo.
+            tracker.typing('a', on_timeout)
+            await asyncio.sleep(0.03)
+            on_timeout.assert_not_called()
+            await asyncio.sleep(0.05)
+            on_timeout.assert_awaited_once()
+            self.assertFalse(tracker.stop('a'))
+
+        asyncio.run(scenario())
+
+
+class EncodingTests(SimpleTestCase):
+
+    def test_compact_codec_round_trip(self):
+        timestamp = timezone.now()
+        payload = {
+            'type': 'previous_messages',
+            'messages': [{'id': 1, 'message': 'oi', 'username': 'ana', 'timestamp': timestamp, 'read': True}],
+            'has_more': False,
+            'cursor': None,
+            'campo_novo': 'x',
+        }
+        frame = CompactCodec.encode(payload)
+        self.assertIsInstance(frame, bytes)
+        self.assertLess(len(frame), len(JsonCodec.encode(payload)))
+
+        decoded = CompactCodec.decode(frame)
+        self.assertEqual(decoded['messages'][0]['timestamp'], int(timestamp.timestamp() * 1000))
+        decoded['messages'][0]['timestamp'] = timestamp
+        self.assertEqual(decoded, payload)
+
+        self.assertEqual(
+            CompactCodec.decode(CompactCodec.envelope('1_2', CompactCodec.encode({'type': 'typing'}))),
+            {'room': '1_2', 'frame': {'type': 'typing'}},
+        )
+
+    def test_negotiation(self):
+        self.assertIs(negotiate([]), JsonCodec)
+        self.assertIs(negotiate(['chat.msgpack', 'chat.json']), CompactCodec)
+        self.assertIs(negotiate(['chat.json', 'chat.msgpack']), JsonCodec)
+        self.assertIsNone(negotiate(['chat.xml']))
+
+    def test_negotiation_without_msgpack_falls_back_to_json(self):
+        with mock.patch('modules.rooms.encoding.CODECS', [JsonCodec]):
+            self.assertIs(negotiate(['chat.msgpack', 'chat.json']), JsonCodec)
+            self.assertIsNone(negotiate(['chat.msgpack']))
+
+
+class RoomCacheTests(TestCase):
+
+    def setUp(self):
+        room_cache.clear()
+
+    def test_get_room_creates_and_caches_room(self):
+        a, b = create_user('ana'), create_user('bruno')
+        room = room_cache.get_room(b.id, a.id)
+        self.assertEqual((room.user1_id, room.user2_id), ChatRoom.canonical_pair(a.id, b.id))
+        with self.assertNumQueries(0):
+            self.assertEqual(room_cache.get_room(a.id, b.id).id, room.id)
+
+    def test_get_room_with_missing_user_raises_does_not_exist(self):
+        a = create_user('ana')
+        with self.assertRaises(User.DoesNotExist):
+            room_cache.get_room(a.id, a.id + 1000)
+        self.assertFalse(ChatRoom.objects.exists())
+
+
+class SendMessageRateLimitTests(TestCase):
+
+    def test_send_message_over_limit_returns_429_with_retry_after(self):
+        a, b = create_user('ana'), create_user('bruno')
+        client = TestClient(ChatController)
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(a)}'}
+        payload = {'recipient_id': b.id, 'content': 'oi'}
+
+        limiter = LocalRateLimiter(rate=0.5, burst=1)
+        with mock.patch('modules.rooms.controllers.message_rate_limiter', limiter):
+            self.assertEqual(client.post('message', json=payload, headers=headers).status_code, 200)
+            response = client.post('message', json=payload, headers=headers)
+
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '2')
+        self.assertEqual(response.json()['message'], 'Rate limit exceeded')
+        self.assertEqual(ChatMessage.objects.count(), 1)
+
+
+class GetMessagesTests(TestCase):
+
+    def setUp(self):
+        room_cache.clear()
+        self.a, self.b = create_user('ana'), create_user('bruno')
+        self.room = ChatRoom.objects.create(user1=self.a, user2=self.b)
+        self.messages = [
+            ChatMessage(room=self.room, user=self.a, content=str(i)) for i in range(5)
+        ]
+        ChatMessageRepository.save_batch(messages=self.messages)
+        self.api = TestClient(ChatController)
+        self.headers = {'Authorization': f'Bearer {AccessToken.for_user(self.a)}'}
+
+    def get(self, query):
+        return self.api.get(f'messages?room_name={self.room.room_name}&{query}', headers=self.headers)
+
+    def contents(self, body):
+        return [message['content'] for message in body['results']]
+
+    def test_pages_backwards_with_next_cursor(self):
+        body = self.get('limit=2').json()
+        self.assertEqual((self.contents(body), body['has_more']), (['3', '4'], True))
+
+        body = self.get(f"limit=2&before={body['next_cursor']}").json()
+        self.assertEqual((self.contents(body), body['has_more']), (['1', '2'], True))
+
+        body = self.get(f"limit=2&before={body['next_cursor']}").json()
+        self.assertEqual(self.contents(body), ['0'])
+        self.assertEqual((body['has_more'], body['next_cursor']), (False, None))
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.get('limit=abc').status_code, 422)
+        self.assertEqual(self.get('before=xyz').status_code, 400)
+        cursor = encode_cursor(timezone.now(), 1)
+        self.assertEqual(self.get(f'before={cursor}&after={cursor}').status_code, 400)
+
+
+class ConversationListTests(TestCase):
+
+    def setUp(self):
+        room_cache.clear()
+        self.ana, self.bruno, self.carla, self.davi = [
+            create_user(name) for name in ('ana', 'bruno', 'carla', 'davi')
+        ]
+        self.with_bruno = ChatRoom.objects.create(user1=self.ana, user2=self.bruno)
+        self.with_carla = ChatRoom.objects.create(user1=self.ana, user2=self.carla)
+        # Sem mensagens: não aparece na lista.
+        ChatRoom.objects.create(user1=self.ana, user2=self.davi)
+        self.api = TestClient(ChatController)
+
+    def send(self, room, user, *contents):
+        messages = [ChatMessage(room=room, user=user, content=content) for content in contents]
+        ChatMessageRepository.save_batch(messages=messages)
+        return messages
+
+    def rooms(self, user, query=''):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        response = self.api.get(f'rooms?{query}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_saving_messages_updates_room_and_member_counters(self):
+        self.send(self.with_bruno, self.bruno, 'oi', 'tudo bem?')
+        ana_reply, = self.send(self.with_bruno, self.ana, 'tudo')
+
+        self.with_bruno.refresh_from_db()
+        self.assertEqual(self.with_bruno.last_message_id, ana_reply.id)
+        self.assertEqual(self.with_bruno.last_activity, ana_reply.timestamp)
+        memberships = {
+            membership.user_id: membership
+            for membership in RoomMembership.objects.filter(room=self.with_bruno)
+        }
+        self.assertEqual(memberships[self.ana.id].unread_count, 2)
+        self.assertEqual(memberships[self.bruno.id].unread_count, 1)
+        self.assertEqual(memberships[self.ana.id].last_activity, ana_reply.timestamp)
+
+    def test_older_batch_does_not_move_last_message_back(self):
+        older = ChatMessage(room=self.with_bruno, user=self.bruno, content='antiga')
+        newer, = self.send(self.with_bruno, self.bruno, 'nova')
+        # Ex.: lote do write-behind persistido depois de um mais recente.
+        ChatMessageRepository.save_batch(messages=[older])
+
+        self.with_bruno.refresh_from_db()
+        self.assertEqual(self.with_bruno.last_message_id, newer.id)
+        self.assertEqual(
+            RoomMembership.objects.get(room=self.with_bruno, user=self.ana).unread_count, 2
+        )
+
+    def test_rooms_are_listed_by_recent_activity_with_counts(self):
+        self.send(self.with_bruno, self.bruno, 'oi')
+        last_from_carla, = self.send(self.with_carla, self.carla, 'olá')
+
+        body = self.rooms(self.ana)
+        self.assertEqual(
+            [(row['room'], row['peer']['username'], row['unread_count']) for row in body['results']],
+            [(self.with_carla.room_name, 'carla', 1), (self.with_bruno.room_name, 'bruno', 1)],
+        )
+        self.assertEqual(body['results'][0]['last_message']['id'], last_from_carla.id)
+        self.assertEqual(body['results'][0]['last_message']['sender_id'], self.carla.id)
+        self.assertFalse(body['has_more'])
+
+        # A nova mensagem leva a conversa para o topo.
+        self.send(self.with_bruno, self.bruno, 'e aí?')
+        body = self.rooms(self.ana)
+        self.assertEqual(
+            [(row['peer']['username'], row['unread_count']) for row in body['results']],
+            [('bruno', 2), ('carla', 1)],
+        )
+
+    def test_rooms_are_paged_with_next_cursor(self):
+        self.send(self.with_bruno, self.bruno, 'oi')
+        self.send(self.with_carla, self.carla, 'olá')
+
+        first = self.rooms(self.ana, 'limit=1')
+        self.assertEqual([row['peer']['username'] for row in first['results']], ['carla'])
+        self.assertTrue(first['has_more'])
+        second = self.rooms(self.ana, f"limit=1&cursor={first['next_cursor']}")
+        self.assertEqual([row['peer']['username'] for row in second['results']], ['bruno'])
+        self.assertFalse(second['has_more'])
+
+
+class MessageSearchTests(TestCase):
+
+    def setUp(self):
+        room_cache.clear()
+        self.a, self.b, self.c = create_user('ana'), create_user('bruno'), create_user('carla')
+        self.ab = ChatRoom.objects.create(user1=self.a, user2=self.b)
+        self.bc = ChatRoom.objects.create(user1=self.b, user2=self.c)
+        self.messages = [
+            ChatMessage(room=self.ab, user=self.a, content='Almoço <b>amanhã</b>?'),
+            ChatMessage(room=self.ab, user=self.b, content='nada a ver'),
+            ChatMessage(room=self.bc, user=self.c, content='almoço secreto'),
+        ]
+        ChatMessageRepository.save_batch(messages=self.messages)
+        self.api = TestClient(ChatController)
+
+    def search(self, user, query):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(user)}'}
+        response = self.api.get(f'search?{query}', headers=headers)
+        self.assertEqual(response.status_code, 200)
+        return [result['id'] for result in response.json()['results']]
+
+    def test_results_are_scoped_to_the_callers_rooms(self):
+        ab, _, bc = (message.id for message in self.messages)
+        self.assertEqual(self.search(self.a, 'q=almoco'), [ab])
+        self.assertEqual(self.search(self.c, 'q=almoco'), [bc])
+        self.assertCountEqual(self.search(self.b, 'q=almoco'), [ab, bc])
+        self.assertEqual(self.search(self.b, f'q=almoco&room_name={self.c.id}_{self.b.id}'), [bc])
+        self.assertEqual(self.search(self.c, f'q=almoco&room_name={self.a.id}_{self.b.id}'), [])
+
+    def test_fallback_is_scoped_to_the_callers_rooms(self):
+        hits, has_more = MessageSearch._fallback(self.a.id, ['almoço'], 10, 0, None)
+        self.assertEqual([hit.message.id for hit in hits], [self.messages[0].id])
+        self.assertFalse(has_more)
+
+    def test_highlight_escapes_message_html(self):
+        headers = {'Authorization': f'Bearer {AccessToken.for_user(self.a)}'}
+        highlight = self.api.get('search?q=amanha', headers=headers).json()['results'][0]['highlight']
+        self.assertIn('&lt;b&gt;<mark>amanhã</mark>&lt;/b&gt;', highlight)
+
+    def test_index_follows_updates_and_deletes(self):
+        message = self.messages[0]
+        ChatMessage.objects.filter(id=message.id).update(content='mudou de ideia')
+        self.assertEqual(self.search(self.a, 'q=almoco'), [])
+        self.assertEqual(self.search(self.a, 'q=ideia'), [message.id])
+        ChatMessage.objects.filter(id=message.id).delete()
+        self.assertEqual(self.search(self.a, 'q=ideia'), [])
+
+    def sqlite_triggers(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'rooms_chatmessage'"
+            )
+            return {name for name, in cursor.fetchall()}
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 triggers are SQLite only')
+    def test_dropped_triggers_are_recreated_after_migrate(self):
+        self.assertLessEqual(set(SQLITE_TRIGGERS), self.sqlite_triggers())
+        self.assertEqual(ensure_sqlite_triggers(connection), [])
+
+        # Como faria uma migração que recria a tabela.
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER rooms_chatmessage_fts_insert')
+        message = ChatMessage(room=self.ab, user=self.b, content='jantar hoje')
+        ChatMessageRepository.save_batch(messages=[message])
+        self.assertEqual(self.search(self.a, 'q=jantar'), [])
+
+        with self.assertLogs('modules.rooms.search', 'WARNING'):
+            emit_post_migrate_signal(verbosity=0, interactive=False, db='default')
+        self.assertLessEqual(set(SQLITE_TRIGGERS), self.sqlite_triggers())
+        self.assertEqual(self.search(self.a, 'q=jantar'), [message.id])
+
+    def test_postgresql_query_is_scoped_and_parameterized(self):
+        with mock.patch('modules.rooms.search.connection') as db:
+            cursor = db.cursor.return_value.__enter__.return_value
+            cursor.fetchall.return_value = [(1, 'x', 0.5)]
+            rows = MessageSearch._postgresql(self.a.id, ['almoço', 'amanhã'], 11, 20, self.ab.id)
+
+        sql, params = cursor.execute.call_args.args
+        self.assertEqual(rows, [(1, 'x', 0.5)])
+        self.assertIn("plainto_tsquery('simple', %s)", sql)
+        self.assertIn('membership.user_id = %s', sql)
+        self.assertIn('AND message.room_id = %s', sql)
+        self.assertEqual(params[1:], ['almoço amanhã', self.a.id, self.ab.id, 11, 20])
+        self.assertEqual(sql.count('%s'), len(params))
+
+
+@skipUnless(connection.vendor == 'postgresql', 'PostgreSQL full-text search')
+class PostgreSQLMessageSearchTests(TestCase):
+
+    def setUp(self):
+        self.a, self.b, self.c = create_user('ana'), create_user('bruno'), create_user('carla')
+        self.ab = ChatRoom.objects.create(user1=self.a, user2=self.b)
+        self.bc = ChatRoom.objects.create(user1=self.b, user2=self.c)
+        self.messages = [
+            ChatMessage(room=self.ab, user=self.a, content='jantar <b>hoje</b>?'),
+            ChatMessage(room=self.bc, user=self.c, content='jantar secreto'),
+        ]
+        ChatMessageRepository.save_batch(messages=self.messages)
+
+    def test_results_are_scoped_ranked_and_highlighted(self):
+        ab, bc = (message.id for message in self.messages)
+        hits, has_more = MessageSearch.search(user_id=self.b.id, terms=['jantar'], limit=1)
+        self.assertEqual(len(hits), 1)
+        self.assertTrue(has_more)
+
+        hits, _ = MessageSearch.search(user_id=self.a.id, terms=['jantar', 'hoje'], limit=10)
+        self.assertEqual([hit.message.id for hit in hits], [ab])
+        self.assertIn('<mark>jantar</mark>', hits[0].highlight)
+        self.assertIn('&lt;b&gt;', hits[0].highlight)
+
+        hits, _ = MessageSearch.search(
+            user_id=self.b.id, terms=['jantar'], limit=10, room_id=self.bc.id
+        )
+        self.assertEqual([hit.message.id for hit in hits], [bc])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatConsumerTests(TransactionTestCase):
+
+    def setUp(self):
+        room_cache.clear()
+
+    def test_room_with_missing_user_closes_with_not_found_code(self):
+        a = create_user('ana')
+
+        async def scenario():
+            socket = communicator(f'/ws/chat/{a.id}_{a.id + 1000}/', a)
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            self.assertEqual(
+                await socket.receive_output(),
+                {'type': 'websocket.close', 'code': ROOM_NOT_FOUND_CLOSE_CODE},
+            )
+            await socket.wait()
+
+        asyncio.run(scenario())
+
+    def test_non_member_is_rejected(self):
+        a, b, c = create_user('ana'), create_user('bruno'), create_user('carla')
+
+        async def scenario():
+            socket = communicator(f'/ws/chat/{a.id}_{b.id}/', c)
+            self.assertEqual(await socket.connect(), (False, FORBIDDEN_CLOSE_CODE))
+
+        asyncio.run(scenario())
+
+    def test_reconnect_with_since_id_replays_only_the_gap(self):
+        a, b = create_user('ana'), create_user('bruno')
+        room = ChatRoom.objects.create(user1=a, user2=b)
+        messages = [ChatMessage(room=room, user=b, content=str(i)) for i in range(3)]
+        ChatMessageRepository.save_batch(messages=messages)
+
+        async def scenario():
+            socket = communicator(f'/ws/chat/{room.room_name}/?since_id={messages[0].id}', a)
+            await socket.connect()
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['type'], frame['since_id']), ('missed_messages', messages[0].id))
+            self.assertEqual([message['message'] for message in frame['messages']], ['1', '2'])
+            await socket.disconnect()
+
+        asyncio.run(scenario())
+
+    @override_settings(CHAT_RESUME_MAX_GAP=2)
+    def test_gap_larger_than_the_limit_asks_for_a_reload(self):
+        a, b = create_user('ana'), create_user('bruno')
+        room = ChatRoom.objects.create(user1=a, user2=b)
+        messages = [ChatMessage(room=room, user=b, content=str(i)) for i in range(4)]
+        ChatMessageRepository.save_batch(messages=messages)
+        since_id = messages[0].id
+
+        async def scenario():
+            socket = communicator(f'/ws/chat/{room.room_name}/?since_id={since_id}', a)
+            await socket.connect()
+            gap = {'type': 'gap_too_large', 'since_id': since_id}
+            self.assertEqual(await socket.receive_json_from(), gap)
+            # Nada foi entregue, então nada é marcado como lido.
+            self.assertTrue(await socket.receive_nothing(0.1))
+
+            await socket.send_json_to({'type': 'resume', 'since_id': since_id})
+            self.assertEqual(await socket.receive_json_from(), gap)
+            await socket.send_json_to({'type': 'resume', 'since_id': messages[1].id})
+            frame = await socket.receive_json_from()
+            self.assertEqual([message['message'] for message in frame['messages']], ['2', '3'])
+            await socket.disconnect()
+
+        asyncio.run(scenario())
+        self.assertEqual(
+            RoomMembership.objects.get(room=room, user=a).last_read_message_id, messages[-1].id
+        )
+
+    def test_msgpack_subprotocol(self):
+        a, b = create_user('ana'), create_user('bruno')
+
+        async def scenario():
+            socket = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/chat/{a.id}_{b.id}/',
+                subprotocols=['chat.msgpack', 'chat.json'],
+            )
+            socket.scope['user'] = a
+            self.assertEqual(await socket.connect(), (True, 'chat.msgpack'))
+            frame = CompactCodec.decode(await socket.receive_from())
+            self.assertEqual(frame['type'], 'previous_messages')
+
+            await socket.send_to(bytes_data=CompactCodec.encode({'type': 'message', 'message': 'olá'}))
+            frame = CompactCodec.decode(await socket.receive_from())
+            self.assertEqual((frame['message'], frame['username'], frame['read']), ('olá', 'ana', False))
+            self.assertIsInstance(frame['timestamp'], int)
+            await socket.disconnect()
+
+        asyncio.run(scenario())
+
+    def test_msgpack_offer_falls_back_to_json_without_msgpack(self):
+        a, b = create_user('ana'), create_user('bruno')
+
+        async def scenario():
+            socket = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/chat/{a.id}_{b.id}/',
+                subprotocols=['chat.msgpack', 'chat.json'],
+            )
+            socket.scope['user'] = a
+            self.assertEqual(await socket.connect(), (True, 'chat.json'))
+            self.assertEqual((await socket.receive_json_from())['type'], 'previous_messages')
+            await socket.send_json_to({'type': 'message', 'message': 'olá'})
+            self.assertEqual((await socket.receive_json_from())['message'], 'olá')
+            await socket.disconnect()
+
+        with mock.patch('modules.rooms.encoding.CODECS', [JsonCodec]):
+            asyncio.run(scenario())
+
+    def test_multiplex_subscribe_to_missing_room_keeps_other_rooms(self):
+        a, b = create_user('ana'), create_user('bruno')
+        room_name, missing = f'{a.id}_{b.id}', f'{a.id}_{b.id + 1000}'
+
+        async def scenario():
+            socket = communicator('/ws/chat/', a)
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            await socket.send_json_to({'type': 'subscribe', 'room': room_name})
+            self.assertEqual((await socket.receive_json_from())['frame']['type'], 'previous_messages')
+
+            await socket.send_json_to({'type': 'subscribe', 'room': missing})
+            self.assertEqual(
+                await socket.receive_json_from(),
+                {'error': 'Room not found', 'room': missing},
+            )
+            await socket.send_json_to({'type': 'typing', 'room': missing})
+            self.assertEqual((await socket.receive_json_from())['error'], 'Not subscribed')
+
+            await socket.send_json_to({'type': 'message', 'room': room_name, 'message': 'oi'})
+            frame = await socket.receive_json_from()
+            self.assertEqual((frame['room'], frame['frame']['message']), (room_name, 'oi'))
+            await socket.disconnect()
+
+        asyncio.run(scenario())
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class HandshakeAuthTests(TransactionTestCase):
+
+    def setUp(self):
+        room_cache.clear()
+        ws_users.clear()
+        self.ana, self.bruno = create_user('ana'), create_user('bruno')
+        self.path = f'/ws/chat/{self.ana.id}_{self.bruno.id}/'
+        self.middleware = JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+    async def connect(self, token):
+        socket = WebsocketCommunicator(self.middleware, f'{self.path}?token={token}')
+        return socket, await socket.connect()
+
+    def test_valid_access_token_connects(self):
+        async def scenario():
+            socket, (connected, _) = await self.connect(AccessToken.for_user(self.ana))
+            self.assertTrue(connected)
+            self.assertEqual((await socket.receive_json_from())['type'], 'previous_messages')
+            await socket.disconnect()
+
+        asyncio.run(scenario())
+
+    def test_invalid_missing_or_refresh_token_is_rejected(self):
+        async def scenario():
+            for token in ('invalido', '', RefreshToken.for_user(self.ana)):
+                with self.subTest(token=str(token)[:10]):
+                    _, result = await self.connect(token)
+                    self.assertEqual(result, (False, FORBIDDEN_CLOSE_CODE))
+
+        asyncio.run(scenario())
+
+    def test_user_cache_is_keyed_by_jti(self):
+        first, second = AccessToken.for_user(self.ana), AccessToken.for_user(self.ana)
+
+        async def scenario():
+            socket, _ = await self.connect(first)
+            await socket.disconnect()
+            self.assertIsNotNone(ws_users.get((self.ana.id, first['jti'])))
+
+            # Mesmo token: vem do cache, sem consultar o banco.
+            with mock.patch.object(self.middleware, 'load_user') as load_user:
+                socket, (connected, _) = await self.connect(first)
+                self.assertTrue(connected)
+                load_user.assert_not_called()
+                await socket.disconnect()
+
+            # Outro token do mesmo usuário é outra entrada.
+            self.assertIsNone(ws_users.get((self.ana.id, second['jti'])))
+            socket, (connected, _) = await self.connect(second)
+            self.assertTrue(connected)
+            await socket.disconnect()
+            self.assertIsNotNone(ws_users.get((self.ana.id, second['jti'])))
+
+        asyncio.run(scenario())
+
+
+class ReadWatermarkTests(TestCase):
+
+    def setUp(self):
+        self.ana, self.bruno = create_user('ana'), create_user('bruno')
+        self.room = ChatRoom.objects.create(user1=self.ana, user2=self.bruno)
+
+    def send(self, user, *contents):
+        messages = [ChatMessage(user=user, room=self.room, content=content) for content in contents]
+        ChatMessageRepository.save_batch(messages=messages)
+        return messages
+
+    def unread(self, user):
+        return RoomMembership.objects.get(room=self.room, user=user).unread_count
+
+    def advance(self, user, message):
+        return RoomMembershipRepository.advance(
+            room_id=self.room.id, user_id=user.id, message_id=message.id
+        )
+
+    def test_advance_recounts_unread_after_the_watermark(self):
+        first, second, third = self.send(self.bruno, '1', '2', '3')
+        self.send(self.ana, 'resposta')
+        self.assertEqual((self.unread(self.ana), self.unread(self.bruno)), (3, 1))
+
+        self.assertTrue(self.advance(self.ana, first))
+        # As mensagens da própria ana não contam.
+        self.assertEqual(self.unread(self.ana), 2)
+        self.assertEqual(
+            RoomMembershipRepository.watermarks(room_id=self.room.id),
+            {self.ana.id: first.id, self.bruno.id: 0},
+        )
+
+    def test_watermark_never_moves_back(self):
+        first, second = self.send(self.bruno, '1', '2')
+        self.assertTrue(self.advance(self.ana, second))
+        self.assertFalse(self.advance(self.ana, first))
+        self.assertFalse(self.advance(self.ana, second))
+        self.assertEqual(
+            RoomMembershipRepository.watermarks(room_id=self.room.id)[self.ana.id], second.id
+        )
+        self.assertEqual(self.unread(self.ana), 0)
+
+    def test_message_is_read_up_to_the_recipient_watermark(self):
+        first, second = self.send(self.ana, '1', '2')
+        self.advance(self.bruno, first)
+
+        session = RoomSession(mock.Mock(user=self.ana), self.room.room_name)
+        session.room = self.room
+        session.read_watermarks = RoomMembershipRepository.watermarks(room_id=self.room.id)
+        self.assertEqual(
+            [message['read'] for message in session.serialize_messages([first, second])],
+            [True, False],
+        )
+
+
+class TypingKeyTests(TransactionTestCase):
+
+    def test_anonymous_connections_are_throttled_separately(self):
+        a, b = create_user('ana'), create_user('bruno')
+        room_name = f'{a.id}_{b.id}'
+
+        def session(user, channel_name):
+            session = RoomSession(mock.Mock(user=user, channel_name=channel_name), room_name)
+            asyncio.run(session.load())
+            return session
+
+        first, second = session(AnonymousUser(), 'um'), session(AnonymousUser(), 'dois')
+        room_id = first.room.id
+        self.assertEqual((first.typing_key, second.typing_key), (('um', room_id), ('dois', room_id)))
+        self.assertEqual(session(a, 'tres').typing_key, (a.id, room_id))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ReadReceiptTests(TransactionTestCase):
+
+    def setUp(self):
+        room_cache.clear()
+        self.ana, self.bruno = create_user('ana'), create_user('bruno')
+        self.room = ChatRoom.objects.create(user1=self.ana, user2=self.bruno)
+        self.path = f'/ws/chat/{self.room.room_name}/'
+
+    def send(self, user, *contents):
+        messages = [ChatMessage(user=user, room=self.room, content=content) for content in contents]
+        ChatMessageRepository.save_batch(messages=messages)
+        return messages
+
+    def membership(self, user):
+        return RoomMembership.objects.get(room=self.room, user=user)
+
+    @override_settings(CHAT_READ_RECEIPT_DEBOUNCE=60)
+    def test_resume_marks_missed_messages_as_read_immediately(self):
+        first, = self.send(self.bruno, 'oi')
+
+        async def scenario():
+            socket = communicator(self.path, self.ana)
+            await socket.connect()
+            self.assertEqual((await socket.receive_json_from())['type'], 'previous_messages')
+            self.assertEqual((await socket.receive_json_from())['message_id'], first.id)
+
+            _, last = await database_sync_to_async(self.send)(self.bruno, 'tudo bem?', 'e aí')
+            await socket.send_json_to({'type': 'resume', 'since_id': first.id})
+            frame = await socket.receive_json_from()
+            self.assertEqual(frame['type'], 'missed_messages')
+            self.assertEqual([m['message'] for m in frame['messages']], ['tudo bem?', 'e aí'])
+            # Sem esperar o debounce de 60s.
+            self.assertEqual(
+                await socket.receive_json_from(),
+                {'type': 'mark_as_read', 'message_id': last.id, 'user_id': self.ana.id},
+            )
+            await socket.disconnect()
+            return last
+
+        last = asyncio.run(scenario())
+        membership = self.membership(self.ana)
+        self.assertEqual((membership.last_read_message_id, membership.unread_count), (last.id, 0))
+
+    async def open_both(self):
+        ana, bruno = communicator(self.path, self.ana), communicator(self.path, self.bruno)
+        for socket in (ana, bruno):
+            await socket.connect()
+            self.assertEqual((await socket.receive_json_from())['type'], 'previous_messages')
+        return ana, bruno
+
+    async def bruno_says(self, ana, bruno, *contents):
+        ids = []
+        for content in contents:
+            await bruno.send_json_to({'type': 'message', 'message': content})
+            ids.append((await ana.receive_json_from())['id'])
+            await bruno.receive_json_from()
+        return ids
+
+    @override_settings(CHAT_READ_RECEIPT_DEBOUNCE=0.2)
+    def test_mark_as_read_is_debounced_into_one_broadcast(self):
+        advance = RoomMembershipRepository.advance
+
+        async def scenario():
+            ana, bruno = await self.open_both()
+            first, second = await self.bruno_says(ana, bruno, 'oi', 'tudo bem?')
+            for message_id in (first, second, first):
+                await ana.send_json_to({'type': 'mark_as_read', 'message_id': message_id})
+            self.assertTrue(await bruno.receive_nothing(0.1))
+            membership = await database_sync_to_async(self.membership)(self.ana)
+            self.assertEqual(membership.unread_count, 2)
+
+            receipt = {'type': 'mark_as_read', 'message_id': second, 'user_id': self.ana.id}
+            self.assertEqual(await bruno.receive_json_from(), receipt)
+            self.assertEqual(await ana.receive_json_from(), receipt)
+            self.assertTrue(await bruno.receive_nothing(0.3))
+            await ana.disconnect()
+            await bruno.disconnect()
+            return second
+
+        with mock.patch.object(RoomMembershipRepository, 'advance', wraps=advance) as advance_mock:
+            second = asyncio.run(scenario())
+        advance_mock.assert_called_once()
+        membership = self.membership(self.ana)
+        self.assertEqual((membership.last_read_message_id, membership.unread_count), (second, 0))
+
+    @override_settings(CHAT_READ_RECEIPT_DEBOUNCE=60)
+    def test_leaving_applies_the_pending_receipt(self):
+        async def scenario():
+            ana, bruno = await self.open_both()
+            message_id, = await self.bruno_says(ana, bruno, 'oi')
+            await ana.send_json_to({'type': 'mark_as_read', 'message_id': message_id})
+            self.assertTrue(await bruno.receive_nothing(0.1))
+            await ana.disconnect()
+            self.assertEqual(
+                await bruno.receive_json_from(),
+                {'type': 'mark_as_read', 'message_id': message_id, 'user_id': self.ana.id},
+            )
+            await bruno.disconnect()
+            return message_id
+
+        message_id = asyncio.run(scenario())
+        self.assertEqual(self.membership(self.ana).last_read_message_id, message_id)
+
+
+class MergeDuplicateRoomsMigrationTests(TransactionTestCase):
+    migrate_from = [('rooms', '0004_chatmessage_room_timestamp_index')]
+    migrate_to = [('rooms', '0006_chatroom_unique_pair')]
+
+    def migrate(self, targets):
+        executor = MigrationExecutor(connection)
+        executor.loader.build_graph()
+        executor.migrate(targets)
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        self.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_duplicate_rooms_are_merged_into_the_oldest_canonical_room(self):
+        apps = self.migrate(self.migrate_from)
+        ChatRoom = apps.get_model('rooms', 'ChatRoom')
+        ChatMessage = apps.get_model('rooms', 'ChatMessage')
+        User = apps.get_model('users', 'User')
+        ana, bruno, carla = [
+            User.objects.create(username=name, email=f'{name}@gmail.com', name=name)
+            for name in ('ana', 'bruno', 'carla')
+        ]
+
+        # Mesma conversa em três salas, duas com o par invertido.
+        oldest = ChatRoom.objects.create(user1=bruno, user2=ana)
+        duplicate = ChatRoom.objects.create(user1=ana, user2=bruno)
+        reversed_duplicate = ChatRoom.objects.create(user1=bruno, user2=ana)
+        other = ChatRoom.objects.create(user1=carla, user2=ana)
+        for room, content in ((oldest, '1'), (duplicate, '2'), (reversed_duplicate, '3'), (other, '4')):
+            ChatMessage.objects.create(user=ana, room=room, content=content)
+
+        apps = self.migrate(self.migrate_to)
+        ChatRoom = apps.get_model('rooms', 'ChatRoom')
+        ChatMessage = apps.get_model('rooms', 'ChatMessage')
+        self.assertEqual(
+            list(ChatRoom.objects.order_by('id').values_list('id', 'user1_id', 'user2_id')),
+            [(oldest.id, ana.id, bruno.id), (other.id, ana.id, carla.id)],
+        )
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('content').values_list('content', 'room_id')),
+            [('1', oldest.id), ('2', oldest.id), ('3', oldest.id), ('4', other.id)],
+        )
+
+
+class MessageWriterTests(TransactionTestCase):
+
+    def setUp(self):
+        self.a, self.b = create_user('ana'), create_user('bruno')
+        self.room = ChatRoom.objects.create(user1=self.a, user2=self.b)
+
+    def writer(self, durability, **kwargs):
+        options = {
+            'enabled': True, 'batch_size': 50, 'flush_interval': 60, 'max_pending': 1000,
+            'retries': 0, 'retry_backoff': 0,
+        }
+        return MessageWriter(durability=durability, **{**options, **kwargs})
+
+    def message(self, content):
+        return ChatMessage(user=self.a, room=self.room, content=content)
+
+    def test_drain_persists_pending_messages_in_order(self):
+        writer = self.writer(FANOUT_FIRST)
+
+        async def scenario():
+            for i in range(120):
+                await writer.submit(self.message(str(i)))
+            await writer.drain()
+            self.assertEqual(writer._pending, [])
+
+        asyncio.run(scenario())
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('id').values_list('content', flat=True)),
+            [str(i) for i in range(120)],
+        )
+        self.room.refresh_from_db()
+        self.assertEqual(self.room.last_message_id, ChatMessage.objects.latest('id').id)
+
+    def test_persist_first_waits_for_commit(self):
+        writer = self.writer(PERSIST_FIRST, batch_size=10, flush_interval=0.01)
+
+        async def scenario():
+            await asyncio.gather(*(writer.submit(self.message(str(i))) for i in range(25)))
+
+        asyncio.run(scenario())
+        self.assertEqual(ChatMessage.objects.count(), 25)
+
+    def test_failed_batch_fails_its_waiters_only(self):
+        writer = self.writer(PERSIST_FIRST, batch_size=2)
+        persist = writer._persist
+        calls = []
+
+        async def failing_first_batch(messages):
+            calls.append(len(messages))
+            if len(calls) == 1:
+                raise RuntimeError('database unavailable')
+            await persist(messages)
+
+        async def scenario():
+            with mock.patch.object(writer, '_persist', failing_first_batch):
+                submits = [asyncio.ensure_future(writer.submit(self.message(str(i)))) for i in range(4)]
+                await writer.drain()
+                return await asyncio.gather(*submits, return_exceptions=True)
+
+        with self.assertLogs('modules.rooms.pipeline', 'ERROR'):
+            results = asyncio.run(scenario())
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertIsInstance(results[1], RuntimeError)
+        self.assertEqual([m.content for m in results[2:]], ['2', '3'])
+        self.assertEqual(calls, [2, 2])
+        self.assertEqual(ChatMessage.objects.count(), 2)
+
+    def test_fanout_first_retries_failed_batch(self):
+        writer = self.writer(FANOUT_FIRST, retries=3)
+        save_batch = ChatMessageRepository.save_batch
+        calls = []
+
+        def flaky_save_batch(*, messages):
+            calls.append(len(messages))
+            if len(calls) <= 2:
+                raise RuntimeError('database unavailable')
+            save_batch(messages=messages)
+
+        async def scenario():
+            for i in range(3):
+                await writer.submit(self.message(str(i)))
+            await writer.drain()
+
+        with mock.patch.object(ChatMessageRepository, 'save_batch', flaky_save_batch), \
+                self.assertLogs('modules.rooms.pipeline', 'WARNING') as logs:
+            asyncio.run(scenario())
+        self.assertEqual(calls, [3, 3, 3])
+        self.assertEqual(len(logs.records), 2)
+        self.assertEqual(writer.failed, 0)
+        self.assertEqual(ChatMessage.objects.count(), 3)
+
+    def test_fanout_first_batch_failing_every_retry_is_counted(self):
+        writer = self.writer(FANOUT_FIRST, batch_size=2, retries=1)
+        save_batch = ChatMessageRepository.save_batch
+
+        def failing_save_batch(*, messages):
+            if messages[0].content == '0':
+                raise RuntimeError('database unavailable')
+            save_batch(messages=messages)
+
+        async def scenario():
+            messages = [self.message(str(i)) for i in range(4)]
+            for message in messages:
+                await writer.submit(message)
+            await writer.drain()
+            return messages
+
+        with mock.patch.object(ChatMessageRepository, 'save_batch', failing_save_batch), \
+                self.assertLogs('modules.rooms.pipeline', 'WARNING') as logs:
+            messages = asyncio.run(scenario())
+        self.assertEqual(writer.failed, 2)
+        self.assertEqual(logs.records[-1].levelname, 'ERROR')
+        self.assertIn(str(messages[0].id), logs.records[-1].getMessage())
+        self.assertEqual(
+            list(ChatMessage.objects.order_by('id').values_list('content', flat=True)), ['2', '3']
+        )
@@ -0,0 +1,87 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+from django.conf import settings
+
+OnTimeout = Callable[[], Awaitable[None]]
+
+
+class _TypingState:
+    __slots__ = ('last_sent', 'deadline', 'on_timeout', 'timer')
+
+    def __init__(self, last_sent: float, deadline: float, on_timeout: OnTimeout) -> None:
+        self.last_sent = last_sent
+        self.deadline = deadline
+        self.on_timeout = on_timeout
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class TypingTracker:
+    """
+    Responsável por limitar os eventos de digitação por (usuário, sala) no
+    processo: no máximo um 'typing' a cada `throttle` segundos e um
+    'stop_typing' automático após `timeout` segundos sem novas teclas.
+    Eventos redundantes (ex.: 'stop_typing' sem 'typing' ativo) são descartados
+    sem passar pelo channel layer.
+    """
+
+    def __init__(self, *, throttle: float, timeout: float) -> None:
+        self.throttle = throttle
+        self.timeout = timeout
+        self._states: Dict[Hashable, _TypingState] = {}
+
+    def typing(self, key: Hashable, on_timeout: OnTimeout) -> bool:
+        """
+        Registra uma tecla e retorna se o evento 'typing' deve ser enviado.
+        """
+        now = time.monotonic()
+        state = self._states.get(key)
+
+        if state is None:
+            state = _TypingState(now, now + self.timeout, on_timeout)
+            state.timer = asyncio.get_running_loop().call_later(
+                self.timeout, self._expire, key
+            )
+            self._states[key] = state
+            return True
+
+        # Apenas adia o prazo; o timer é reagendado quando expirar.
+        state.deadline = now + self.timeout
+        state.on_timeout = on_timeout
+        if now - state.last_sent >= self.throttle:
+            state.last_sent = now
+            return True
+        return False
+
+    def stop(self, key: Hashable) -> bool:
+        """
+        Encerra a digitação e retorna se o evento 'stop_typing' deve ser enviado.
+        """
+        state = self._states.pop(key, None)
+        if state is None:
+            return False
+        if state.timer is not None:
+            state.timer.cancel()
+        return True
+
+    def _expire(self, key: Hashable) -> None:
+        state = self._states.get(key)
+        if state is None:
+            return
+
+        remaining = state.deadline - time.monotonic()
+        if remaining > 0:
+            state.timer = asyncio.get_running_loop().call_later(
+                remaining, self._expire, key
+            )
+            return
+
+        del self._states[key]
+        asyncio.ensure_future(state.on_timeout())
+
+
+typing_tracker = TypingTracker(
+    throttle=settings.CHAT_TYPING_THROTTLE,
+    timeout=settings.CHAT_TYPING_TIMEOUT,
+)
@@ -5,7 +5,15 @@ from ninja_extra.ordering import ordering
 from core.main.schemas import CustomOrdering, CustomPagination, PaginatedResponseSchema
 from core.utils.changes import Controller
 from .services import UserService
-from .schemas import UserFilterSchema, UserMinimalSchema, UserOutSchema, UserPostSchema, UserPutSchema
+from .schemas import (
+    PresenceOutSchema,
+    PresenceQuerySchema,
+    UserFilterSchema,
+    UserMinimalSchema,
+    UserOutSchema,
+    UserPostSchema,
+    UserPutSchema,
+)
 from core.main.schemas import ErrorResponse
 from core.utils.choices import SUCCESS_STATUSES, ERROR_STATUSES, NO_CONTENT_STATUSES
 from django.db.models.query import QuerySet
@@ -32,20 +40,43 @@ class UserController(Controller):
         }
     )
     
-    @paginate(CustomPagination)
+    @paginate(CustomPagination, count_mode='estimated')
     @ordering(
         CustomOrdering,
         ordering_fields=[
             'id', 
             'username', 
-            'first_name', 
-            'last_name'
+            'name'
             ],
     )
     
     def list(self, filters: UserFilterSchema = Query(...)) -> QuerySet[Any]:
         return self.service.list(filters=filters)
     
+    @route.post(
+        '/presence',
+        summary='Presença de usuários',
+        response={
+            SUCCESS_STATUSES: List[PresenceOutSchema],
+            ERROR_STATUSES: ErrorResponse,
+        }
+    )
+    
+    def presence(self, request, payload: PresenceQuerySchema) -> Tuple[Any, ...]:
+        return self.service.presence(ids=payload.ids)
+    
+    @route.get(
+        '/search',
+        summary='Buscar usuários (autocompletar)',
+        response={
+            SUCCESS_STATUSES: List[UserMinimalSchema],
+            ERROR_STATUSES: ErrorResponse,
+        }
+    )
+    
+    def search(self, request, q: str, limit: int = 10) -> Tuple[Any, ...]:
+        return self.service.search(q=q, limit=limit)
+    
     @route.get(
         '/{id}',
         summary='Obter usuário',
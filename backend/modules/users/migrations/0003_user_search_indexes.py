@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# PostgreSQL: índices de trigramas (pg_trgm) para a busca por similaridade de
+# UserRepository.similar, sobre as mesmas expressões UPPER(campo) usadas nas
+# consultas. Nos demais bancos a busca fica só no prefixo, servido pelos
+# índices funcionais da 0002_user_ordering_indexes.
+POSTGRESQL_FORWARD = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    """
+    CREATE INDEX IF NOT EXISTS user_username_trgm_idx
+    ON users_user USING GIN (UPPER(username) gin_trgm_ops)
+    """,
+    """
+    CREATE INDEX IF NOT EXISTS user_name_trgm_idx
+    ON users_user USING GIN (UPPER(name) gin_trgm_ops)
+    """,
+]
+POSTGRESQL_REVERSE = [
+    'DROP INDEX IF EXISTS user_name_trgm_idx',
+    'DROP INDEX IF EXISTS user_username_trgm_idx',
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for sql in statements:
+                schema_editor.execute(sql)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0002_user_ordering_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(POSTGRESQL_FORWARD), run(POSTGRESQL_REVERSE)),
+    ]
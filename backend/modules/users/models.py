@@ -2,6 +2,7 @@ from django.contrib.auth.models import Group, Permission
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
 from django.db import models
 from core.main.models import AbstractBaseModel
+from core.utils.model_utils import ordering_indexes
 from django.contrib.auth.models import BaseUserManager
 
 class UserManager(BaseUserManager):
@@ -52,5 +53,9 @@ class User(AbstractBaseModel, AbstractBaseUser, PermissionsMixin):
         related_name="modified_users"
     )
 
+    class Meta:
+        # Ordenação de UserController.list (ver CustomOrdering).
+        indexes = ordering_indexes(prefix='user', fields=['username', 'name'])
+
     def __str__(self):
         return self.username
\ No newline at end of file
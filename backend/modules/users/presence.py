@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Iterable, Optional, Set, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+Presence = Tuple[bool, Optional[int]]
+
+
+class PresenceTracker:
+    """
+    Responsável pela presença (online / visto por último) dos usuários.
+
+    O estado do processo fica em memória (conexões abertas e último sinal de
+    vida por usuário) e é gravado no cache padrão em lotes (`set_many`) a
+    cada `flush_interval` segundos, apenas para os usuários que mudaram.
+    Cada entrada no cache é o par (online, visto por último em segundos
+    Unix). Enquanto o usuário estiver conectado, o processo regrava a entrada
+    a cada `online_ttl / 3` segundos; uma entrada "online" mais velha que
+    `online_ttl` é lida como offline, o que cobre processos que caíram sem
+    registrar a desconexão.
+
+    Com vários processos, o cache guarda também quantos processos têm
+    conexões do usuário (`presence:connections:<id>`, com INCR/DECR na
+    primeira conexão e na última desconexão de cada processo). A última
+    desconexão de um processo só grava "offline" quando nenhum outro processo
+    tem conexões do usuário. Se um processo cai sem descontar, a contagem
+    fica alta, mas a entrada "online" deixa de ser regravada e vence em
+    `online_ttl`. Conexões mortas são detectadas pelos pings do servidor
+    ASGI, que disparam o `disconnect` do consumer.
+
+    Falhas do cache na leitura (`get_many`) não interrompem a consulta: vale
+    o estado em memória deste processo e os demais usuários aparecem offline.
+    """
+
+    key_prefix = 'presence'
+
+    def __init__(self, *, flush_interval: float, online_ttl: float, last_seen_ttl: int) -> None:
+        self.flush_interval = flush_interval
+        self.online_ttl = online_ttl
+        self.last_seen_ttl = last_seen_ttl
+        self._connections: Dict[int, int] = {}
+        self._last_seen: Dict[int, float] = {}
+        self._written: Dict[int, float] = {}
+        self._dirty: Set[int] = set()
+        # Variação ainda não gravada no cache da contagem de processos com
+        # conexões do usuário (+1 na primeira conexão, -1 na última desconexão).
+        self._deltas: Dict[int, int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def key(self, user_id: int) -> str:
+        return f'{self.key_prefix}:{user_id}'
+
+    def connections_key(self, user_id: int) -> str:
+        return f'{self.key_prefix}:connections:{user_id}'
+
+    def _ensure_flusher(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run())
+
+    def connect(self, user_id: int) -> None:
+        count = self._connections.get(user_id, 0) + 1
+        self._connections[user_id] = count
+        self._last_seen[user_id] = time.time()
+        if count == 1:
+            self._deltas[user_id] = self._deltas.get(user_id, 0) + 1
+            self._dirty.add(user_id)
+        self._ensure_flusher()
+
+    def disconnect(self, user_id: int) -> None:
+        count = self._connections.get(user_id, 0) - 1
+        self._last_seen[user_id] = time.time()
+        if count > 0:
+            self._connections[user_id] = count
+            return
+        self._drop(user_id)
+
+    def _drop(self, user_id: int) -> None:
+        if self._connections.pop(user_id, None) is not None:
+            self._deltas[user_id] = self._deltas.get(user_id, 0) - 1
+        self._written.pop(user_id, None)
+        self._dirty.add(user_id)
+
+    def heartbeat(self, user_id: int) -> None:
+        if user_id in self._connections:
+            self._last_seen[user_id] = time.time()
+
+    async def _other_processes(self, user_id: int, delta: int) -> int:
+        """
+        Aplica a variação deste processo na contagem compartilhada e retorna
+        quantos processos ainda têm conexões do usuário.
+        """
+        key = self.connections_key(user_id)
+        try:
+            if not delta:
+                return await cache.aget(key, 0)
+            await cache.aadd(key, 0, timeout=None)
+            count = await cache.aincr(key, delta)
+            if count < 0:
+                await cache.aset(key, 0, timeout=None)
+            return count
+        except Exception:
+            logger.warning('Failed to update the connection count of user %s', user_id, exc_info=True)
+            return 0
+
+    def _collect(self, connected_elsewhere: Set[int]) -> Dict[str, Presence]:
+        now = time.time()
+        refresh_after = self.online_ttl / 3
+        for user_id in self._connections:
+            if now - self._written.get(user_id, 0) >= refresh_after:
+                self._dirty.add(user_id)
+
+        entries = {}
+        for user_id in self._dirty:
+            online = user_id in self._connections
+            if online:
+                self._written[user_id] = now
+                entries[self.key(user_id)] = (True, int(now))
+            else:
+                last_seen = int(self._last_seen.pop(user_id, now))
+                if user_id not in connected_elsewhere:
+                    entries[self.key(user_id)] = (False, last_seen)
+        self._dirty.clear()
+        return entries
+
+    async def flush(self) -> None:
+        deltas, self._deltas = self._deltas, {}
+        connected_elsewhere = set()
+        for user_id in self._dirty | set(deltas):
+            delta = deltas.get(user_id, 0)
+            if user_id in self._connections:
+                if delta:
+                    await self._other_processes(user_id, delta)
+            elif await self._other_processes(user_id, delta) > 0:
+                connected_elsewhere.add(user_id)
+
+        entries = self._collect(connected_elsewhere)
+        if entries:
+            await cache.aset_many(entries, timeout=self.last_seen_ttl)
+
+    async def shutdown(self) -> None:
+        """
+        Marca como offline os usuários conectados a este processo.
+        """
+        for user_id in list(self._connections):
+            self._last_seen[user_id] = time.time()
+            self._drop(user_id)
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception('Failed to flush presence')
+
+    def get_many(self, user_ids: Iterable[int]) -> Dict[int, Presence]:
+        """
+        Retorna a presença dos usuários em uma única leitura do cache,
+        priorizando o estado em memória deste processo.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        try:
+            stored = cache.get_many([self.key(user_id) for user_id in user_ids])
+        except Exception:
+            logger.warning('Failed to read presence from the cache', exc_info=True)
+            stored = {}
+        now = time.time()
+
+        result = {}
+        for user_id in user_ids:
+            if user_id in self._connections:
+                result[user_id] = (True, int(self._last_seen.get(user_id, now)))
+                continue
+            if user_id in self._last_seen:
+                result[user_id] = (False, int(self._last_seen[user_id]))
+                continue
+            online, last_seen = stored.get(self.key(user_id), (False, None))
+            if online and now - last_seen >= self.online_ttl:
+                online = False
+            result[user_id] = (online, last_seen)
+        return result
+
+
+presence = PresenceTracker(
+    flush_interval=settings.CHAT_PRESENCE['FLUSH_INTERVAL'],
+    online_ttl=settings.CHAT_PRESENCE['ONLINE_TTL'],
+    last_seen_ttl=settings.CHAT_PRESENCE['LAST_SEEN_TTL'],
+)
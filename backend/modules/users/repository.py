@@ -1,11 +1,14 @@
 # Repository
 
-from typing import Dict
+import sys
+from typing import Dict, Iterable, List
 from core.utils import omitted_fields
 from core.utils.changes import Repository
 from.models import User
+from django.apps import apps
 from django.contrib.auth.hashers import make_password
-from django.db import models
+from django.db import connection, models
+from django.db.models.functions import Upper
 class UserRepository(Repository):
     
     model = User
@@ -29,6 +32,112 @@ class UserRepository(Repository):
             updated_payload['password'] = cls.hash_password(updated_payload['password'])
             
         return updated_payload
-    
-    
-    
\ No newline at end of file
+
+    @staticmethod
+    def upper_key(term: str) -> str:
+        """
+        Converte `term` em maiúsculas como o UPPER() do banco: no SQLite só as
+        letras ASCII mudam (João -> JOãO); nos demais, as letras que têm uma
+        única maiúscula (o Python converteria ß em SS).
+        """
+        if connection.vendor == 'sqlite':
+            return ''.join(char.upper() if char.isascii() else char for char in term)
+        return ''.join(
+            upper if len(upper := char.upper()) == 1 else char for char in term
+        )
+
+    @classmethod
+    def prefix(cls, *, term: str, limit: int, exclude_ids: Iterable[int] = ()) -> List[Dict]:
+        """
+        Retorna os usuários ativos cujo username ou nome começa com `term`, sem
+        diferenciar maiúsculas. O prefixo vira uma faixa em UPPER(campo), servida
+        pelos índices funcionais de ordenação (user_username_upper_idx e
+        user_name_upper_idx); o LIKE apenas confirma o prefixo.
+
+        No SQLite, letras fora do ASCII precisam coincidir também na caixa
+        ("joã" encontra "João", mas "JOÃ" não).
+        """
+        start = cls.upper_key(term)
+        bounds = {'key__gte': start, 'key__startswith': start}
+        if ord(start[-1]) < sys.maxunicode:
+            bounds['key__lt'] = start[:-1] + chr(ord(start[-1]) + 1)
+        results: List[Dict] = []
+        seen = set(exclude_ids)
+        for field in ('username', 'name'):
+            rows = (
+                cls.model.objects
+                .filter(is_active=True)
+                .alias(key=Upper(field))
+                .filter(**bounds)
+                .exclude(id__in=seen)
+                .order_by('key', 'id')
+                .values('id', 'username', 'email')[:limit - len(results)]
+            )
+            for row in rows:
+                seen.add(row['id'])
+                results.append(row)
+            if len(results) >= limit:
+                break
+        return results
+
+    @classmethod
+    def similar(cls, *, term: str, limit: int, exclude_ids: Iterable[int] = ()) -> List[Dict]:
+        """
+        Retorna os usuários ativos com username ou nome parecido com `term`
+        (similaridade de trigramas do pg_trgm, índices user_*_trgm_idx), do mais
+        para o menos parecido. Disponível apenas no PostgreSQL; nos demais
+        bancos retorna uma lista vazia.
+        """
+        if connection.vendor != 'postgresql':
+            return []
+
+        term = cls.upper_key(term)
+        exclude_ids = list(exclude_ids) or [0]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT id, username, email
+                FROM users_user
+                WHERE is_active
+                    AND (UPPER(username) %% %s OR UPPER(name) %% %s)
+                    AND NOT (id = ANY(%s))
+                ORDER BY GREATEST(
+                    similarity(UPPER(username), %s),
+                    similarity(UPPER(name), %s)
+                ) DESC, id
+                LIMIT %s
+                """,
+                [term, term, exclude_ids, term, term, limit],
+            )
+            return [
+                {'id': row[0], 'username': row[1], 'email': row[2]}
+                for row in cursor.fetchall()
+            ]
+
+    # Participações lidas por usuário pedido em `most_active`.
+    MOST_ACTIVE_SCAN_FACTOR = 4
+
+    @classmethod
+    def most_active(cls, *, limit: int) -> List[Dict]:
+        """
+        Retorna até `limit` usuários ativos com conversas mais recentes.
+
+        Lê apenas as `limit * MOST_ACTIVE_SCAN_FACTOR` participações mais
+        recentes (índice roommember_activity_idx), em vez de agrupar todas as
+        participações de todos os usuários; usuários que só aparecem depois
+        disso ficam de fora.
+        """
+        RoomMembership = apps.get_model('rooms', 'RoomMembership')
+        user_ids = list(dict.fromkeys(
+            RoomMembership.objects
+            .filter(last_activity__isnull=False)
+            .order_by('-last_activity')
+            .values_list('user_id', flat=True)[:limit * cls.MOST_ACTIVE_SCAN_FACTOR]
+        ))
+        users = {
+            user['id']: user
+            for user in cls.model.objects
+            .filter(id__in=user_ids, is_active=True)
+            .values('id', 'username', 'email', 'name')
+        }
+        return [users[user_id] for user_id in user_ids if user_id in users][:limit]
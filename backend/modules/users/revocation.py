@@ -0,0 +1,55 @@
+"""
+Responsável por revogar a autenticação das conexões websocket.
+
+A autenticação do websocket é verificada uma única vez, no handshake
+(core.asgi.JWTAuthMiddleware). Depois disso, cada conexão autenticada fica no
+grupo `user_<id>` e é fechada quando recebe o evento `user_revoked`, enviado
+quando o usuário é desativado ou removido, ou quando um token é colocado na
+blacklist (neste caso apenas as conexões abertas com aquele token).
+"""
+
+from typing import Optional
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from core.utils.cache import TTLCache
+
+# Usuários autenticados no handshake, chaveados por (user_id, jti).
+ws_users = TTLCache(
+    maxsize=settings.CHAT_WS_USER_CACHE_SIZE,
+    ttl=settings.CHAT_WS_USER_CACHE_TTL,
+)
+
+
+def user_group(user_id: int) -> str:
+    return f'user_{user_id}'
+
+
+def forget(user_id: int, jti: Optional[str] = None) -> None:
+    """
+    Remove do cache do handshake as entradas do usuário (ou só a do token).
+    """
+    ws_users.pop_where(
+        lambda key: str(key[0]) == str(user_id) and (jti is None or key[1] == jti)
+    )
+
+
+def revoke(user_id: int, jti: Optional[str] = None) -> None:
+    """
+    Invalida o cache deste processo e, após o commit, avisa as conexões do
+    usuário em todos os processos, que também invalidam o cache local.
+    """
+    forget(user_id, jti)
+    transaction.on_commit(lambda: _broadcast(user_id, jti))
+
+
+def _broadcast(user_id: int, jti: Optional[str]) -> None:
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        user_group(user_id),
+        {'type': 'user_revoked', 'user_id': user_id, 'jti': jti},
+    )
@@ -1,6 +1,6 @@
 from datetime import datetime
 from enum import Enum
-from typing import Optional
+from typing import List, Optional
 from ninja import Schema, Field, FilterSchema
 
 # Schemas User 
@@ -33,4 +33,11 @@ class UserMinimalSchema(Schema):
     id: int
     username: str = Field(..., alias="username", title="Nome de usuário")
     email: str = Field(..., alias="email", title="Email")
-    
\ No newline at end of file
+    
+class PresenceQuerySchema(Schema):
+    ids: List[int] = Field(..., title="IDs dos usuários")
+
+class PresenceOutSchema(Schema):
+    id: int
+    online: bool = Field(..., title="Online")
+    last_seen: Optional[datetime] = Field(None, title="Visto por último")
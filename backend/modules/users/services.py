@@ -1,11 +1,16 @@
 # Services
 
-from typing import Any, Dict, Optional, Tuple
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+from django.conf import settings
 from core.utils.changes import Services
 from .repository import UserRepository
 from ninja_extra import status
 from core.utils.regex.regex_character import special_characters_pattern, email_pattern
+from django.db import IntegrityError, transaction
 from django.db.models import Model
+from .presence import presence
+from .typeahead import user_typeahead
 
 class UserService(Services):
     
@@ -92,4 +97,85 @@ class UserService(Services):
                         'message': 'Senha deve conter ao menos um caracter especial.'
                     }
                     
-        return status.HTTP_200_OK, user
\ No newline at end of file
+        return status.HTTP_200_OK, user
+
+    @classmethod
+    def disable(cls, *, id: int, last_user_id: int) -> Tuple[int, Any]:
+        """
+        Desativa o usuário. O post_save do usuário inativo revoga, após o
+        commit, as conexões websocket abertas dele (ver modules.users.signals).
+        """
+        try:
+            with transaction.atomic():
+                status_code, message_or_object = cls.get(id=id)
+                if status_code != status.HTTP_200_OK:
+                    return status_code, message_or_object
+
+                user: Model = message_or_object
+                if not user.is_active:
+                    return status.HTTP_400_BAD_REQUEST, {
+                        'message': 'Usuário já está inativo.'
+                    }
+
+                user = cls.repository.put(
+                    instance=user, payload={'is_active': False}, last_user_id=last_user_id
+                )
+                return status.HTTP_200_OK, user
+
+        except IntegrityError as error:
+            return status.HTTP_500_INTERNAL_SERVER_ERROR, {"message": str(error)}
+
+    @classmethod
+    def presence(cls, *, ids: List[int]) -> Tuple[int, Any]:
+        """
+        Retorna a presença de vários usuários com uma única leitura do cache.
+        """
+        if len(ids) > settings.CHAT_PRESENCE['MAX_IDS']:
+            return status.HTTP_400_BAD_REQUEST, {
+                'message': f"Máximo de {settings.CHAT_PRESENCE['MAX_IDS']} ids por consulta."
+            }
+
+        return status.HTTP_200_OK, [
+            {
+                'id': user_id,
+                'online': online,
+                'last_seen': (
+                    datetime.fromtimestamp(last_seen, tz=timezone.utc)
+                    if last_seen is not None else None
+                ),
+            }
+            for user_id, (online, last_seen) in presence.get_many(ids).items()
+        ]
+
+    @classmethod
+    def search(cls, *, q: str, limit: int) -> Tuple[int, Any]:
+        """
+        Busca de usuários ativos para autocompletar: primeiro na trie em memória
+        dos usuários mais ativos, depois por prefixo no banco e, se ainda faltar,
+        por similaridade (PostgreSQL).
+        """
+        term = q.strip()
+        if not term:
+            return status.HTTP_400_BAD_REQUEST, {
+                'message': 'Informe ao menos um caractere.'
+            }
+        if len(term) > settings.USER_SEARCH['MAX_QUERY_LENGTH']:
+            return status.HTTP_400_BAD_REQUEST, {
+                'message': f"Máximo de {settings.USER_SEARCH['MAX_QUERY_LENGTH']} caracteres."
+            }
+        limit = min(max(limit, 1), settings.USER_SEARCH['MAX_LIMIT'])
+
+        results = user_typeahead.search(term, limit)
+        if len(results) < limit:
+            results += cls.repository.prefix(
+                term=term,
+                limit=limit - len(results),
+                exclude_ids=[user['id'] for user in results],
+            )
+        if len(results) < limit:
+            results += cls.repository.similar(
+                term=term,
+                limit=limit - len(results),
+                exclude_ids=[user['id'] for user in results],
+            )
+        return status.HTTP_200_OK, results
@@ -0,0 +1,32 @@
+from django.apps import apps
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from .models import User
+from .revocation import revoke
+from .typeahead import user_typeahead
+
+
+@receiver(post_save, sender=User)
+def revoke_inactive_user(sender, instance, **kwargs):
+    if not instance.is_active:
+        revoke(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted_user(sender, instance, **kwargs):
+    revoke(instance.id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_typeahead(sender, instance, **kwargs):
+    user_typeahead.invalidate()
+
+
+if apps.is_installed('ninja_jwt.token_blacklist'):
+    from ninja_jwt.token_blacklist.models import BlacklistedToken
+
+    @receiver(post_save, sender=BlacklistedToken)
+    def revoke_blacklisted_token(sender, instance, created, **kwargs):
+        if created and instance.token.user_id is not None:
+            revoke(instance.token.user_id, jti=instance.token.jti)
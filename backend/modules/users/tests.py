@@ -1 +1,240 @@
-from django.test import TestCase
+import asyncio
+import threading
+from datetime import timedelta
+from unittest import mock
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+from ninja_extra import status
+from core.layers import HybridChannelLayer
+from modules.rooms.consumer import REVOKED_CLOSE_CODE
+from modules.rooms.models import ChatRoom, RoomMembership
+from modules.rooms.router import websocket_urlpatterns
+from modules.users.models import User
+from modules.users.presence import PresenceTracker
+from modules.users.repository import UserRepository
+from modules.users.services import UserService
+from modules.users.typeahead import user_typeahead
+
+# Camada híbrida com a InMemoryChannelLayer no lugar do Redis: outros
+# "processos" são outras HybridChannelLayer sobre a mesma camada remota.
+HYBRID_CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': 'core.layers.HybridChannelLayer',
+        'CONFIG': {'remote': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    },
+}
+
+LOCMEM_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def create_user(username):
+    return User.objects.create_user(username, f'{username}@gmail.com', 'senha', name=username)
+
+
+@override_settings(CHANNEL_LAYERS=HYBRID_CHANNEL_LAYERS)
+class UserDisableTests(TransactionTestCase):
+
+    def test_disable_from_another_process_closes_user_sockets(self):
+        ana, bruno, admin = create_user('ana'), create_user('bruno'), create_user('admin')
+
+        async def scenario():
+            socket = WebsocketCommunicator(
+                URLRouter(websocket_urlpatterns), f'/ws/chat/{ana.id}_{bruno.id}/'
+            )
+            socket.scope['user'] = ana
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            await socket.receive_json_from()
+
+            # Processo sem nenhum membro no grupo user_<id> (ex.: o admin).
+            other_process = HybridChannelLayer(remote=get_channel_layer().remote)
+            with mock.patch('modules.users.revocation.get_channel_layer', return_value=other_process):
+                status_code, _ = await database_sync_to_async(UserService.disable)(
+                    id=ana.id, last_user_id=admin.id
+                )
+            self.assertEqual(status_code, status.HTTP_200_OK)
+            self.assertEqual(
+                await socket.receive_output(1),
+                {'type': 'websocket.close', 'code': REVOKED_CLOSE_CODE},
+            )
+
+        asyncio.run(scenario())
+        ana.refresh_from_db()
+        self.assertFalse(ana.is_active)
+
+    def test_disable_rejects_missing_or_inactive_user(self):
+        admin = create_user('admin')
+        status_code, _ = UserService.disable(id=admin.id + 1000, last_user_id=admin.id)
+        self.assertEqual(status_code, status.HTTP_404_NOT_FOUND)
+
+        inactive = create_user('inativo')
+        inactive.is_active = False
+        inactive.save()
+        status_code, response = UserService.disable(id=inactive.id, last_user_id=admin.id)
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response, {'message': 'Usuário já está inativo.'})
+
+
+class UserSearchTests(TestCase):
+
+    def setUp(self):
+        self.joao = User.objects.create_user('jsilva', 'j@gmail.com', 'senha', name='João Silva')
+        self.maria = User.objects.create_user('maria', 'm@gmail.com', 'senha', name='Maria Souza')
+        self.add_activity(self.joao, self.maria, minutes_ago=1)
+        user_typeahead.rebuild()
+
+    @staticmethod
+    def add_activity(user, other, *, minutes_ago):
+        room = ChatRoom.objects.create(user1=user, user2=other)
+        RoomMembership.objects.filter(room=room).update(
+            last_activity=timezone.now() - timedelta(minutes=minutes_ago)
+        )
+
+    def usernames(self, q, limit=10):
+        status_code, results = UserService.search(q=q, limit=limit)
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        return [user['username'] for user in results]
+
+    def test_prefix_matches_accented_names(self):
+        self.assertEqual(
+            [row['username'] for row in UserRepository.prefix(term='joã', limit=10)],
+            ['jsilva'],
+        )
+        self.assertEqual(
+            [row['username'] for row in UserRepository.prefix(term='MAR', limit=10)],
+            ['maria'],
+        )
+
+    def test_prefix_with_last_code_point(self):
+        self.assertEqual(UserRepository.prefix(term='a\U0010ffff', limit=10), [])
+
+    def test_trie_and_database_results_are_merged(self):
+        self.assertEqual(self.usernames('silva'), ['jsilva'])
+        self.assertEqual(self.usernames('JOÃO'), ['jsilva'])
+
+    def test_users_created_elsewhere_are_found_before_trie_rebuild(self):
+        self.assertEqual(self.usernames('ma'), ['maria'])
+        # Criado em outro processo: a trie deste não é invalidada.
+        with mock.patch.object(user_typeahead, 'invalidate'):
+            User.objects.create_user('marcos', 'mc@gmail.com', 'senha', name='Marcos')
+        self.assertEqual(self.usernames('ma'), ['maria', 'marcos'])
+
+    def test_most_active_orders_by_recent_activity_and_caps_the_scan(self):
+        carla, inactive = create_user('carla'), create_user('inativo')
+        inactive.is_active = False
+        inactive.save()
+        self.add_activity(carla, inactive, minutes_ago=0)
+
+        with self.assertNumQueries(2):
+            users = UserRepository.most_active(limit=10)
+        self.assertEqual([user['username'] for user in users], ['carla', 'jsilva', 'maria'])
+
+        # Só as 2 participações mais recentes (carla e inativo) são lidas.
+        with mock.patch.object(UserRepository, 'MOST_ACTIVE_SCAN_FACTOR', 1):
+            self.assertEqual(
+                [user['username'] for user in UserRepository.most_active(limit=2)], ['carla']
+            )
+
+    def test_stale_trie_is_served_while_rebuilding_in_background(self):
+        started, release = threading.Event(), threading.Event()
+        calls = []
+
+        def slow_rebuild():
+            calls.append(threading.current_thread().name)
+            started.set()
+            release.wait(5)
+
+        user_typeahead.invalidate()
+        with mock.patch.object(user_typeahead, 'rebuild', slow_rebuild):
+            self.assertEqual(user_typeahead.search('silva', 10), [
+                {'id': self.joao.id, 'username': 'jsilva', 'email': 'j@gmail.com'},
+            ])
+            self.assertTrue(started.wait(1))
+            user_typeahead.search('silva', 10)
+            release.set()
+        self.assertEqual(calls, ['user-typeahead'])
+
+    def test_blank_query_is_rejected(self):
+        status_code, _ = UserService.search(q='  ', limit=10)
+        self.assertEqual(status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CACHES=LOCMEM_CACHES)
+class PresenceTests(SimpleTestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    @staticmethod
+    def tracker():
+        return PresenceTracker(flush_interval=60, online_ttl=90, last_seen_ttl=3600)
+
+    def test_last_disconnect_in_one_process_keeps_user_online_elsewhere(self):
+        first, second, reader = self.tracker(), self.tracker(), self.tracker()
+
+        async def scenario():
+            first.connect(1)
+            first.connect(1)
+            second.connect(1)
+            await first.flush()
+            await second.flush()
+
+            first.disconnect(1)
+            await first.flush()
+            self.assertTrue(reader.get_many([1])[1][0])
+            first.disconnect(1)
+            await first.flush()
+            self.assertTrue(reader.get_many([1])[1][0])
+
+            second.disconnect(1)
+            await second.flush()
+            online, last_seen = reader.get_many([1])[1]
+            self.assertFalse(online)
+            self.assertIsNotNone(last_seen)
+            self.assertEqual(cache.get(first.connections_key(1)), 0)
+
+        asyncio.run(scenario())
+
+    def test_connect_and_disconnect_between_flushes(self):
+        first, second, reader = self.tracker(), self.tracker(), self.tracker()
+
+        async def scenario():
+            first.connect(1)
+            await first.flush()
+            second.connect(1)
+            second.disconnect(1)
+            await second.flush()
+            self.assertTrue(reader.get_many([1])[1][0])
+
+            await first.shutdown()
+            self.assertFalse(reader.get_many([1])[1][0])
+
+        asyncio.run(scenario())
+
+    def test_stale_online_entry_reads_as_offline(self):
+        tracker = self.tracker()
+        cache.set(tracker.key(1), (True, 1000))
+        self.assertEqual(tracker.get_many([1, 2]), {1: (False, 1000), 2: (False, None)})
+
+    def test_cache_failure_falls_back_to_local_state(self):
+        tracker = self.tracker()
+
+        async def connect():
+            tracker.connect(1)
+
+        asyncio.run(connect())
+        with mock.patch('modules.users.presence.cache') as broken_cache, \
+                mock.patch('modules.users.services.presence', tracker), \
+                self.assertLogs('modules.users.presence', 'WARNING'):
+            broken_cache.get_many.side_effect = ConnectionError('cache down')
+            status_code, results = UserService.presence(ids=[1, 2])
+        self.assertEqual(status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['id'], row['online']) for row in results], [(1, True), (2, False)]
+        )
@@ -0,0 +1,129 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connections
+from .repository import UserRepository
+
+logger = logging.getLogger(__name__)
+
+
+class PrefixTrie:
+    """
+    Responsável por mapear prefixos para ids. Cada nó guarda os primeiros
+    `max_results` ids inseridos que passam por ele, então a busca custa apenas
+    o tamanho do prefixo. Os ids devem ser inseridos em ordem de relevância.
+    """
+
+    IDS = ''
+
+    def __init__(self, *, max_results: int) -> None:
+        self.max_results = max_results
+        self.root: Dict = {self.IDS: []}
+
+    def add(self, key: str, item_id: int) -> None:
+        node = self.root
+        for char in key:
+            node = node.setdefault(char, {self.IDS: []})
+            ids = node[self.IDS]
+            if len(ids) < self.max_results and item_id not in ids:
+                ids.append(item_id)
+
+    def find(self, prefix: str) -> List[int]:
+        node = self.root
+        for char in prefix:
+            node = node.get(char)
+            if node is None:
+                return []
+        return node[self.IDS]
+
+
+class UserTypeahead:
+    """
+    Responsável pela busca de usuários por prefixo em memória (typeahead).
+
+    Mantém em uma PrefixTrie os `size` usuários ativos com conversas mais
+    recentes, indexados pelo username, pelo nome e por cada palavra do nome,
+    sem diferenciar maiúsculas. A trie é reconstruída a cada `ttl` segundos,
+    ou na busca seguinte a uma alteração de usuário (`invalidate`).
+
+    A reconstrução roda em uma thread, fora da requisição: enquanto isso as
+    buscas usam a trie anterior (ou nenhuma, logo após a inicialização, e os
+    resultados vêm só do banco).
+
+    A trie é local ao processo e `invalidate` só vale para o processo que
+    alterou o usuário: nos demais, nomes alterados e usuários desativados
+    continuam na trie por até `ttl` segundos. Ela apenas antecipa resultados;
+    os usuários novos vêm sempre da busca no banco (UserService.search).
+    """
+
+    def __init__(self, *, size: int, ttl: float, max_results: int) -> None:
+        self.size = size
+        self.ttl = ttl
+        self.max_results = max_results
+        self._index: Optional[Tuple[PrefixTrie, Dict[int, Dict]]] = None
+        self._built_at = 0.0
+        self._generation = 0
+        self._refreshing = False
+        self._lock = threading.Lock()
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._built_at = 0.0
+
+    def refresh(self) -> None:
+        """
+        Inicia a reconstrução em segundo plano, se nenhuma estiver em andamento.
+        """
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='user-typeahead', daemon=True).start()
+
+    def _refresh(self) -> None:
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Failed to rebuild the user typeahead')
+            # Tenta de novo só depois de `ttl`, mantendo a trie anterior.
+            self._built_at = time.monotonic()
+        finally:
+            self._refreshing = False
+            connections.close_all()
+
+    def rebuild(self) -> None:
+        generation = self._generation
+        trie = PrefixTrie(max_results=self.max_results)
+        users = {}
+        for user in UserRepository.most_active(limit=self.size):
+            users[user['id']] = {
+                'id': user['id'],
+                'username': user['username'],
+                'email': user['email'],
+            }
+            name = (user['name'] or '').upper()
+            for key in (user['username'].upper(), name, *name.split()[1:]):
+                trie.add(key, user['id'])
+        with self._lock:
+            self._index = (trie, users)
+            # Uma alteração durante a reconstrução pede outra.
+            self._built_at = time.monotonic() if generation == self._generation else 0.0
+
+    def search(self, term: str, limit: int) -> List[Dict]:
+        if time.monotonic() - self._built_at >= self.ttl:
+            self.refresh()
+        if self._index is None:
+            return []
+        trie, users = self._index
+        return [users[user_id] for user_id in trie.find(term.upper())[:limit]]
+
+
+user_typeahead = UserTypeahead(
+    size=settings.USER_SEARCH['TRIE_SIZE'],
+    ttl=settings.USER_SEARCH['TRIE_TTL'],
+    max_results=settings.USER_SEARCH['MAX_LIMIT'],
+)
@@ -31,8 +31,8 @@ const ChatPage: React.FC = () => {
 
                 if (user) {
                     setChatUser(user);
-                    const msgs = await chatService.getMessages(user.id.toString());
-                    setMessages(msgs);
+                    const page = await chatService.getMessages(user.id.toString());
+                    setMessages(page.results);
                 } else {
                     toast.error("Usuário não encontrado");
                     navigate("/");
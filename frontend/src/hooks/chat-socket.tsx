@@ -1,7 +1,7 @@
 
 'use client';
 
-import { chatService, userService } from '@/services/api';
+import { authService, chatService, userService } from '@/services/api';
 import React, { useEffect, useState, useRef, use } from 'react';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
@@ -27,6 +27,9 @@ interface Message {
 
 const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
     const [messages, setMessages] = useState<Message[]>([]);
+    // Cursor da página anterior do histórico (null quando não há mais).
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingOlder, setLoadingOlder] = useState(false);
     const [newMessage, setNewMessage] = useState('');
     const [typingUsers, setTypingUsers] = useState<string[]>([]);
     const [showScrollButton, setShowScrollButton] = useState(false);
@@ -61,6 +64,27 @@ const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
     const getRoomName = (id1: number, id2: number) =>
         id1 < id2 ? `${id1}_${id2}` : `${id2}_${id1}`;
 
+    const formatMessage = (msg: any): Message => ({
+        id: msg.id,
+        content: msg.message || msg.content,
+        username: msg.username ?? msg.sender?.username,
+        senderId: msg.sender.id === currentUser.id ? currentUserId : otherUserId,
+        timestamp: msg.timestamp,
+        read: msg.read,
+    });
+
+    const loadOlderMessages = async () => {
+        if (!nextCursor || loadingOlder) return;
+        setLoadingOlder(true);
+        try {
+            const page = await chatService.getMessages(getRoomName(currentUserId, otherUserId), nextCursor);
+            setMessages((prev) => [...page.results.map(formatMessage), ...prev]);
+            setNextCursor(page.has_more ? page.next_cursor : null);
+        } finally {
+            setLoadingOlder(false);
+        }
+    };
+
     useEffect(() => {
         const fetchUser = async () => {
             try {
@@ -79,7 +103,7 @@ const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
     useEffect(() => {
         const roomName = getRoomName(currentUserId, otherUserId);
         const wsProtocol = window.location.protocol === 'https:' ? 'wss' : 'ws';
-        const wsUrl = `${wsProtocol}://127.0.0.1:8000/ws/chat/${roomName}/?user_id=${currentUser?.id}`;
+        const wsUrl = `${wsProtocol}://127.0.0.1:8000/ws/chat/${roomName}/?token=${encodeURIComponent(authService.getToken() ?? '')}`;
 
         // Use MockWebSocket for development, real WebSocket for production
         try {
@@ -92,18 +116,10 @@ const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
         ws.current.onopen = () => {
             console.log('WebSocket conectado na sala', roomName);
             // Carrega mensagens anteriores via API REST
-            chatService.getMessages(roomName).then((initialMessages) => {
-                // Transforme mensagens no formato esperado
-                console.log("Mensagens antigas:", initialMessages);
-                const formatted = initialMessages.map((msg: any) => ({
-                    id: msg.id,
-                    content: msg.message || msg.content,
-                    username: msg.username,
-                    senderId: msg.sender.id === currentUser.id ? currentUserId : otherUserId,
-                    timestamp: msg.timestamp,
-                    read: msg.read,
-                }));
-                setMessages(formatted);
+            chatService.getMessages(roomName).then((page) => {
+                console.log("Mensagens antigas:", page.results);
+                setMessages(page.results.map(formatMessage));
+                setNextCursor(page.has_more ? page.next_cursor : null);
             });
         };
 
@@ -159,13 +175,16 @@ const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
                 ws.current = null;
             }
             setMessages([]);
+            setNextCursor(null);
         };
     }, [currentUserId, otherUserId]);
 
-    // Auto scroll para o fim da lista sempre que messages mudarem
+    // Auto scroll para o fim da lista quando chega uma mensagem nova
+    // (carregar o histórico anterior não muda a última).
+    const lastMessageId = messages[messages.length - 1]?.id;
     useEffect(() => {
         messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
-    }, [messages]);
+    }, [lastMessageId]);
 
     // Add scroll event listener to show/hide scroll button
     useEffect(() => {
@@ -244,6 +263,13 @@ const Chat: React.FC<ChatProps> = ({ currentUserId, otherUserId }) => {
                 ref={chatContainerRef}
                 className="flex-1 p-4 overflow-y-auto space-y-4 bg-muted/20"
             >
+                {nextCursor && (
+                    <div className="flex justify-center">
+                        <Button variant="ghost" size="sm" onClick={loadOlderMessages} disabled={loadingOlder}>
+                            {loadingOlder ? 'Carregando...' : 'Carregar mensagens anteriores'}
+                        </Button>
+                    </div>
+                )}
                 {messages.map((msg) => (
                     <ChatBubble
                         key={msg.id}
@@ -21,6 +21,14 @@ export interface Message {
     read: boolean;
 }
 
+// Página do histórico (GET chat/messages), em ordem cronológica. Com
+// `has_more`, a página anterior vem de getMessages(room_name, next_cursor).
+export interface MessagePage {
+    results: Message[];
+    has_more: boolean;
+    next_cursor: string | null;
+}
+
 export interface LoginResponse {
     token: string;
     user: User;
@@ -143,19 +151,53 @@ export const userService = {
             toast.error("Erro ao carregar usuário: " + (error as Error).message);
             throw error;
         }
+    },
+
+    // Presença (online / visto por último) de vários usuários em uma chamada
+    getPresence: async (userIds: number[]): Promise<{ id: number; online: boolean; last_seen: string | null }[]> => {
+        const token = authService.getToken();
+        if (!token) throw new Error("Token não encontrado");
+
+        const response = await fetch(`${API_URL}/api/user/presence`, {
+            method: 'POST',
+            headers: {
+                'Authorization': `Bearer ${token}`,
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ ids: userIds }),
+        });
+
+        if (!response.ok) throw new Error('Falha ao obter presença');
+
+        return await response.json();
+    },
+
+    // Autocompletar: usuários cujo username ou nome começa com `query`
+    searchUsers: async (query: string, limit = 10): Promise<{ id: number; username: string; email: string }[]> => {
+        const token = authService.getToken();
+        if (!token) throw new Error("Token não encontrado");
+
+        const params = new URLSearchParams({ q: query, limit: String(limit) });
+        const response = await fetch(`${API_URL}/api/user/search?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+
+        if (!response.ok) throw new Error('Falha ao buscar usuários');
+        return await response.json();
     }
 
 };
 
 // Serviço de mensagens
 export const chatService = {
-    getMessages: async (room_name: string): Promise<Message[]> => {
+    getMessages: async (room_name: string, before?: string | null): Promise<MessagePage> => {
         try {
             const token = authService.getToken();
             if (!token) throw new Error("Usuário não autenticado");
 
-            // Sua API deve aceitar o room_name para buscar as mensagens
-            const response = await fetch(`${API_URL}/api/chat/messages?room_name=${room_name}`, {
+            const params = new URLSearchParams({ room_name });
+            if (before) params.set('before', before);
+            const response = await fetch(`${API_URL}/api/chat/messages?${params}`, {
                 headers: { 'Authorization': `Bearer ${token}` }
             });
 
@@ -189,4 +231,20 @@ export const chatService = {
             throw error;
         }
     },
+
+    // Busca nas mensagens das salas do usuário; `highlight` vem em HTML já escapado, com <mark>
+    searchMessages: async (query: string, offset = 0, room_name?: string) => {
+        const token = authService.getToken();
+        if (!token) throw new Error("Usuário não autenticado");
+
+        const params = new URLSearchParams({ q: query, offset: String(offset) });
+        if (room_name) params.set('room_name', room_name);
+
+        const response = await fetch(`${API_URL}/api/chat/search?${params}`, {
+            headers: { 'Authorization': `Bearer ${token}` }
+        });
+
+        if (!response.ok) throw new Error('Falha ao buscar mensagens');
+        return await response.json();
+    },
 };
\ No newline at end of file